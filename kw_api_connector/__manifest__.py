@@ -8,10 +8,11 @@
     'category': 'Extra Tools',
     'license': 'LGPL-3',
 
-    'version': '18.0.0.4.2',
+    'version': '18.0.0.20.0',
 
     'depends': [
         'kw_http_request_log',
+        'kw_mixin',
     ],
 
     'external_dependencies': {
@@ -20,6 +21,11 @@
 
     'data': [
         'security/ir.model.access.csv',
+
+        'data/ir_cron.xml',
+
+        'views/outbox_views.xml',
+        'views/rate_limit_views.xml',
     ],
     'demo': [
     ],
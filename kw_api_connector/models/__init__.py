@@ -1,4 +1,7 @@
 from . import (
     connector,
     credential,
+    http_request_log,
+    outbox,
+    rate_limit,
 )
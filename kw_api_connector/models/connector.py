@@ -2,6 +2,9 @@ import logging
 
 from odoo import models, fields
 
+from ..tools import (
+    drop_circuit, drop_sessions, is_circuit_open, record_circuit_result, )
+
 _logger = logging.getLogger(__name__)
 
 
@@ -19,3 +22,126 @@ class ApiConnector(models.AbstractModel):
         string='Use token', readonly=True, )
     is_api_token_static = fields.Boolean(
         string='Static token', readonly=True, )
+    api_retry_max = fields.Integer(
+        string='Retries',
+        help='Number of retries of requests that failed with connection '
+             'error or retryable status code, 0 disables retries.')
+    api_retry_backoff = fields.Float(
+        default=0.5,
+        string='Retry backoff',
+        help='Base delay in seconds between retries, it is doubled on each '
+             'retry and randomized.')
+    api_retry_backoff_max = fields.Float(
+        default=30,
+        string='Maximum retry delay',
+        help='Maximum delay in seconds between retries. Requests are not '
+             'retried if the API asks to wait longer with Retry-After.')
+    api_retry_status_codes = fields.Char(
+        default='429,500,502,503,504',
+        string='Retry status codes',
+        help='Comma separated status codes of responses that are retried.')
+    is_api_retry_non_idempotent = fields.Boolean(
+        string='Retry non-idempotent requests',
+        help='Retry POST and PATCH requests without Idempotency-Key header.')
+    api_circuit_threshold = fields.Integer(
+        string='Circuit breaker threshold',
+        help='Number of consecutive failed requests after which requests '
+             'to the API fail without being sent, 0 disables the circuit '
+             'breaker.')
+    api_circuit_reset_timeout = fields.Integer(
+        default=60,
+        string='Circuit breaker timeout',
+        help='Seconds during which requests fail without being sent once '
+             'the circuit breaker is open.')
+    api_rate_limit = fields.Float(
+        string='Rate limit',
+        help='Maximum number of requests per second, 0 disables the rate '
+             'limiter.')
+    api_rate_burst = fields.Integer(
+        string='Rate limit burst',
+        help='Number of requests that may be sent at once after a pause, '
+             'the rate limit if not set.')
+    api_rate_limit_scope = fields.Selection(
+        selection=[('credential', 'Credential'),
+                   ('connector', 'Connector'), ],
+        default='credential', required=True,
+        string='Rate limit scope',
+        help='Whether the rate limit is shared by requests of each '
+             'credential or by all credentials of the connector.')
+    api_rate_limit_backend = fields.Selection(
+        selection=[('postgresql', 'PostgreSQL'),
+                   ('local', 'Worker'), ],
+        default='postgresql', required=True,
+        string='Rate limit backend',
+        help='PostgreSQL shares the rate limit between all workers, Worker '
+             'limits requests of each worker separately without queries.')
+    api_rate_limit_timeout = fields.Float(
+        default=30,
+        string='Rate limit timeout',
+        help='Requests that would wait for the rate limiter longer than '
+             'this number of seconds fail.')
+    api_circuit_failures = fields.Integer(
+        default=0, readonly=True, copy=False,
+        string='Consecutive failures', )
+    api_circuit_open_until = fields.Datetime(
+        readonly=True, copy=False,
+        string='Circuit open until', )
+
+    def write(self, vals):
+        if 'api_url' in vals:
+            drop_sessions(self.env.cr.dbname, base_urls=set(
+                self.filtered('api_url').mapped('api_url')))
+        res = super().write(vals)
+        circuit_fields = {'api_circuit_failures', 'api_circuit_open_until'}
+        if set(vals) - circuit_fields:
+            # settings of credentials include their connectors
+            self.env.registry.clear_cache()
+        if circuit_fields & set(vals):
+            # e.g. circuit is closed manually, workers read it from the
+            # database
+            self.flush_recordset(list(circuit_fields))
+            for obj in self:
+                drop_circuit(obj._get_api_circuit_key())
+        return res
+
+    def _get_api_retry_status_codes(self):
+        self.ensure_one()
+        return {int(x) for x in (self.api_retry_status_codes or '').split(',')
+                if x.strip().isdigit()}
+
+    def _get_api_circuit_key(self):
+        return self.env.cr.dbname, self._name, self.id
+
+    def _get_api_circuit_settings(self):
+        self.ensure_one()
+        return {
+            'circuit_threshold': self.api_circuit_threshold,
+            'circuit_reset_timeout': self.api_circuit_reset_timeout,
+            'connector_name': self.name, }
+
+    def is_api_circuit_open(self, settings=None):
+        """ Requests to the API should fail without being sent
+
+            :param settings: cached settings of the credential, the
+                connector is not read if they are given
+        """
+        self.ensure_one()
+        settings = settings or self._get_api_circuit_settings()
+        if not settings['circuit_threshold']:
+            return False
+        return is_circuit_open(self._get_api_circuit_key(), self._table)
+
+    def _record_api_result(self, success, settings=None):
+        """ Update circuit breaker state shared by workers
+
+            :param settings: cached settings of the credential, the
+                connector is not read if they are given
+        """
+        self.ensure_one()
+        settings = settings or self._get_api_circuit_settings()
+        record_circuit_result(
+            self._get_api_circuit_key(), self._table, success,
+            settings['circuit_threshold'], settings['circuit_reset_timeout'],
+            settings['connector_name'])
+        self.invalidate_recordset(
+            ['api_circuit_failures', 'api_circuit_open_until'])
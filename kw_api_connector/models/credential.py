@@ -1,14 +1,52 @@
 import json
 import logging
 import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta, timezone
 
 import requests
 from html2text import html2text
+from psycopg2 import errors
 
-from odoo import models, fields, exceptions, _
+from odoo import api, models, fields, exceptions, tools, _
+from odoo.tools import SQL
+
+from odoo.addons.kw_mixin.tools import get_hook
+
+from ..tools import (
+    ApiCircuitOpenError, ApiRateLimitError, ApiRequestError, BodyCapture,
+    capture_body, CAPTURE_SIZE, drop_sessions, drop_token, get_delays,
+    get_path, get_retry_delay, get_semaphore, get_session, get_timings,
+    get_token, is_circuit_open, is_idempotent, merge_headers,
+    PAGINATION_DEFAULTS, parse_retry_after, PendingLog, prepare_body,
+    rate_limit, record_circuit_result, reset_connect_time, response_cache,
+    set_token, StreamResponse, StreamSample, STREAM_MODES, UPLOAD_MODES, )
 
 _logger = logging.getLogger(__name__)
 
+API_SESSION_FIELDS = {
+    'active', 'api_connector_id', 'api_pool_size', 'api_concurrency',
+    'is_api_keep_alive', 'api_connect_retries', }
+
+API_CACHE_FIELDS = {
+    'is_api_cache_enabled', 'api_cache_ttl', 'api_cache_size',
+    'api_connector_id', }
+
+# headers that do not change the response of the API
+API_CACHE_IGNORED_HEADERS = {
+    'authorization', 'if-none-match', 'if-modified-since', }
+
+API_TOKEN_FIELDS = {'api_token', 'api_token_expire_date', }
+
+# requests failed with these errors may succeed if they are sent later
+API_TRANSIENT_ERRORS = (
+    requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+    ApiCircuitOpenError, ApiRateLimitError, )
+
+# how long a worker waits for the token refreshed by another worker
+API_TOKEN_LOCK_TIMEOUT = 30
+
 
 class ApiCredential(models.AbstractModel):
     _name = 'kw.api.credential'
@@ -28,129 +66,1098 @@ class ApiCredential(models.AbstractModel):
         comodel_name='kw.api.connector', required=True, )
     code = fields.Char(
         related='api_connector_id.name', string='Code', )
+    api_pool_size = fields.Integer(
+        default=10,
+        string='Connection pool size',
+        help='Maximum number of connections to the API kept open by each '
+             'worker.')
+    is_api_keep_alive = fields.Boolean(
+        default=True,
+        string='Keep-alive',
+        help='Reuse connections to the API between requests.')
+    api_concurrency = fields.Integer(
+        default=4,
+        string='Concurrent requests',
+        help='Maximum number of requests sent at the same time by each '
+             'worker in batch requests.')
+    api_connect_retries = fields.Integer(
+        string='Connection retries',
+        help='Number of retries of requests that failed to connect to '
+             'the API.')
+    is_api_cache_enabled = fields.Boolean(
+        string='Cache responses',
+        help='Cache responses of GET requests in memory of each worker.')
+    api_cache_ttl = fields.Integer(
+        default=300,
+        string='Cache TTL, s',
+        help='Cached responses are served without requests to the API for '
+             'this number of seconds, then they are revalidated with ETag '
+             'and Last-Modified headers.')
+    api_cache_size = fields.Integer(
+        default=256,
+        string='Cache size',
+        help='Maximum number of responses cached by each worker.')
+    api_cache_hits = fields.Integer(
+        compute='_compute_api_cache_stats',
+        string='Cache hits',
+        help='Requests served from the cache of this worker.')
+    api_cache_misses = fields.Integer(
+        compute='_compute_api_cache_stats',
+        string='Cache misses',
+        help='Cacheable requests of this worker sent to the API.')
+    is_api_compress_request = fields.Boolean(
+        string='Compress requests',
+        help='Send request bodies compressed with gzip, the API must accept '
+             'Content-Encoding: gzip.')
+    api_compress_min_size = fields.Integer(
+        default=1024,
+        string='Compression threshold, bytes',
+        help='Smaller JSON bodies are sent uncompressed.')
+    api_capture_size = fields.Integer(
+        default=CAPTURE_SIZE,
+        string='Captured response size, bytes',
+        help='Only this head of error and non-JSON responses is logged and '
+             'parsed, the rest of streamed response is not read. Responses '
+             'of requests that are not streamed are downloaded in full '
+             'before the head is captured. Binary bodies are not logged.')
+    api_token = fields.Char(
+        copy=False,
+        help='Access token, fetched by the fetch_api_token_<code> hook '
+             'unless the connector uses static token.')
+    api_token_expire_date = fields.Datetime(
+        copy=False,
+        string='Token expires at',
+        help='Empty if the token does not expire.')
+    api_token_refresh_margin = fields.Integer(
+        default=60,
+        string='Token refresh margin',
+        help='Token is refreshed this number of seconds before it expires.')
+
+    def write(self, vals):
+        res = super().write(vals)
+        if set(vals) - API_TOKEN_FIELDS:
+            # token is not part of the cached settings
+            self.env.registry.clear_cache()
+        if API_SESSION_FIELDS & set(vals):
+            self._drop_api_sessions()
+        if API_CACHE_FIELDS & set(vals):
+            for obj in self:
+                response_cache.drop_entries(obj._get_api_cache_owner())
+        if API_TOKEN_FIELDS & set(vals):
+            for obj in self:
+                drop_token(obj._get_api_token_key())
+        return res
+
+    @api.model
+    @tools.ormcache('credential_id')
+    def _get_api_settings(self, credential_id):
+        """ Settings of the credential and its connector cached per
+            process, so requests do not read related records, the cache is
+            cleared on every change of credentials, connectors and log
+            sources
+
+            :return: frozendict of field values or None if there is no
+                credential with given id
+        """
+        credential = self.sudo().with_context(active_test=False).browse(
+            credential_id).exists()
+        if not credential:
+            return None
+        connector = credential.api_connector_id
+        if connector.api_rate_limit_scope == 'connector':
+            rate_limit_key = f'{connector._name},{connector.id}'
+        else:
+            rate_limit_key = f'{credential._name},{credential.id}'
+        return tools.frozendict({
+            'id': credential.id,
+            'dbname': self.env.cr.dbname,
+            'code': connector.name,
+            'api_url': connector.api_url or '',
+            'log_source_id': credential.kw_http_request_log_source_id.id,
+            'pool_size': max(
+                credential.api_pool_size, credential.api_concurrency, 1),
+            'concurrency': credential.api_concurrency,
+            'connect_retries': credential.api_connect_retries,
+            'is_keep_alive': credential.is_api_keep_alive,
+            'is_cache_enabled': credential.is_api_cache_enabled,
+            'cache_ttl': credential.api_cache_ttl,
+            'cache_size': credential.api_cache_size,
+            'is_compress_request': credential.is_api_compress_request,
+            'compress_min_size': credential.api_compress_min_size,
+            'capture_size': credential.api_capture_size or CAPTURE_SIZE,
+            'connector_model': connector._name,
+            'connector_id': connector.id,
+            'connector_table': connector._table,
+            'connector_name': connector.name,
+            'is_token_used': connector.is_api_token_used,
+            'is_token_static': connector.is_api_token_static,
+            'token_refresh_margin': credential.api_token_refresh_margin,
+            'circuit_threshold': connector.api_circuit_threshold,
+            'circuit_reset_timeout': connector.api_circuit_reset_timeout,
+            'retry_max': connector.api_retry_max,
+            'retry_backoff': connector.api_retry_backoff,
+            'retry_backoff_max': connector.api_retry_backoff_max,
+            'retry_status_codes': frozenset(
+                connector._get_api_retry_status_codes()),
+            'is_retry_non_idempotent':
+                connector.is_api_retry_non_idempotent,
+            'rate_limit': connector.api_rate_limit,
+            'rate_burst': connector.api_rate_burst,
+            'rate_limit_scope': connector.api_rate_limit_scope,
+            'rate_limit_key': rate_limit_key,
+            'rate_limit_backend': connector.api_rate_limit_backend,
+            'rate_limit_timeout': connector.api_rate_limit_timeout,
+        })
+
+    def get_api_settings(self):
+        self.ensure_one()
+        return self._get_api_settings(self.id)
+
+    def _get_api_hook(self, name):
+        return get_hook(self, name, self.get_api_settings()['code'])
+
+    def _get_api_log_source(self):
+        return self.env['kw.http.request.log.source'].sudo().browse(
+            self.get_api_settings()['log_source_id'])
+
+    def _compute_api_cache_stats(self):
+        for obj in self:
+            obj.api_cache_hits, obj.api_cache_misses = \
+                response_cache.get_stats(obj._get_api_cache_owner())
+
+    def _get_api_session(self):
+        """ HTTP session shared by requests of the credential within the
+            worker, request headers are passed per request and are not
+            stored in the session
+        """
+        settings = self.get_api_settings()
+        return get_session(
+            (self.env.cr.dbname, self._name, self.id, settings['api_url']),
+            pool_size=settings['pool_size'],
+            max_retries=settings['connect_retries'],
+            keep_alive=settings['is_keep_alive'])
+
+    def _drop_api_sessions(self):
+        drop_sessions(self.env.cr.dbname, model=self._name, ids=self.ids)
 
     def get_api_url(self, ext=''):
         self.ensure_one()
-        fname = f'get_api_url_{self.code}'
-        if hasattr(self, fname):
-            return getattr(self, fname)(ext)
+        hook = self._get_api_hook('get_api_url')
+        if hook is not None:
+            return hook(self, ext)
+        if ext.startswith(('http://', 'https://')):
+            # e.g. next page link returned by the API
+            return ext
         return os.path.join(
-            self.api_connector_id.api_url.strip('/'), ext.strip('/'))
+            self.get_api_settings()['api_url'].strip('/'), ext.strip('/'))
 
     def get_api_headers(self, **kw):
         self.ensure_one()
-        fname = f'get_api_headers_{self.code}'
-        if hasattr(self, fname):
-            return getattr(self, fname)(**kw)
-        return {'Content-Type': 'application/json',
-                'Accept': 'application/json', }
+        hook = self._get_api_hook('get_api_headers')
+        if hook is not None:
+            return hook(self, **kw)
+        headers = {'Content-Type': 'application/json',
+                   'Accept': 'application/json', }
+        token = self.get_api_token()
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        return headers
+
+    def _get_api_token_key(self):
+        return self.env.cr.dbname, self._name, self.id
+
+    def _is_api_token_valid(self, token, expire_date):
+        if not token:
+            return False
+        return not expire_date or expire_date - timedelta(
+            seconds=self.get_api_settings()['token_refresh_margin']
+        ) > fields.Datetime.now()
+
+    def _cache_api_token(self, token, expire_date):
+        set_token(
+            self._get_api_token_key(), token,
+            expire_date and expire_date.replace(
+                tzinfo=timezone.utc).timestamp())
+
+    def get_api_token(self, force=False):
+        """ Token to authorize requests to the API
+
+            Tokens are fetched by the fetch_api_token_<code> hook, which
+            returns dict with 'token' and optional 'expires_in' (seconds).
+            Token is cached by the worker and refreshed before it expires,
+            only one worker fetches the token at a time.
+
+            :param force: fetch new token even if the current one is valid
+            :return: token or False if the connector does not use tokens
+        """
+        self.ensure_one()
+        settings = self.get_api_settings()
+        if not settings['is_token_used']:
+            return False
+        if settings['is_token_static']:
+            return self.api_token or False
+        if self._get_api_hook('fetch_api_token') is None:
+            return False
+        key = self._get_api_token_key()
+        if force:
+            drop_token(key)
+        else:
+            token = get_token(key, settings['token_refresh_margin'])
+            if token:
+                return token
+            if self._is_api_token_valid(
+                    self.api_token, self.api_token_expire_date):
+                self._cache_api_token(
+                    self.api_token, self.api_token_expire_date)
+                return self.api_token
+        return self._refresh_api_token(force=force)
+
+    def _refresh_api_token(self, force=False):
+        lock_key = f'{self._name},{self.id}'
+        deadline = time.monotonic() + API_TOKEN_LOCK_TIMEOUT
+        while True:
+            with self.env.registry.cursor() as cr:
+                cr.execute(SQL(
+                    'SELECT pg_try_advisory_xact_lock(hashtext(%s))',
+                    lock_key))
+                if cr.fetchone()[0]:
+                    return self._fetch_api_token(cr, force=force)
+            if time.monotonic() > deadline:
+                raise exceptions.UserError(_(
+                    'Connector "%s": timeout while waiting for the API token '
+                    'refresh') % self.name)
+            # token fetched by another worker is read in the new
+            # transaction
+            force = False
+            time.sleep(0.1)
+
+    def _fetch_api_token(self, cr, force=False):
+        """ Fetch token while holding the lock, cr is the cursor of the
+            lock transaction
+        """
+        if not force:
+            cr.execute(SQL(
+                'SELECT api_token, api_token_expire_date FROM %s '
+                'WHERE id = %s', SQL.identifier(self._table), self.id))
+            token, expire_date = cr.fetchone()
+            if self._is_api_token_valid(token, expire_date):
+                self._cache_api_token(token, expire_date)
+                return token
+        res = self._get_api_hook('fetch_api_token')(self)
+        if not res or not res.get('token'):
+            return False
+        token = res['token']
+        expire_date = res.get('expires_in') and (
+            fields.Datetime.now() + timedelta(seconds=res['expires_in']))
+        # the row may be locked by the transaction of the caller, the token
+        # is kept in the worker cache only in such case
+        cr.execute(SQL("SET LOCAL lock_timeout = '5s'"))
+        try:
+            with cr.savepoint(flush=False):
+                cr.execute(SQL(
+                    'UPDATE %s SET api_token = %s, api_token_expire_date = %s '
+                    'WHERE id = %s', SQL.identifier(self._table), token,
+                    expire_date or None, self.id))
+        except errors.LockNotAvailable:
+            _logger.warning(
+                'API token of %s is not stored, the record is locked',
+                self)
+        self.invalidate_recordset(list(API_TOKEN_FIELDS))
+        self._cache_api_token(token, expire_date)
+        return token
+
+    def get_api_pagination(self):
+        """ Pagination settings used by api_paginate, see
+            PAGINATION_DEFAULTS
+        """
+        self.ensure_one()
+        hook = self._get_api_hook('get_api_pagination')
+        if hook is not None:
+            return dict(PAGINATION_DEFAULTS, **hook(self))
+        return dict(PAGINATION_DEFAULTS)
 
     def is_api_success(self, response):
         self.ensure_one()
-        fname = f'is_api_success_{self.code}'
-        if hasattr(self, fname):
-            return getattr(self, fname)(response)
+        hook = self._get_api_hook('is_api_success')
+        if hook is not None:
+            return hook(self, response)
         return 200 <= response.status_code < 300
 
     def parse_api_error(self, response, res=None, log=None, silent=True):
         self.ensure_one()
-        fname = f'parse_api_error_{self.code}'
-        if hasattr(self, fname):
-            return getattr(self, fname)(response, res=res, log=log,
-                                        silent=silent)
-        return {'message': response.text}
+        hook = self._get_api_hook('parse_api_error')
+        if hook is not None:
+            return hook(self, response, res=res, log=log, silent=silent)
+        return {'message': self._api_capture(response).text}
+
+    def _api_capture(self, response):
+        """ Head of the response body used for logging and error messages,
+            it is captured once per response
+        """
+        capture = getattr(response, 'kw_api_capture', None)
+        if not isinstance(capture, BodyCapture):
+            capture = response.kw_api_capture = capture_body(
+                response, self.get_api_settings()['capture_size'])
+        return capture
 
     def action_refresh_api_token(self):
         self.ensure_one()
-        fname = f'action_refresh_api_token_{self.code}'
-        if hasattr(self, fname):
-            return getattr(self, fname)()
+        hook = self._get_api_hook('action_refresh_api_token')
+        if hook is not None:
+            res = hook(self)
+            self._drop_api_sessions()
+            return res
+        if self._get_api_hook('fetch_api_token') is not None:
+            return bool(self.get_api_token(force=True))
         return False
 
-    # pylint: disable=too-many-branches,too-many-return-statements
+    def _prepare_api_log_vals(self, method, url, data=None, params=None,
+                              headers=None, body=True):
+        self.ensure_one()
+        vals = {
+            'name': self.get_api_url(url), 'method': method,
+            'headers': headers, 'params': json.dumps(params), }
+        if isinstance(data, StreamSample):
+            # encoded body is sampled at once, uploaded body is sampled
+            # while it is sent and logged afterwards
+            data = data.text if data.size else None
+        if body and data is not None:
+            vals['request_body'] = data
+        if self.env.context.get('kw_api_outbox_id'):
+            vals['api_outbox_id'] = self.env.context['kw_api_outbox_id']
+        return vals
+
+    def _api_log_start(self, request, pending=False):
+        """ Decide whether the request is logged and create its log
+
+            :param request: tuple (method, url, data, params, headers)
+            :param pending: keep the log in memory to be written by the
+                caller
+            :return: id of created log, PendingLog or False
+        """
+        self.ensure_one()
+        source = self._get_api_log_source()
+        settings = source.get_log_settings()
+        sampled = source.is_log_sampled()
+        body = not settings['is_log_body_on_error_only']
+        if pending:
+            return PendingLog(
+                self._prepare_api_log_vals(*request, body=body)
+                if sampled else {}, sampled=sampled)
+        if not sampled:
+            return False
+        vals = self._prepare_api_log_vals(*request, body=body)
+        if settings['is_log_deferred']:
+            # the row is written with the result of the request, or when
+            # the threshold is reached if the request lasts longer
+            log = PendingLog(vals, deferred=True)
+            log.start_timer(
+                settings['log_deferred_threshold'], self.env.cr.dbname,
+                self.env.uid, source.id)
+            return log
+        return source.create_log(vals)
+
+    def _api_log(self, log, request, vals, is_error=False, response=None):
+        """ Store result of API request in the log
+
+            :param log: log created by _api_log_start
+            :param request: tuple (method, url, data, params, headers)
+            :param vals: result values (code, response_body, error)
+            :param is_error: request failed or got non-2xx response
+            :param response: response which timings are logged
+        """
+        self.ensure_one()
+        timings = getattr(response, 'kw_api_timings', None)
+        if isinstance(timings, dict):
+            vals = dict(timings, **vals)
+        source = self._get_api_log_source()
+        if isinstance(request[2], StreamSample):
+            # only head and tail of the encoded body are logged
+            sample = request[2]
+            request = request[:2] + (sample.text, ) + request[3:]
+            if not vals.get('request_size'):
+                # size of streamed body is not known to requests
+                vals = dict(vals, request_size=sample.size)
+            if not source.get_log_settings()['is_log_body_on_error_only']:
+                vals['request_body'] = sample.text
+        sampled = log.sampled if isinstance(log, PendingLog) else bool(log)
+        if not sampled:
+            if not is_error or not source.is_log_sampled(is_error=True):
+                return False
+            vals = dict(self._prepare_api_log_vals(*request), **vals)
+        elif source.get_log_settings()['is_log_body_on_error_only']:
+            if is_error:
+                vals = dict(vals, request_body=request[2])
+            else:
+                vals = {k: v for k, v in vals.items()
+                        if k != 'response_body'}
+        if isinstance(log, PendingLog) and log.deferred:
+            log_id = log.finish()
+            if log_id:
+                return source.update_log(log_id, vals)
+            return source.create_log(dict(log.vals, **vals))
+        if isinstance(log, PendingLog):
+            log.vals.update(vals)
+            log.sampled = True
+            return True
+        if not sampled:
+            return source.create_log(vals)
+        return source.update_log(log, vals)
+
+    def _api_send(self, session, method, url, data=None, params=None,
+                  headers=None, stream=False, queued_at=None, body=None):
+        """ Send HTTP request, it does not use ORM and may be called
+            from other threads
+
+            :param queued_at: time.perf_counter() value when the request was
+                queued, e.g. before waiting for the rate limiter
+            :param body: body prepared by _prepare_api_body, data is sent
+                as JSON if it is not set
+            :return: response with timings of the request in kw_api_timings
+        """
+        kwargs = {'stream': True} if stream else {}
+        if body is not None:
+            kwargs['data'] = body
+            data = None
+        reset_connect_time()
+        start = time.perf_counter()
+        response = session.request(
+            method=method, url=url, json=data, allow_redirects=True,
+            params=params, headers=headers, timeout=60, **kwargs)
+        response.kw_api_timings = get_timings(
+            response, start, time.perf_counter(), queued_at)
+        return response
+
+    def _get_api_rate_limit_key(self):
+        return self.get_api_settings()['rate_limit_key']
+
+    def _api_throttle(self, count=1, settings=None):
+        """ Take tokens from the rate limiter of the connector before
+            sending requests
+
+            :param count: number of requests to send
+            :param settings: settings resolved by the caller, ORM is not
+                used if they are given
+            :return: list of delays in seconds before each request may be
+                sent
+        """
+        settings = settings or self.get_api_settings()
+        rate = settings['rate_limit']
+        if not rate or not count:
+            return [0] * count
+        capacity = settings['rate_burst'] or max(rate, 1)
+        key = settings['rate_limit_key']
+        timeout = settings['rate_limit_timeout']
+        if settings['rate_limit_backend'] == 'local':
+            available = rate_limit.reserve(
+                (settings['dbname'], key), rate, capacity, count, timeout)
+        else:
+            available = rate_limit.reserve_shared(
+                settings['dbname'], key, rate, capacity, count, timeout)
+        if available is None:
+            raise ApiRateLimitError(_(
+                'Rate limit of API "%s" is exceeded'
+            ) % settings['connector_name'])
+        return get_delays(available, count, rate)
+
+    def get_api_rate_limit_metrics(self):
+        """ Number of requests passed through the rate limiter, how many of
+            them were throttled and total wait time in seconds, worker
+            backend counts requests of the current worker only
+        """
+        self.ensure_one()
+        key = self._get_api_rate_limit_key()
+        if self.get_api_settings()['rate_limit_backend'] == 'local':
+            return rate_limit.get_metrics((self.env.cr.dbname, key))
+        bucket = self.env['kw.api.rate.limit'].sudo().search(
+            [('name', '=', key)], limit=1)
+        return {'requests': bucket.request_count,
+                'throttled': bucket.throttled_count,
+                'wait_time': bucket.wait_time}
+
+    def _api_send_with_retry(self, session, method, url, data=None,
+                             params=None, headers=None, stream=False,
+                             queued_at=None, body=None, throttled=False,
+                             settings=None):
+        """ Send HTTP request retrying connection errors and responses with
+            retryable status codes according to the retry policy of the
+            connector, fails fast while its circuit breaker is open.
+
+            :param throttled: the caller already waited for the rate limiter
+                before the first attempt, e.g. for the whole batch
+            :param settings: settings resolved by the caller, ORM is not
+                used if they are given, so the request may be sent from
+                other threads
+        """
+        settings = settings or self.get_api_settings()
+        circuit_key = (settings['dbname'], settings['connector_model'],
+                       settings['connector_id'])
+        threshold = settings['circuit_threshold']
+        if threshold and is_circuit_open(
+                circuit_key, settings['connector_table']):
+            raise ApiCircuitOpenError(_(
+                'API "%s" is unavailable, requests are suspended by the '
+                'circuit breaker') % settings['connector_name'])
+        retries = settings['retry_max']
+        if not settings['is_retry_non_idempotent'] \
+                and not is_idempotent(method, headers):
+            retries = 0
+        if body is not None and not isinstance(body, bytes):
+            # uploaded body is consumed by the first attempt
+            retries = 0
+        status_codes = settings['retry_status_codes']
+        attempt = 0
+        while True:
+            if attempt or not throttled:
+                time.sleep(self._api_throttle(settings=settings)[0])
+            response = error = None
+            try:
+                response = self._api_send(
+                    session, method, url, data=data, params=params,
+                    headers=headers, stream=stream, queued_at=queued_at,
+                    body=body)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                error = e
+            failed = error is not None or response.status_code in status_codes
+            record_circuit_result(
+                circuit_key, settings['connector_table'], not failed,
+                threshold, settings['circuit_reset_timeout'],
+                settings['connector_name'])
+            if not failed or attempt >= retries or threshold \
+                    and is_circuit_open(
+                        circuit_key, settings['connector_table']):
+                if error is not None:
+                    raise error
+                return response
+            delay = get_retry_delay(
+                attempt, settings['retry_backoff'],
+                settings['retry_backoff_max'])
+            if response is not None:
+                retry_after = parse_retry_after(
+                    response.headers.get('Retry-After'))
+                if retry_after is not None:
+                    if retry_after > settings['retry_backoff_max']:
+                        return response
+                    delay = retry_after
+                response.close()
+            _logger.info(
+                'Retry %s of %s %s in %.1f seconds: %s', attempt + 1, method,
+                url, delay, error or response.status_code)
+            time.sleep(delay)
+            attempt += 1
+
+    def _api_stream(self, response, log, request, mode):
+        """ Return iterator over body of successful streamed response, the
+            status is logged at once, head and tail of the body along with
+            its size and hash are logged when the iterator is closed
+        """
+        timings = getattr(response, 'kw_api_timings', None)
+        vals = dict(timings if isinstance(timings, dict) else {},
+                    code=response.status_code)
+        source = self._get_api_log_source()
+        if isinstance(log, PendingLog):
+            log_id = log.finish()
+            if log_id:
+                source.update_log(log_id, vals)
+            else:
+                log_id = source.create_log(dict(log.vals, **vals))
+            log = log_id
+        elif log:
+            source.update_log(log, vals)
+
+        def finish(stream):
+            sample = stream.sample
+            vals = {
+                'code': response.status_code,
+                'response_body': sample.text,
+                'response_size': sample.size,
+                'response_hash': sample.hexdigest, }
+            if isinstance(timings, dict):
+                vals['total_time'] = timings['total_time'] + (
+                    sample.read_time * 1000)
+            if stream.error is not None:
+                vals['error'] = stream.error
+            self._api_log(log, request, vals,
+                          is_error=stream.error is not None,
+                          response=response)
+
+        return StreamResponse(response, mode, finish)
+
     def api_request(self, method, url, data=None, params=None,
-                    headers=None, silent=True, renew_token=False):
+                    headers=None, silent=True, renew_token=False,
+                    stream=False, upload=False):
+        """ Send request to the API
+
+            :param stream: False to return parsed JSON response, or one of
+                'chunks' (same as True), 'jsonl' and 'json_array' to return
+                iterator over chunks of bytes, JSON lines or items of JSON
+                array of the response, the body is not kept in memory, the
+                iterator is closed once the body is read, otherwise it has
+                to be closed or used as context manager
+            :param upload: False to send data as JSON, 'jsonl' to send
+                iterable of records as JSON lines or 'chunks' to send
+                iterable of bytes, the body is sent with chunked transfer
+                encoding without keeping it in memory, the request is not
+                retried
+        """
         self.ensure_one()
-        fname = f'api_request_{self.code}'
-        if hasattr(self, fname):
-            return getattr(self, fname)(
-                method, url, data=None, params=None,
-                headers=None, silent=True, renew_token=False)
+        settings = self.get_api_settings()
+        hook = get_hook(self, 'api_request', settings['code'])
+        if hook is not None:
+            kwargs = {'stream': stream} if stream else {}
+            if upload:
+                kwargs['upload'] = upload
+            return hook(
+                self, method, url, data=data, params=params,
+                headers=headers, silent=silent, renew_token=renew_token,
+                **kwargs)
+        queued_at = time.perf_counter()
         if headers is None:
             headers = self.get_api_headers(renew_token=renew_token)
-        log = False
-        if self.is_log_enabled:
-            log = self.kw_http_request_log_source_id.sudo(
-            ).create_log({
-                'name': self.get_api_url(url), 'method': method,
-                'headers': headers, 'params': json.dumps(params),
-                'request_body': data, })
+        request = (method, url, data, params, headers)
+        if stream is True:
+            stream = 'chunks'
+        if stream and stream not in STREAM_MODES:
+            raise exceptions.UserError(_(
+                'Unknown stream mode "%s"') % stream)
+        if upload and upload not in UPLOAD_MODES:
+            raise exceptions.UserError(_(
+                'Unknown upload mode "%s"') % upload)
+        sample = StreamSample(data=None if upload else data) \
+            if upload or data is not None else None
+        body, body_headers = self._prepare_api_body(data, upload, sample)
+        if body_headers:
+            # type of uploaded body replaces the default JSON type
+            headers = merge_headers(
+                headers, body_headers, replace_type=bool(upload))
+            request = (method, url, sample or data, params, headers)
+        cache_key = entry = None
+        if settings['is_cache_enabled'] and not stream and not upload \
+                and method.upper() == 'GET':
+            cache_key = self._get_api_cache_key(url, params, headers)
+            entry = response_cache.get_entry(
+                self._get_api_cache_owner(), cache_key)
+            if entry is not None and entry.is_fresh:
+                return self._api_cache_hit(entry, request)
+            if entry is not None and entry.validators:
+                headers = dict(headers, **entry.validators)
+                request = request[:4] + (headers, )
+        log = self._api_log_start(request)
         try:
-            response = requests.request(
-                method=method, url=self.get_api_url(url), json=data,
-                allow_redirects=True,
-                params=params, headers=headers, timeout=60, )
+            response = self._api_send_with_retry(
+                self._get_api_session(), method, self.get_api_url(url),
+                data=data, params=params, headers=headers, stream=stream,
+                queued_at=queued_at, body=body)
         except Exception as e:
-            if self.is_log_enabled:
-                self.kw_http_request_log_source_id.update_log(
-                    log, {'error': e})
-            if not silent:
-                raise exceptions.ValidationError(_(
-                    'Connector "%(credential)s" connection error: "%(error)s"'
-                    '') % {'credential': self.name, 'error': e})
+            return self._api_process_exception(e, log, request, silent)
+        if stream and self.is_api_success(response):
+            return self._api_stream(response, log, request, stream)
+        if cache_key is not None:
+            return self._api_cache_response(
+                response, log, request, cache_key, entry, silent=silent,
+                renew_token=renew_token)
+        return self._api_process_response(
+            response, log, request, silent=silent, renew_token=renew_token,
+            stream=stream)
+
+    def api_enqueue(self, method, url, data=None, params=None, name=None,
+                    priority=10, max_attempts=5, idempotency_key=None):
+        """ Queue request to be sent in the background by the outbox cron
+
+            :return: kw.api.outbox record, its state and result are updated
+                once the request is sent
+        """
+        self.ensure_one()
+        return self.env['kw.api.outbox'].sudo().create({
+            'name': name or f'{method} {url}',
+            'credential_model': self._name,
+            'credential_id': self.id,
+            'method': method,
+            'url': url,
+            'data': data,
+            'params': params,
+            'priority': priority,
+            'max_attempts': max_attempts,
+            'idempotency_key': idempotency_key, })
+
+    def _prepare_api_body(self, data, upload=False, sample=None):
+        """ Encode body of the request, JSON bodies are encoded by the same
+            serializer whether they are compressed or not
+
+            :param sample: StreamSample updated with the encoded body, it is
+                logged instead of data
+            :return: tuple (body, headers), body is None if there is no data
+        """
+        self.ensure_one()
+        if data is None and not upload:
+            return None, {}
+        settings = self.get_api_settings()
+        return prepare_body(
+            data, upload=upload, compress=settings['is_compress_request'],
+            min_size=settings['compress_min_size'], sample=sample)
+
+    def _get_api_cache_owner(self):
+        return self.env.cr.dbname, self._name, self.id
+
+    def _get_api_cache_key(self, url, params, headers):
+        return (
+            self.get_api_url(url),
+            json.dumps(params, sort_keys=True, default=str),
+            tuple(sorted(
+                (k.lower(), str(v)) for k, v in (headers or {}).items()
+                if k.lower() not in API_CACHE_IGNORED_HEADERS)))
+
+    def _api_cache_hit(self, entry, request):
+        """ Return response served from the cache, hit is logged without
+            bodies if the log source allows it
+        """
+        response_cache.count(self._get_api_cache_owner(), True)
+        source = self._get_api_log_source()
+        if source.get_log_settings()['is_log_cache_hits'] \
+                and source.is_log_sampled():
+            source.create_log(dict(
+                self._prepare_api_log_vals(*request, body=False),
+                code=200, is_cache_hit=True))
+        return json.loads(entry.body)
+
+    def _api_cache_response(self, response, log, request, cache_key, entry,
+                            silent=True, renew_token=False):
+        owner = self._get_api_cache_owner()
+        settings = self.get_api_settings()
+        if entry is not None and response.status_code == 304:
+            # cached response is still valid
+            entry.expire_at = time.monotonic() + settings['cache_ttl']
+            response_cache.count(owner, True)
+            self._api_log(log, request, {
+                'code': response.status_code, 'is_cache_hit': True, },
+                response=response)
+            return json.loads(entry.body)
+        response_cache.count(owner, False)
+        res = self._api_process_response(
+            response, log, request, silent=silent, renew_token=renew_token)
+        if res is not False and self.is_api_success(response) \
+                and 'no-store' not in response.headers.get(
+                    'Cache-Control', ''):
+            response_cache.set_entry(
+                owner, cache_key, response_cache.CacheEntry(
+                    response.content, etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified'),
+                    ttl=settings['cache_ttl']),
+                settings['cache_size'])
+        return res
+
+    def api_request_many(self, requests_list, silent=True):
+        """ Send requests concurrently, they are retried and throttled as
+            requests sent by api_request
+
+            :param requests_list: list of tuples (method, url, data, params),
+                data and params are optional
+            :return: list of results in the order of requests_list, result
+                of each request is the same as of api_request
+        """
+        self.ensure_one()
+        settings = self.get_api_settings()
+        if self._get_api_hook('api_request') is not None:
+            # the hook sends requests one by one
+            return self._api_request_each(requests_list, silent)
+        headers = self.get_api_headers()
+        batch = [(tuple(r) + (None, None))[:4] for r in requests_list]
+        samples = [StreamSample(data=r[2]) if r[2] is not None else None
+                   for r in batch]
+        bodies = [self._prepare_api_body(r[2], sample=sample)
+                  for r, sample in zip(batch, samples)]
+        batch = [
+            (method, url, sample or data, params,
+             merge_headers(headers, body_headers) if body_headers
+             else headers)
+            for (method, url, data, params), sample, (__, body_headers)
+            in zip(batch, samples, bodies)]
+        logs = [self._api_log_start(request, pending=True)
+                for request in batch]
+        session = self._get_api_session()
+        semaphore = get_semaphore(
+            (self.env.cr.dbname, self._name, self.id),
+            settings['concurrency'] or 1)
+
+        try:
+            delays = self._api_throttle(len(batch))
+            throttle_error = None
+        except ApiRateLimitError as e:
+            delays = [0] * len(batch)
+            throttle_error = e
+        start = time.perf_counter()
+
+        def send(request, delay, body):
+            if throttle_error:
+                raise throttle_error
+            time.sleep(max(start + delay - time.perf_counter(), 0))
+            method, url, data, params, req_headers = request
+            with semaphore:
+                return self._api_send_with_retry(
+                    session, method, url, data=data, params=params,
+                    headers=req_headers, queued_at=start, body=body,
+                    throttled=True, settings=settings)
+
+        urls = [self.get_api_url(request[1]) for request in batch]
+        with ThreadPoolExecutor(
+                max_workers=max(min(settings['concurrency'], len(batch)), 1)
+        ) as executor:
+            futures = [
+                executor.submit(send, (r[0], u) + r[2:], delay, body)
+                for r, u, delay, (body, __) in zip(
+                    batch, urls, delays, bodies)]
+
+        results = []
+        error = None
+        for future, log, request in zip(futures, logs, batch):
+            try:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    results.append(self._api_process_exception(
+                        e, log, request, silent))
+                    continue
+                results.append(self._api_process_response(
+                    response, log, request, silent=silent))
+            except exceptions.ValidationError as e:
+                results.append(False)
+                error = error or e
+        self._get_api_log_source().create_logs(
+            [log.vals for log in logs if log.sampled])
+        if error:
+            raise error
+        return results
+
+    def _api_request_each(self, requests_list, silent=True):
+        results = []
+        error = None
+        for request in requests_list:
+            try:
+                results.append(self.api_request(*request, silent=silent))
+            except exceptions.ValidationError as e:
+                results.append(False)
+                error = error or e
+        if error:
+            raise error
+        return results
+
+    def api_paginate(self, method, url, data=None, params=None,
+                     silent=True, **kw):
+        """ Iterate over records of all pages of the API list endpoint
+
+            Only one page is kept in memory. With the prefetch setting, the
+            next page is requested in the background while the caller
+            processes records of the current one, otherwise it is
+            requested once they are processed.
+
+            :param kw: overrides of pagination settings returned by
+                get_api_pagination
+        """
+        self.ensure_one()
+        pagination = dict(self.get_api_pagination(), **kw)
+        strategy = pagination['strategy']
+        next_page = getattr(self, f'_api_next_page_{strategy}', None)
+        if next_page is None:
+            raise exceptions.UserError(_(
+                'Unknown pagination strategy "%s"') % strategy)
+        params = dict(params or {})
+        if pagination['size_param']:
+            params[pagination['size_param']] = pagination['page_size']
+        if strategy == 'page':
+            params[pagination['page_param']] = pagination['first_page']
+        elif strategy == 'offset':
+            params[pagination['offset_param']] = 0
+        return self._api_paginate(
+            (method, url, data, params, self.get_api_headers()),
+            pagination, next_page, silent)
+
+    def _api_paginate(self, request, pagination, next_page, silent):
+        session = self._get_api_session()
+        settings = self.get_api_settings()
+        prefetch = pagination['prefetch']
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+
+        def send(delay, *args, **kwargs):
+            time.sleep(delay)
+            return self._api_send_with_retry(
+                *args, throttled=True, settings=settings, **kwargs)
+
+        def prepare(req):
+            """ :return: tuple (request to log, encoded body) """
+            sample = StreamSample(data=req[2]) \
+                if req[2] is not None else None
+            body, body_headers = self._prepare_api_body(
+                req[2], sample=sample)
+            return (req[0], req[1], sample or req[2], req[3],
+                    merge_headers(req[4], body_headers) if body_headers
+                    else req[4]), body
+
+        def submit(req):
+            """ Send the request in the background if pages are
+                prefetched, otherwise at once
+
+                :return: tuple (request to log, log, future of response)
+            """
+            logged, body = prepare(req)
+            log = self._api_log_start(logged)
+            future = Future()
+            try:
+                delay = self._api_throttle(settings=settings)[0]
+                args = (delay, session, req[0], self.get_api_url(req[1]))
+                kwargs = {'params': req[3], 'headers': logged[4],
+                          'queued_at': time.perf_counter(), 'body': body}
+                if executor is not None:
+                    return logged, log, executor.submit(send, *args, **kwargs)
+                future.set_result(send(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return logged, log, future
+
+        def close(prefetched):
+            if not prefetched.exception():
+                prefetched.result().close()
+
+        logged, log, future = submit(request)
+        try:
+            while future:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    self._api_process_exception(e, log, logged, silent)
+                    return
+                future = None
+                res = self._api_process_response(
+                    response, log, logged, silent=silent)
+                if res is False:
+                    return
+                items = get_path(res, pagination['items_key']) or []
+                next_request = items and next_page(
+                    pagination, request, response, res, items)
+                if next_request and prefetch:
+                    request = next_request
+                    logged, log, future = submit(request)
+                yield from items
+                if next_request and not prefetch:
+                    request = next_request
+                    logged, log, future = submit(request)
+        finally:
+            if future and not future.cancel():
+                # prefetched page is not needed if the caller stopped
+                # iterating, its request is finished before the generator
+                # is closed
+                close(future)
+            if executor is not None:
+                executor.shutdown()
+
+    def _api_next_page_page(self, pagination, request, response, res, items):
+        if len(items) < pagination['page_size']:
+            return False
+        method, url, data, params, headers = request
+        page_param = pagination['page_param']
+        params = dict(params, **{page_param: params[page_param] + 1})
+        return method, url, data, params, headers
+
+    def _api_next_page_offset(self, pagination, request, response, res,
+                              items):
+        if len(items) < pagination['page_size']:
+            return False
+        method, url, data, params, headers = request
+        offset_param = pagination['offset_param']
+        params = dict(params, **{
+            offset_param: params[offset_param] + len(items)})
+        return method, url, data, params, headers
+
+    def _api_next_page_cursor(self, pagination, request, response, res,
+                              items):
+        cursor = get_path(res, pagination['cursor_key'])
+        if not cursor:
+            return False
+        method, url, data, params, headers = request
+        params = dict(params, **{pagination['cursor_param']: cursor})
+        return method, url, data, params, headers
+
+    def _api_next_page_link(self, pagination, request, response, res, items):
+        next_url = response.links.get('next', {}).get('url')
+        if not next_url:
             return False
+        method, __, data, __, headers = request
+        # link contains all query parameters of the next page
+        return method, next_url, data, None, headers
 
+    def _api_process_exception(self, e, log, request, silent=True):
+        self._api_log(log, request, {'error': e}, is_error=True)
+        if not silent:
+            raise ApiRequestError(_(
+                'Connector "%(credential)s" connection error: "%(error)s"'
+                '') % {'credential': self.name, 'error': e},
+                is_transient=isinstance(e, API_TRANSIENT_ERRORS))
+        return False
+
+    # pylint: disable=too-many-return-statements
+    def _api_process_response(self, response, log, request, silent=True,
+                              renew_token=False, stream=False):
+        method, url, data, params, __ = request
         if self.is_api_success(response):
             try:
                 res = response.json()
             except Exception as e:
-                if self.is_log_enabled and log:
-                    self.kw_http_request_log_source_id.update_log(
-                        log, {'code': response.status_code,
-                              'response_body': response.text, 'error': e, })
+                self._api_log(log, request, {
+                    'code': response.status_code,
+                    'response_body': self._api_capture(response).text,
+                    'error': e, }, is_error=True, response=response)
                 return False
 
-            if self.is_log_enabled and log:
-                self.kw_http_request_log_source_id.update_log(
-                    log,
-                    {'code': response.status_code, 'response_body': res, })
+            self._api_log(log, request, {
+                'code': response.status_code, 'response_body': res, },
+                response=response)
             return res
 
+        capture = self._api_capture(response)
         try:
+            if capture.is_truncated or capture.is_binary:
+                raise ValueError('Response body is not parsed as JSON')
             res = response.json()
         except Exception as e:
-            if self.is_log_enabled and log:
-                _logger.debug(e)
-                self.kw_http_request_log_source_id.update_log(
-                    log, {
-                        'code': response.status_code,
-                        'response_body': response.text,
-                        'error': html2text(response.text).split('\n')[0]})
+            _logger.debug(e)
+            error = html2text(capture.text) if capture.is_html \
+                else capture.text
+            self._api_log(log, request, {
+                'code': response.status_code,
+                'response_body': capture.text,
+                'error': error.split('\n')[0]},
+                is_error=True, response=response)
             if not silent:
-                raise exceptions.ValidationError(_(
+                raise ApiRequestError(_(
                     'Connector "%(credential)s" connection error: "%(error)s"'
-                    '') % {'credential': self.name,
-                           'error': html2text(response.text)})
+                    '') % {'credential': self.name, 'error': error},
+                    status_code=response.status_code)
             return False
 
         parse_result = self.parse_api_error(
-            response=response, res=res, log=log, silent=True, )
+            response=response, res=res,
+            log=False if isinstance(log, PendingLog) else log, silent=True, )
 
-        if self.is_log_enabled and log:
-            self.kw_http_request_log_source_id.update_log(
-                log, {
-                    'code': response.status_code,
-                    'response_body': response.text,
-                    'error': parse_result['message']})
+        self._api_log(log, request, {
+            'code': response.status_code,
+            'response_body': capture.text,
+            'error': parse_result['message']}, is_error=True,
+            response=response)
 
-        if not renew_token and parse_result.get('is_refresh_api_token_needed'):
+        is_upload = isinstance(data, StreamSample) and data.data is None
+        if isinstance(data, StreamSample):
+            data = data.data
+        # uploaded body can not be sent again
+        if not renew_token and not is_upload \
+                and parse_result.get('is_refresh_api_token_needed'):
             if self.action_refresh_api_token():
                 return self.api_request(
                     method=method, url=url, data=data, params=params,
-                    silent=silent, renew_token=renew_token, )
+                    silent=silent, renew_token=renew_token, stream=stream)
 
         if not silent:
-            raise exceptions.ValidationError(_(
+            raise ApiRequestError(_(
                 'Connector "%(credential)s" connection error: "%(error)s"'
-                '') % {'credential': self.name, 'error': parse_result})
+                '') % {'credential': self.name, 'error': parse_result},
+                status_code=response.status_code)
         return False
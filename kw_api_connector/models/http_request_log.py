@@ -0,0 +1,9 @@
+from odoo import models, fields
+
+
+class HTTPRequestLog(models.Model):
+    _inherit = 'kw.http.request.log'
+
+    api_outbox_id = fields.Many2one(
+        comodel_name='kw.api.outbox', string='Outbox', readonly=True,
+        ondelete='set null', index='btree_not_null', )
@@ -0,0 +1,198 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from odoo import api, exceptions, fields, models, _
+from odoo.tools import SQL
+
+from ..tools import ApiRequestError
+
+_logger = logging.getLogger(__name__)
+
+OUTBOX_WORKERS = 4
+OUTBOX_TIME_LIMIT = 240
+OUTBOX_RETRY_DELAY = 60
+OUTBOX_RETRY_DELAY_MAX = 3600
+
+
+class ApiOutbox(models.Model):
+    _name = 'kw.api.outbox'
+    _description = 'Api Outbox'
+    _order = 'id DESC'
+
+    name = fields.Char(
+        required=True, readonly=True, )
+    credential_model = fields.Char(
+        required=True, readonly=True, )
+    credential_id = fields.Many2oneReference(
+        model_field='credential_model', required=True, readonly=True, )
+    method = fields.Char(
+        required=True, readonly=True, )
+    url = fields.Char(
+        string='URL', required=True, readonly=True, )
+    data = fields.Json(
+        readonly=True, )
+    params = fields.Json(
+        readonly=True, )
+    idempotency_key = fields.Char(
+        readonly=True,
+        help='Sent in Idempotency-Key header, so the API may deduplicate '
+             'retried requests.')
+    state = fields.Selection(
+        selection=[('pending', 'Pending'),
+                   ('done', 'Done'),
+                   ('dead', 'Dead letter'), ],
+        default='pending', required=True, readonly=True, index=True, )
+    priority = fields.Integer(
+        default=10, readonly=True,
+        help='Requests with lower priority are sent first.')
+    attempt_count = fields.Integer(
+        string='Attempts', readonly=True, )
+    max_attempts = fields.Integer(
+        default=5, readonly=True,
+        help='The request is moved to dead letters after this number of '
+             'failed attempts.')
+    next_attempt_date = fields.Datetime(
+        default=fields.Datetime.now, readonly=True, )
+    done_date = fields.Datetime(
+        readonly=True, )
+    result = fields.Json(
+        readonly=True, )
+    error = fields.Text(
+        readonly=True, )
+    log_ids = fields.One2many(
+        comodel_name='kw.http.request.log', inverse_name='api_outbox_id',
+        string='Logs', readonly=True, )
+
+    def init(self):
+        self.env.cr.execute(SQL(
+            "CREATE INDEX IF NOT EXISTS kw_api_outbox_pending_index "
+            "ON %s (priority, id) WHERE state = 'pending'",
+            SQL.identifier(self._table)))
+
+    def _get_credential(self):
+        self.ensure_one()
+        return self.env[self.credential_model].browse(
+            self.credential_id).with_context(kw_api_outbox_id=self.id)
+
+    @api.model
+    def _claim(self):
+        """ Lock the next pending request, requests locked by other
+            workers are skipped, the lock is held until the transaction
+            ends
+        """
+        self.env.cr.execute(SQL(
+            "SELECT id FROM %s WHERE state = 'pending' "
+            "AND next_attempt_date <= %s ORDER BY priority, id LIMIT 1 "
+            "FOR UPDATE SKIP LOCKED",
+            SQL.identifier(self._table), fields.Datetime.now()))
+        row = self.env.cr.fetchone()
+        return self.browse(row and row[0])
+
+    def _get_retry_date(self, attempt):
+        delay = min(OUTBOX_RETRY_DELAY * 2 ** (attempt - 1),
+                    OUTBOX_RETRY_DELAY_MAX)
+        return fields.Datetime.now() + timedelta(seconds=delay)
+
+    def _process(self):
+        """ Send requests and store their results, requests failed with
+            transient errors are retried later, other failed requests are
+            moved to dead letters
+        """
+        for obj in self:
+            attempt = obj.attempt_count + 1
+            credential = obj._get_credential()
+            try:
+                if not credential.exists():
+                    raise exceptions.UserError(_(
+                        'Credential of the request is deleted'))
+                headers = None
+                if obj.idempotency_key:
+                    headers = dict(
+                        credential.get_api_headers(),
+                        **{'Idempotency-Key': obj.idempotency_key})
+                with self.env.cr.savepoint():
+                    result = credential.api_request(
+                        obj.method, obj.url, data=obj.data,
+                        params=obj.params, headers=headers, silent=False)
+                if result is False:
+                    raise exceptions.UserError(_(
+                        'Request failed, see logs for details'))
+            except Exception as e:
+                _logger.info('Outbox request %s attempt %s failed: %s',
+                             obj.id, attempt, e)
+                vals = {'attempt_count': attempt, 'error': str(e),
+                        'state': 'dead', }
+                # e.g. 400, 401, 404 or 422 fail again if retried
+                is_transient = isinstance(e, ApiRequestError) \
+                    and e.is_transient
+                if is_transient and attempt < obj.max_attempts:
+                    vals.update({
+                        'state': 'pending',
+                        'next_attempt_date': obj._get_retry_date(attempt), })
+                obj.write(vals)
+                continue
+            obj.write({
+                'attempt_count': attempt, 'state': 'done', 'result': result,
+                'error': False, 'done_date': fields.Datetime.now(), })
+
+    def _drain(self, deadline):
+        """ Process pending requests one by one, each request is claimed
+            and processed in its own transaction
+
+            :return: number of processed requests
+        """
+        count = 0
+        while time.monotonic() < deadline:
+            with self.env.registry.cursor() as cr:
+                outbox = self.with_env(self.env(cr=cr))._claim()
+                if not outbox:
+                    return count
+                outbox._process()
+            count += 1
+        return count
+
+    @api.model
+    def cron_process_outbox(self, workers=OUTBOX_WORKERS,
+                            time_limit=OUTBOX_TIME_LIMIT):
+        """ Send pending requests by a pool of threads, the cron is
+            triggered again if the run takes longer than time_limit seconds
+        """
+        deadline = time.monotonic() + time_limit
+        if workers <= 1 or self.env.registry.in_test_mode():
+            count = self._drain(deadline)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(self._drain, deadline)
+                           for __ in range(workers)]
+            count = 0
+            for future in futures:
+                try:
+                    count += future.result()
+                except Exception:
+                    _logger.exception('Outbox worker failed')
+        if time.monotonic() >= deadline:
+            self._trigger_cron()
+        _logger.info('Outbox requests processed: %s', count)
+        return count
+
+    @api.model
+    def _trigger_cron(self, at=None):
+        cron = self.env.ref(
+            'kw_api_connector.process_api_outbox_cron',
+            raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger(at)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self._trigger_cron()
+        return records
+
+    def action_retry(self):
+        self.filtered(lambda x: x.state == 'dead').write({
+            'state': 'pending', 'attempt_count': 0,
+            'next_attempt_date': fields.Datetime.now(), })
+        self._trigger_cron()
@@ -0,0 +1,47 @@
+import logging
+
+from odoo import api, models, fields
+
+from ..tools import rate_limit
+
+_logger = logging.getLogger(__name__)
+
+
+class ApiRateLimit(models.Model):
+    _name = 'kw.api.rate.limit'
+    _description = 'Api Rate Limit'
+    _order = 'name'
+    _sql_constraints = [
+        ('name_uniq', 'unique (name)',
+         'Api rate limit key must be unique'), ]
+
+    name = fields.Char(
+        string='Key', required=True, readonly=True,
+        help='Credential or connector the rate limit is shared by.')
+    tokens = fields.Float(
+        readonly=True,
+        help='Tokens left at the time of the last request, negative while '
+             'requests wait for their turn.')
+    refill_date = fields.Datetime(
+        readonly=True, )
+    request_count = fields.Integer(
+        string='Requests', readonly=True, )
+    throttled_count = fields.Integer(
+        string='Throttled', readonly=True,
+        help='Number of requests that waited for the rate limiter or were '
+             'rejected by it.')
+    wait_time = fields.Float(
+        string='Wait time, s', readonly=True,
+        help='Total time requests waited for the rate limiter.')
+
+    @api.model
+    def _reserve(self, key, rate, capacity, count=1, max_wait=0):
+        """ Reserve tokens of the bucket shared by all workers, the bucket is
+            updated in a separate transaction
+
+            :return: tokens available before the reservation, None if the
+                last request would wait longer than max_wait seconds
+        """
+        return rate_limit.reserve_shared(
+            self.env.cr.dbname, key, rate, capacity, count, max_wait,
+            table=self._table)
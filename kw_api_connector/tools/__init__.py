@@ -0,0 +1,17 @@
+from .capture import BodyCapture, capture_body, CAPTURE_SIZE
+from .concurrency import get_semaphore
+from .pagination import get_path, PAGINATION_DEFAULTS
+from .pending_log import PendingLog
+from .rate_limit import ApiRateLimitError, get_delays
+from .request_body import merge_headers, prepare_body, UPLOAD_MODES
+from . import response_cache
+from .retry import (
+    ApiCircuitOpenError, ApiRequestError, drop_circuit, get_circuit,
+    get_retry_delay, is_circuit_open, is_idempotent, parse_retry_after,
+    record_circuit_result, set_circuit, )
+from .session_pool import drop_sessions, get_session
+from .stream import (
+    iter_chunks, iter_json_array, iter_jsonl, StreamResponse, StreamSample,
+    STREAM_MODES, )
+from .timing import get_timings, reset_connect_time
+from .token_cache import drop_token, get_token, set_token
@@ -0,0 +1,76 @@
+import codecs
+from collections import namedtuple
+
+from .stream import CHUNK_SIZE
+
+CAPTURE_SIZE = 64 * 1024
+
+HTML_TYPES = ('text/html', 'application/xhtml+xml', )
+TEXT_TYPES = ('application/json', 'application/xml',
+              'application/javascript', 'application/problem+json',
+              'application/x-www-form-urlencoded', )
+
+BodyCapture = namedtuple(
+    'BodyCapture', ['text', 'content_type', 'is_truncated', 'is_binary',
+                    'is_html'])
+
+
+def get_content_type(response):
+    value = response.headers.get('Content-Type')
+    if not isinstance(value, str):
+        return ''
+    return value.split(';')[0].strip().lower()
+
+
+def is_text_type(content_type):
+    """ Unknown content type is considered text """
+    return not content_type or content_type.startswith('text/') \
+        or content_type in TEXT_TYPES \
+        or content_type.endswith(('+json', '+xml'))
+
+
+def read_head(response, max_size):
+    """ Return at most max_size + 1 bytes of the body, streamed body is not
+        read further and is kept in the response if it is not longer, body
+        of response that is not streamed is already downloaded in full
+    """
+    if getattr(response, '_content', None) is not False:
+        return response.content[:max_size + 1]
+    head = bytearray()
+    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+        head += chunk
+        if len(head) > max_size:
+            response.close()
+            return bytes(head[:max_size + 1])
+    response._content = bytes(head)
+    return response._content
+
+
+def decode(content, encoding):
+    try:
+        codecs.lookup(encoding)
+    except (LookupError, TypeError):
+        encoding = 'utf-8'
+    return content.decode(encoding, errors='replace')
+
+
+def capture_body(response, max_size=CAPTURE_SIZE):
+    """ Capture head of the response body for logging and error messages,
+        binary bodies are replaced by description
+
+        :return: BodyCapture
+    """
+    content_type = get_content_type(response)
+    head = read_head(response, max_size)
+    is_truncated = len(head) > max_size
+    head = head[:max_size]
+    if not is_text_type(content_type) or b'\x00' in head[:1024]:
+        return BodyCapture(
+            f'[binary body of type {content_type or "unknown"} is not '
+            f'logged]', content_type, is_truncated, True, False)
+    text = decode(head, response.encoding)
+    is_html = content_type in HTML_TYPES or (
+        not content_type and text.lstrip().startswith('<'))
+    if is_truncated:
+        text += f'\n... truncated, only first {max_size} bytes are logged'
+    return BodyCapture(text, content_type, is_truncated, False, is_html)
@@ -0,0 +1,19 @@
+import threading
+
+_semaphores = {}
+_lock = threading.Lock()
+
+
+def get_semaphore(key, limit):
+    """ Return semaphore shared by the process for given key, the semaphore
+        is replaced when the limit changes
+    """
+    semaphore = _semaphores.get(key)
+    if semaphore is None or semaphore.limit != limit:
+        with _lock:
+            semaphore = _semaphores.get(key)
+            if semaphore is None or semaphore.limit != limit:
+                semaphore = threading.BoundedSemaphore(limit)
+                semaphore.limit = limit
+                _semaphores[key] = semaphore
+    return semaphore
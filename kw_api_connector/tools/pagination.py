@@ -0,0 +1,31 @@
+PAGINATION_DEFAULTS = {
+    # page, offset, cursor or link, see _api_next_page_<strategy> methods
+    'strategy': 'page',
+    'page_size': 100,
+    # path of the list of records in the response, the response itself
+    # is the list of records if not set
+    'items_key': None,
+    'page_param': 'page',
+    'first_page': 1,
+    'size_param': 'per_page',
+    'offset_param': 'offset',
+    'cursor_param': 'cursor',
+    # path of the next page cursor in the response
+    'cursor_key': 'next_cursor',
+    # request the next page in the background while the caller processes
+    # records of the current one
+    'prefetch': False,
+}
+
+
+def get_path(data, path):
+    """ Return value of dotted path (e.g. ``meta.next_cursor``) of parsed
+        JSON response
+    """
+    if not path:
+        return data
+    for key in path.split('.'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
@@ -0,0 +1,146 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+from odoo import api
+from odoo.modules.registry import Registry
+
+_logger = logging.getLogger(__name__)
+
+
+class ScheduledWrite:
+    """ Row of the request in progress to be written by the scheduler """
+    __slots__ = ('log', 'args')
+
+    def __init__(self, log, args):
+        self.log = log
+        self.args = args
+
+    def cancel(self):
+        # the entry stays in the queue until it is due, it does not keep
+        # the row values in memory meanwhile
+        self.log = None
+
+
+class LogScheduler:
+    """ Single thread of the process writing rows of requests that are
+        still in progress when their threshold is reached, so slow
+        requests do not start a thread each
+    """
+
+    def __init__(self):
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def schedule(self, delay, log, args):
+        """ Call log.write(*args) in delay seconds unless the returned
+            entry is cancelled
+        """
+        entry = ScheduledWrite(log, args)
+        with self._cond:
+            heapq.heappush(self._queue, (
+                time.monotonic() + delay, next(self._counter), entry))
+            self._cond.notify()
+            self._ensure_thread()
+        return entry
+
+    def _ensure_thread(self):
+        """ Must be called with self._cond acquired """
+        if self._thread is not None and self._pid == os.getpid() \
+                and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name='kw.api.log.scheduler')
+        self._thread.start()
+
+    def _next(self):
+        """ Wait for the next due entry """
+        with self._cond:
+            while True:
+                while self._queue and self._queue[0][2].log is None:
+                    heapq.heappop(self._queue)
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                delay = self._queue[0][0] - time.monotonic()
+                if delay <= 0:
+                    return heapq.heappop(self._queue)[2]
+                self._cond.wait(delay)
+
+    def _run(self):
+        while True:
+            entry = self._next()
+            log = entry.log
+            if log is not None:
+                log.write(*entry.args)
+
+
+_scheduler = LogScheduler()
+
+
+class PendingLog:
+    """ Log of API request kept in memory until it is written at once
+
+        :param vals: values of the log row
+        :param sampled: request was sampled for logging, otherwise the row
+            is only written if the request fails
+        :param deferred: the row is written when the result of the request
+            is logged, otherwise it is written by the caller (e.g. with
+            logs of other requests of a batch)
+    """
+    __slots__ = ('vals', 'sampled', 'deferred', 'log_id', 'done', 'timer',
+                 'lock')
+
+    def __init__(self, vals=None, sampled=True, deferred=False):
+        self.vals = vals or {}
+        self.sampled = sampled
+        self.deferred = deferred
+        self.log_id = False
+        self.done = False
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def start_timer(self, delay, dbname, uid, source_id):
+        """ Write the row with request data if the request is not completed
+            within delay seconds, the row is written by the scheduler
+            thread of the process with its own cursor
+
+            :param source_id: id of kw.http.request.log.source
+        """
+        self.timer = _scheduler.schedule(
+            delay, self, (dbname, uid, source_id))
+
+    def write(self, dbname, uid, source_id):
+        """ Write the row unless the request is completed, called by the
+            scheduler
+        """
+        with self.lock:
+            if self.done:
+                return
+            try:
+                with Registry(dbname).cursor() as cr:
+                    env = api.Environment(cr, uid, {})
+                    source_model = env['kw.http.request.log.source']
+                    self.log_id = source_model.sudo().browse(
+                        source_id).create_log(dict(self.vals))
+            except Exception:
+                _logger.exception(
+                    'Cannot write log of API request in progress')
+
+    def finish(self):
+        """ Cancel the scheduled write
+
+            :return: id of the row written by the scheduler or False
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+        with self.lock:
+            self.done = True
+            return self.log_id
@@ -0,0 +1,107 @@
+import threading
+
+from odoo.modules.registry import Registry
+from odoo.tools import SQL
+
+from odoo.addons.kw_http_request_log.tools.token_bucket import TokenBucket
+
+_buckets = {}
+_lock = threading.Lock()
+
+
+class ApiRateLimitError(Exception):
+    """ Request would wait for the rate limiter longer than allowed """
+
+
+class RateLimitBucket(TokenBucket):
+    """ Token bucket of the worker with metrics of its requests """
+
+    def __init__(self, rate, capacity):
+        super().__init__(rate, capacity)
+        self.requests = 0
+        self.throttled = 0
+        self.wait_time = 0.0
+
+
+def get_delays(available, count, rate):
+    """ Delays in seconds before each of ``count`` requests may be sent
+
+        :param available: tokens available before the reservation
+    """
+    return [max((i + 1 - available) / rate, 0) for i in range(count)]
+
+
+def reserve(key, rate, capacity, count=1, max_wait=0):
+    """ Reserve tokens of the worker bucket
+
+        :return: tokens available before the reservation, None if the last
+            request would wait longer than max_wait seconds
+    """
+    with _lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = RateLimitBucket(rate, capacity)
+        # settings of the connector may be changed since the last request
+        bucket.rate = rate
+        bucket.capacity = capacity
+        available = bucket.reserve(count, max_wait)
+        if available is None:
+            bucket.throttled += 1
+            return None
+        bucket.requests += count
+        if available < count:
+            bucket.throttled += 1
+            bucket.wait_time += sum(get_delays(available, count, rate))
+        return available
+
+
+def reserve_shared(dbname, key, rate, capacity, count=1, max_wait=0,
+                   table='kw_api_rate_limit'):
+    """ Reserve tokens of the bucket shared by all workers, the bucket is
+        updated in a separate transaction, so it may be called from other
+        threads
+
+        :return: tokens available before the reservation, None if the last
+            request would wait longer than max_wait seconds
+    """
+    registry = Registry(dbname)
+    table = SQL.identifier(table)
+    with registry.cursor() as cr:
+        if not registry.in_test_mode():
+            # concurrent updates of the bucket are expected
+            cr.execute(SQL(
+                'SET TRANSACTION ISOLATION LEVEL READ COMMITTED'))
+        cr.execute(SQL(
+            "INSERT INTO %s (name, tokens, refill_date, request_count, "
+            "throttled_count, wait_time) VALUES (%s, %s, "
+            "clock_timestamp() AT TIME ZONE 'UTC', 0, 0, 0) "
+            "ON CONFLICT (name) DO NOTHING", table, key, capacity))
+        cr.execute(SQL(
+            "SELECT id, LEAST(%s, tokens + %s * EXTRACT(EPOCH FROM "
+            "clock_timestamp() AT TIME ZONE 'UTC' - refill_date))::float "
+            "FROM %s WHERE name = %s FOR UPDATE",
+            capacity, rate, table, key))
+        bucket_id, available = cr.fetchone()
+        rejected = available - count < -max_wait * rate
+        throttled = rejected or available < count
+        wait_time = 0 if rejected else sum(
+            get_delays(available, count, rate))
+        cr.execute(SQL(
+            "UPDATE %s SET tokens = %s, "
+            "refill_date = clock_timestamp() AT TIME ZONE 'UTC', "
+            "request_count = request_count + %s, "
+            "throttled_count = throttled_count + %s, "
+            "wait_time = wait_time + %s WHERE id = %s",
+            table, available if rejected else available - count,
+            0 if rejected else count, int(throttled), wait_time,
+            bucket_id))
+    return None if rejected else available
+
+
+def get_metrics(key):
+    with _lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            return {'requests': 0, 'throttled': 0, 'wait_time': 0.0}
+        return {'requests': bucket.requests, 'throttled': bucket.throttled,
+                'wait_time': bucket.wait_time}
@@ -0,0 +1,115 @@
+import gzip
+import json
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from requests.structures import CaseInsensitiveDict
+
+from .stream import CHUNK_SIZE
+
+UPLOAD_MODES = ('chunks', 'jsonl')
+
+GZIP_LEVEL = 6
+
+
+def dumps(data):
+    """ Serialize data to JSON bytes, orjson is used if it is installed """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except orjson.JSONEncodeError:
+            # e.g. integers out of 64-bit range or non-string keys, which
+            # are supported by the standard encoder
+            pass
+    return json.dumps(data).encode()
+
+
+def merge_headers(headers, body_headers, replace_type=False):
+    """ Add headers of the encoded body to request headers, Content-Type
+        set by the caller is kept unless replace_type is set, header names
+        are compared case-insensitively
+    """
+    headers = CaseInsensitiveDict(headers or {})
+    for name, value in body_headers.items():
+        if name.lower() == 'content-type' and not replace_type:
+            headers.setdefault(name, value)
+        else:
+            headers[name] = value
+    return dict(headers)
+
+
+def iter_jsonl_body(records):
+    for record in records:
+        yield dumps(record) + b'\n'
+
+
+def iter_sampled(chunks, sample):
+    for chunk in chunks:
+        if chunk:
+            sample.update(chunk)
+            yield chunk
+
+
+def iter_buffered(chunks, chunk_size=CHUNK_SIZE):
+    """ Join small chunks, each chunk is sent as a separate chunk of
+        chunked transfer encoding
+    """
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def iter_gzip(chunks, level=GZIP_LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in iter_buffered(chunks):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def prepare_body(data, upload=False, compress=False, min_size=0,
+                 sample=None):
+    """ Encode body of the request
+
+        :param upload: False to send data as JSON, 'jsonl' to send iterable
+            of records as JSON lines or 'chunks' to send iterable
+            of bytes or str, such bodies are sent with chunked transfer
+            encoding and are not kept in memory
+        :param compress: compress the body with gzip
+        :param min_size: smaller JSON bodies are not compressed
+        :param sample: StreamSample updated with the encoded body before
+            compression, chunks of uploaded body are sampled while they are
+            sent
+        :return: tuple (body, headers), body is bytes or iterator of bytes
+    """
+    if not upload:
+        body = dumps(data)
+        headers = {'Content-Type': 'application/json'}
+        if sample is not None:
+            sample.update(body)
+        if compress and len(body) >= min_size:
+            headers['Content-Encoding'] = 'gzip'
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        return body, headers
+    headers = {}
+    if upload == 'jsonl':
+        headers['Content-Type'] = 'application/x-ndjson'
+        chunks = iter_jsonl_body(data)
+    else:
+        chunks = (x.encode() if isinstance(x, str) else x for x in data)
+    if sample is not None:
+        chunks = iter_sampled(chunks, sample)
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+        return iter_gzip(chunks), headers
+    return iter_buffered(chunks), headers
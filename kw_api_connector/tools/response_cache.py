@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+
+_caches = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+class CacheEntry:
+    """ Body of cached response with its validators """
+    __slots__ = ('body', 'etag', 'last_modified', 'expire_at')
+
+    def __init__(self, body, etag=None, last_modified=None, ttl=0):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expire_at = time.monotonic() + ttl
+
+    @property
+    def is_fresh(self):
+        return self.expire_at > time.monotonic()
+
+    @property
+    def validators(self):
+        """ Headers of conditional request revalidating the entry """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+def get_entry(owner, key):
+    """ :param owner: tuple (dbname, model, record id) of the credential """
+    with _lock:
+        cache = _caches.get(owner)
+        entry = cache and cache.get(key)
+        if entry is not None:
+            cache.move_to_end(key)
+        return entry
+
+
+def set_entry(owner, key, entry, max_size):
+    with _lock:
+        cache = _caches.setdefault(owner, OrderedDict())
+        cache[key] = entry
+        cache.move_to_end(key)
+        while len(cache) > max(max_size, 1):
+            cache.popitem(last=False)
+
+
+def drop_entries(owner):
+    with _lock:
+        _caches.pop(owner, None)
+
+
+def count(owner, hit):
+    with _lock:
+        hits, misses = _stats.get(owner, (0, 0))
+        _stats[owner] = (hits + 1, misses) if hit else (hits, misses + 1)
+
+
+def get_stats(owner):
+    """ :return: tuple (hits, misses) of the worker """
+    with _lock:
+        return _stats.get(owner, (0, 0))
@@ -0,0 +1,207 @@
+import logging
+import random
+import threading
+import time
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+
+from psycopg2 import errors
+
+from odoo import exceptions
+from odoo.modules.registry import Registry
+from odoo.tools import SQL
+
+_logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE', }
+TRANSIENT_STATUS_CODES = {408, 425, 429, }
+
+# seconds during which the circuit state shared by workers is not read
+# from the database again
+CIRCUIT_CHECK_INTERVAL = 1.0
+
+_circuits = {}
+_circuit_checks = {}
+_lock = threading.Lock()
+
+
+class ApiCircuitOpenError(Exception):
+    """ Request is not sent because the API is considered down """
+
+
+class ApiRequestError(exceptions.ValidationError):
+    """ Request failed, raised by requests that are not silent
+
+        :param status_code: status of the response, None if the request
+            failed without response
+        :param is_transient: the request may succeed if it is sent later,
+            by default only for timeouts, throttled requests and server
+            errors
+    """
+
+    def __init__(self, message, status_code=None, is_transient=None):
+        super().__init__(message)
+        self.status_code = status_code
+        if is_transient is None:
+            is_transient = is_transient_status(status_code)
+        self.is_transient = is_transient
+
+
+def is_transient_status(status_code):
+    return bool(status_code) and (
+        status_code >= 500 or status_code in TRANSIENT_STATUS_CODES)
+
+
+def is_idempotent(method, headers=None):
+    """ Request may be safely sent again, requests with Idempotency-Key
+        header are deduplicated by the API
+    """
+    if method.upper() in IDEMPOTENT_METHODS:
+        return True
+    return any(x.lower() == 'idempotency-key' for x in headers or {})
+
+
+def parse_retry_after(value):
+    """ Return delay in seconds from Retry-After header value, which is
+        either number of seconds or HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_retry_delay(attempt, backoff, backoff_max):
+    """ Exponential backoff with full jitter """
+    delay = min(backoff_max, backoff * 2 ** attempt)
+    return random.uniform(0, delay)  # nosec
+
+
+def get_circuit(key):
+    """ Return state of circuit breaker known to this process
+
+        :param key: tuple (dbname, model, record id)
+        :return: tuple (number of consecutive failures, POSIX timestamp
+            until which the circuit is open or None)
+    """
+    with _lock:
+        return _circuits.get(key, (0, None))
+
+
+def set_circuit(key, failures=0, open_until=None):
+    with _lock:
+        if failures or open_until:
+            _circuits[key] = (failures, open_until)
+        else:
+            _circuits.pop(key, None)
+
+
+def drop_circuit(key):
+    """ Forget state of the circuit, it is read from the database by the
+        next check
+    """
+    with _lock:
+        _circuits.pop(key, None)
+        _circuit_checks.pop(key, None)
+
+
+def _to_timestamp(value):
+    return value and value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def read_circuit(key, table):
+    """ Read state of the circuit shared by workers in a separate cursor,
+        so it may be called from other threads
+
+        :param table: table of the connector model
+    """
+    dbname, __, record_id = key
+    with Registry(dbname).cursor() as cr:
+        cr.execute(SQL(
+            'SELECT api_circuit_failures, api_circuit_open_until '
+            'FROM %s WHERE id = %s', SQL.identifier(table), record_id))
+        row = cr.fetchone()
+    if not row:
+        return 0, None
+    return row[0] or 0, _to_timestamp(row[1]) or None
+
+
+def is_circuit_open(key, table):
+    """ Requests to the API should fail without being sent, the state
+        shared by workers is read from the database at most once per
+        CIRCUIT_CHECK_INTERVAL seconds, so a circuit opened by another
+        worker is seen without waiting for failures of this one
+    """
+    now = time.monotonic()
+    with _lock:
+        open_until = _circuits.get(key, (0, None))[1]
+        if open_until and open_until > time.time():
+            return True
+        checked = _circuit_checks.get(key)
+        if checked is not None and now - checked < CIRCUIT_CHECK_INTERVAL:
+            return False
+        _circuit_checks[key] = now
+    failures, open_until = read_circuit(key, table)
+    set_circuit(key, failures, open_until)
+    return bool(open_until and open_until > time.time())
+
+
+def record_circuit_result(key, table, success, threshold, reset_timeout,
+                          name=None):
+    """ Update circuit state shared by workers, the state is stored in a
+        separate transaction to be visible to other workers at once, so it
+        may be called from other threads
+
+        :param threshold: consecutive failures which open the circuit
+        :param reset_timeout: seconds during which the circuit stays open
+        :param name: name of the API in the warning logged when the
+            circuit is opened
+    """
+    if not threshold:
+        return
+    failures = get_circuit(key)[0]
+    if success and not failures:
+        return
+    if success:
+        query = SQL(
+            'UPDATE %s SET api_circuit_failures = 0, '
+            'api_circuit_open_until = NULL WHERE id = %s '
+            'RETURNING api_circuit_failures, api_circuit_open_until',
+            SQL.identifier(table), key[2])
+    else:
+        query = SQL(
+            'UPDATE %(table)s SET '
+            'api_circuit_failures = api_circuit_failures + 1, '
+            'api_circuit_open_until = CASE '
+            'WHEN api_circuit_failures + 1 >= %(threshold)s '
+            "THEN (now() AT TIME ZONE 'UTC') + %(timeout)s * "
+            "interval '1 second' ELSE api_circuit_open_until END "
+            'WHERE id = %(id)s '
+            'RETURNING api_circuit_failures, api_circuit_open_until',
+            table=SQL.identifier(table), threshold=threshold,
+            timeout=reset_timeout, id=key[2])
+    with Registry(key[0]).cursor() as cr:
+        # the row may be locked by the transaction of the caller, the
+        # state is kept by this worker only in such case
+        cr.execute(SQL("SET LOCAL lock_timeout = '1s'"))
+        try:
+            with cr.savepoint(flush=False):
+                cr.execute(query)
+                failures, open_until = cr.fetchone()
+        except errors.LockNotAvailable:
+            failures = 0 if success else failures + 1
+            open_until = (
+                failures >= threshold and time.time() + reset_timeout)
+        else:
+            open_until = _to_timestamp(open_until)
+    if open_until and not success:
+        _logger.warning(
+            'Circuit breaker of API connector %s is open, %s failures',
+            name or key[2], failures)
+    set_circuit(key, failures, open_until or None)
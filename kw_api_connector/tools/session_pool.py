@@ -0,0 +1,89 @@
+import threading
+from collections import OrderedDict
+from http import cookiejar
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .timing import POOL_CLASSES_BY_SCHEME
+
+MAX_SESSIONS = 128
+
+_sessions = OrderedDict()
+_lock = threading.Lock()
+
+
+class BlockAllCookies(cookiejar.CookiePolicy):
+    """ Pooled sessions are shared by requests of different users, so they
+        must not keep cookies between requests
+    """
+    netscape = True
+    rfc2965 = hide_cookie2 = False
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+    def domain_return_ok(self, domain, request):
+        return False
+
+    def path_return_ok(self, path, request):
+        return False
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """ Adapter which connections measure time of connecting """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = POOL_CLASSES_BY_SCHEME
+
+
+def _create_session(pool_size, max_retries, keep_alive):
+    session = requests.Session()
+    session.cookies.set_policy(BlockAllCookies())
+    adapter = TimedHTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size,
+        max_retries=Retry(total=max_retries, read=False,
+                          backoff_factor=0.3))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def get_session(key, pool_size=10, max_retries=0, keep_alive=True):
+    """ Return session shared by the process for given key
+
+        :param key: tuple (dbname, model, record id, base url)
+    """
+    key = tuple(key) + (pool_size, max_retries, keep_alive)
+    with _lock:
+        session = _sessions.get(key)
+        if session is not None:
+            _sessions.move_to_end(key)
+            return session
+        session = _sessions[key] = _create_session(
+            pool_size, max_retries, keep_alive)
+        while len(_sessions) > MAX_SESSIONS:
+            _sessions.popitem(last=False)[1].close()
+    return session
+
+
+def drop_sessions(dbname, model=None, ids=None, base_urls=None):
+    """ Close sessions of given credentials or base urls """
+    with _lock:
+        for key in list(_sessions):
+            if key[0] != dbname:
+                continue
+            if model is not None and key[1] != model:
+                continue
+            if ids is not None and key[2] not in ids:
+                continue
+            if base_urls is not None and key[3] not in base_urls:
+                continue
+            _sessions.pop(key).close()
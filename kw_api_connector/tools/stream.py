@@ -0,0 +1,223 @@
+import codecs
+import hashlib
+import json
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+STREAM_MODES = ('chunks', 'jsonl', 'json_array')
+
+CHUNK_SIZE = 64 * 1024
+MAX_BUFFER_SIZE = 16 * 1024 * 1024
+SAMPLE_SIZE = 4 * 1024
+JSON_WHITESPACE = ' \t\r\n'
+NUMBER_TAIL = '.eE+-'
+
+
+class StreamSample:
+    """ Keeps head and tail of a streamed body along with its size and hash,
+        so the body can be logged without holding it in memory
+    """
+
+    def __init__(self, sample_size=SAMPLE_SIZE, data=None):
+        self.sample_size = sample_size
+        # data of encoded JSON body, kept to send the request again, it is
+        # None for uploaded bodies which are consumed by the first attempt
+        self.data = data
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        # seconds spent on reading the body
+        self.read_time = 0.0
+
+    def update(self, chunk):
+        self.size += len(chunk)
+        self.sha256.update(chunk)
+        free = self.sample_size - len(self.head)
+        if free > 0:
+            self.head += chunk[:free]
+            chunk = chunk[free:]
+        if chunk:
+            self.tail += chunk
+            del self.tail[:-self.sample_size]
+
+    @property
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+    @property
+    def text(self):
+        head = self.head.decode('utf-8', errors='replace')
+        if not self.tail:
+            return head
+        skipped = self.size - len(self.head) - len(self.tail)
+        tail = self.tail.decode('utf-8', errors='replace')
+        if not skipped:
+            return head + tail
+        return f'{head}\n... {skipped} bytes skipped ...\n{tail}'
+
+
+class StreamResponse:
+    """ Iterator over body of streamed response, may be used as context
+        manager. The response is closed and on_close is called with the
+        iterator once the body is read, the iteration fails or close() is
+        called. An iterator that is garbage collected unclosed only closes
+        the response.
+
+        :param mode: 'chunks', 'jsonl' or 'json_array'
+        :param on_close: function called once, e.g. to log the sample
+    """
+
+    def __init__(self, response, mode, on_close):
+        self.response = response
+        self.sample = StreamSample()
+        self.error = None
+        self.closed = False
+        self._on_close = on_close
+        items = iter_chunks(response, self.sample)
+        if mode == 'jsonl':
+            items = iter_jsonl(items)
+        elif mode == 'json_array':
+            items = iter_json_array(items)
+        self._items = items
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise StopIteration
+        try:
+            return next(self._items)
+        except StopIteration:
+            self.close()
+            raise
+        except Exception as e:
+            self.error = e
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        # garbage collection may run in another thread or after the cursor
+        # is closed, so the connection is released without on_close
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.response.close()
+        except Exception:
+            _logger.exception('Cannot close streamed response')
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.response.close()
+        self._on_close(self)
+
+
+def iter_chunks(response, sample, chunk_size=CHUNK_SIZE):
+    chunks = response.iter_content(chunk_size=chunk_size)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        sample.read_time += time.perf_counter() - start
+        if chunk is None:
+            return
+        if chunk:
+            sample.update(chunk)
+            yield chunk
+
+
+def iter_jsonl(chunks, max_buffer_size=MAX_BUFFER_SIZE):
+    """ Parse JSON lines, one record per line """
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+        if len(buffer) > max_buffer_size:
+            raise ValueError(
+                f'JSON line is longer than {max_buffer_size} bytes')
+    if buffer.strip():
+        yield json.loads(buffer)
+
+
+def iter_json_array(chunks, max_buffer_size=MAX_BUFFER_SIZE):
+    """ Parse items of top level JSON array one by one, malformed arrays
+        (empty items, missing separators or data after the array) raise
+        ValueError
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    pos = 0
+    # next token: '[', 'first' item or ']', 'item', 'separator' or 'end'
+    expected = '['
+    eof = False
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in JSON_WHITESPACE:
+            pos += 1
+        if pos < len(buffer):
+            char = buffer[pos]
+            if expected == '[':
+                if char != '[':
+                    raise ValueError('JSON array is expected')
+                expected = 'first'
+                pos += 1
+                continue
+            if expected == 'end':
+                raise ValueError('Unexpected data after JSON array')
+            if expected == 'separator':
+                if char not in ',]':
+                    raise ValueError(
+                        'Comma or end of JSON array is expected')
+                expected = 'item' if char == ',' else 'end'
+                pos += 1
+                continue
+            if char == ']' and expected == 'first':
+                expected = 'end'
+                pos += 1
+                continue
+            if char in ',]':
+                raise ValueError('JSON array item is expected')
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # number at the end of buffer may continue in the next chunk
+                if eof or (end < len(buffer)
+                           and buffer[end] not in NUMBER_TAIL):
+                    yield item
+                    pos = end
+                    expected = 'separator'
+                    continue
+        if eof:
+            if expected == 'end':
+                return
+            raise ValueError('Unexpected end of JSON array')
+        buffer = buffer[pos:]
+        pos = 0
+        if len(buffer) > max_buffer_size:
+            raise ValueError(
+                f'JSON array item is longer than {max_buffer_size} bytes')
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buffer += text_decoder.decode(b'', final=True)
+        else:
+            buffer += text_decoder.decode(chunk)
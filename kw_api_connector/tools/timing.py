@@ -0,0 +1,88 @@
+import threading
+import time
+from datetime import timedelta
+
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+_local = threading.local()
+
+
+class TimedConnectionMixin:
+    """ Measure time of opening connections (DNS lookup, TCP connect and TLS
+        handshake) made by the current thread
+    """
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            _local.connect_time = get_connect_time() + (
+                time.perf_counter() - start)
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+POOL_CLASSES_BY_SCHEME = {
+    'http': TimedHTTPConnectionPool,
+    'https': TimedHTTPSConnectionPool,
+}
+
+
+def reset_connect_time():
+    _local.connect_time = 0.0
+
+
+def get_connect_time():
+    """ Seconds spent by the current thread on opening connections since
+        the last reset
+    """
+    return getattr(_local, 'connect_time', 0.0)
+
+
+def get_body_size(body):
+    if isinstance(body, str):
+        return len(body.encode())
+    if isinstance(body, bytes):
+        return len(body)
+    return 0
+
+
+def get_timings(response, start, end, queued_at=None):
+    """ Return log values with timings of the request in milliseconds and
+        sizes of its bodies in bytes
+
+        :param start: perf_counter value when the request was sent
+        :param end: perf_counter value when the response was received
+        :param queued_at: perf_counter value when the request was queued
+    """
+    timings = {
+        'queue_time': (start - queued_at) * 1000 if queued_at else 0.0,
+        'connect_time': get_connect_time() * 1000,
+        'total_time': (end - start) * 1000,
+        'request_size': get_body_size(
+            getattr(getattr(response, 'request', None), 'body', None)),
+    }
+    elapsed = getattr(response, 'elapsed', None)
+    if isinstance(elapsed, timedelta):
+        # requests measures time until the response headers are parsed
+        timings['ttfb_time'] = elapsed.total_seconds() * 1000
+    content = getattr(response, '_content', None)
+    if isinstance(content, bytes):
+        timings['response_size'] = len(content)
+    return timings
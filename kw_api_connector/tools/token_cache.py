@@ -0,0 +1,29 @@
+import threading
+import time
+
+_tokens = {}
+_lock = threading.Lock()
+
+
+def get_token(key, margin=0):
+    """ Return token cached by the process for given key if it does not
+        expire within ``margin`` seconds
+
+        :param key: tuple (dbname, model, record id)
+    """
+    with _lock:
+        token, expire_at = _tokens.get(key, (None, None))
+    if token and (expire_at is None or expire_at - margin > time.time()):
+        return token
+    return None
+
+
+def set_token(key, token, expire_at=None):
+    """ :param expire_at: POSIX timestamp, token does not expire if None """
+    with _lock:
+        _tokens[key] = (token, expire_at)
+
+
+def drop_token(key):
+    with _lock:
+        _tokens.pop(key, None)
@@ -1 +1,2 @@
 from . import models
+from .tools.log_writer import register_worker_flush
@@ -8,7 +8,7 @@
 
     'category': 'Extra Tools',
     'license': 'LGPL-3',
-    'version': '18.0.0.4.8',
+    'version': '18.0.0.18.0',
 
     'depends': [
         'generic_mixin',
@@ -32,6 +32,9 @@
         'demo/http_request_log_demo.xml',
     ],
 
+    # flushes buffered logs when a worker of the prefork server stops
+    'post_load': 'register_worker_flush',
+
     # wait for generic_mixin on 18.0
     'installable': True,
     'auto_install': False,
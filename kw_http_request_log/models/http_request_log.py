@@ -1,11 +1,27 @@
 import base64
 import json
 import logging
+import time
+from datetime import timedelta
+
+from dateutil.relativedelta import relativedelta
 from lxml import etree  # nosec
-from odoo import api, fields, models
+from odoo import api, exceptions, fields, models, _
+from odoo.tools import config, sql, SQL
+from odoo.tools.lru import LRU
+
+from ..tools import codec, get_log_writer, partition
 
 _logger = logging.getLogger(__name__)
 
+PURGE_BATCH_SIZE = 5000
+PURGE_TIME_LIMIT = 600
+PARTITION_PREMAKE = 3
+BODY_FIELDS = ('request_body', 'response_body', 'error')
+COMPRESSED_COLUMNS = ('headers', 'request_body', 'response_body', 'error')
+
+_FORMAT_MEMO = LRU(256)
+
 
 class HTTPRequestLog(models.Model):
     _name = 'kw.http.request.log'
@@ -16,6 +32,7 @@ class HTTPRequestLog(models.Model):
     name = fields.Char(
         string='URL',
         required=True,
+        index='trigram',
         help='The full URL of the HTTP request, including protocol, domain, '
              'and path.')
     method = fields.Char(
@@ -32,10 +49,19 @@ class HTTPRequestLog(models.Model):
     request_body_xml = fields.Text(
         string='Request',
         compute='_compute_request_body_xml',)
+    request_body_formatted = fields.Text(
+        string='Request',
+        compute='_compute_body_formatted',)
     request_body_file = fields.Binary(
         help='Binary storage for large request bodies that exceed the '
              'body_text_log_limit. Used to prevent database performance '
              'issues with large requests.')
+    request_body_codec = fields.Char(
+        readonly=True,
+        help='Compression codec of the request body file.')
+    request_body_file_text = fields.Text(
+        string='Request',
+        compute='_compute_body_file_text', )
     code = fields.Char(
         help='HTTP response status code (e.g., 200 for success, 404 for '
              'not found, etc.).')
@@ -53,11 +79,52 @@ class HTTPRequestLog(models.Model):
         help='Binary storage for large response bodies that exceed the '
              'body_text_log_limit. Used to prevent database performance '
              'issues with large responses.')
+    response_body_codec = fields.Char(
+        readonly=True,
+        help='Compression codec of the response body file.')
+    response_body_file_text = fields.Text(
+        string='Response',
+        compute='_compute_body_file_text', )
     response_body_xml = fields.Text(
         string='Response',
         compute='_compute_response_body_xml',)
+    response_body_formatted = fields.Text(
+        string='Response',
+        compute='_compute_body_formatted',)
+    is_cache_hit = fields.Boolean(
+        readonly=True,
+        help='Response was served from the response cache or revalidated '
+             'by the API.')
+    request_size = fields.Integer(
+        readonly=True,
+        help='Size of sent request body in bytes.')
+    response_size = fields.Integer(
+        readonly=True,
+        help='Size of received response body in bytes, only a sample of '
+             'streamed body is stored.')
+    response_hash = fields.Char(
+        string='Response SHA-256',
+        readonly=True,
+        help='SHA-256 hash of streamed response body.')
+    queue_time = fields.Float(
+        string='Queue time, ms', readonly=True,
+        help='Time the request waited before it was sent, e.g. for the '
+             'rate limiter or retries.')
+    connect_time = fields.Float(
+        string='Connect time, ms', readonly=True,
+        help='Time of DNS lookup, TCP connect and TLS handshake, zero when '
+             'a pooled connection was reused.')
+    ttfb_time = fields.Float(
+        string='Time to first byte, ms', readonly=True,
+        help='Time between sending the request and receiving the response '
+             'headers.')
+    total_time = fields.Float(
+        string='Total time, ms', readonly=True,
+        help='Time between sending the request and receiving the whole '
+             'response body.')
     delete_by_date = fields.Date(
         default=fields.Date.today,
+        index=True,
         help='Date when this log entry should be deleted. Calculated based '
              'on the retention policy.')
     log_source_id = fields.Many2one(
@@ -75,32 +142,70 @@ class HTTPRequestLog(models.Model):
         help='Displays processing time in seconds', )
     process_time = fields.Datetime(
         readonly=True, )
+    is_error = fields.Boolean(
+        compute='_compute_is_error',
+        store=True, readonly=True,
+        help='Request failed or got response with non-2xx status code.')
+    log_uid = fields.Char(
+        index='btree_not_null', readonly=True, copy=False,
+        help='Key of the log row created through the buffered log writer. '
+             'Used to apply updates that arrive after the row was flushed.')
 
-    def _compute_request_body_xml(self):
+    def _compute_body_file_text(self):
         for obj in self:
-            obj.request_body_xml = obj.request_body
+            for x in ['request_body', 'response_body']:
+                value = obj.with_context(bin_size=False)[f'{x}_file']
+                codec_name = obj[f'{x}_codec']
+                if not value or codec_name in (False, 'none'):
+                    obj[f'{x}_file_text'] = False
+                    continue
+                obj[f'{x}_file_text'] = codec.decompress(
+                    base64.b64decode(value), codec_name
+                ).decode(errors='replace')
 
-    def _compute_response_body_xml(self):
+    @api.depends('code', 'error')
+    def _compute_is_error(self):
         for obj in self:
-            obj.response_body_xml = obj.response_body
+            obj.is_error = bool(obj.error) or bool(
+                obj.code and not obj.code.startswith('2'))
 
     @api.depends('process_time', 'create_date')
     def _compute_log_process_time(self):
         for obj in self:
             if obj.process_time and obj.create_date:
-                obj.log_process_time = (
+                obj.log_process_time = int((
                     obj.process_time - obj.create_date
-                ).seconds
+                ).total_seconds())
             else:
                 obj.log_process_time = 0
 
     def _compute_request_body_xml(self):
         for obj in self:
-            obj.request_body_xml = obj.request_body
+            obj.request_body_xml = obj._get_formatted_body('request_body')
 
     def _compute_response_body_xml(self):
         for obj in self:
-            obj.response_body_xml = obj.response_body
+            obj.response_body_xml = obj._get_formatted_body('response_body')
+
+    def _compute_body_formatted(self):
+        for obj in self:
+            for x in ['request_body', 'response_body']:
+                obj[f'{x}_formatted'] = obj._get_formatted_body(x)
+
+    def _get_formatted_body(self, fname):
+        """ Pretty-printed value of the body field for display, memoized
+            per record version
+        """
+        self.ensure_one()
+        value = self[fname]
+        if not value:
+            return value
+        key = (self.env.cr.dbname, self.id, fname, self.write_date)
+        result = _FORMAT_MEMO.get(key)
+        if result is None:
+            result = self.try_convert2formatted_json(value)
+            _FORMAT_MEMO[key] = result
+        return result
 
     @staticmethod
     def try_convert2formatted_json(val):
@@ -123,56 +228,106 @@ class HTTPRequestLog(models.Model):
                 _logger.debug(e)
         return val
 
+    @staticmethod
+    def convert2log_text(val):
+        """ Convert value to text to be stored as is, dict and list
+            values are dumped to JSON without indentation
+        """
+        if isinstance(val, (dict, list)):
+            try:
+                return json.dumps(val, ensure_ascii=False)
+            except Exception as e:
+                _logger.debug(e)
+        elif isinstance(val, bytes):
+            return val.decode(errors='replace')
+        elif isinstance(val, str):
+            return val
+        return str(val)
+
     def prepare_value(self, vals):
-        if self:
-            log_source = self.log_source_id
-        else:
-            log_source = self.env['kw.http.request.log.source'].sudo().browse(
-                vals.get('log_source_id'))
-        for x in ['request_body', 'response_body', 'error']:
+        log_source_id = self[:1].log_source_id.id if self \
+            else vals.get('log_source_id')
+        settings = self.env[
+            'kw.http.request.log.source']._get_log_source_settings(
+            log_source_id)
+        for x in BODY_FIELDS:
             if not vals.get(x):
                 continue
-            vals[x] = self.try_convert2formatted_json(vals.get(x))
+            vals[x] = self.convert2log_text(vals.get(x))
             if f'{x}_file' not in self._fields:
                 continue
-            if len(vals.get(x)) < log_source.body_text_log_limit * 1024:
+            if len(vals.get(x)) < settings['body_text_log_limit'] * 1024:
                 continue
-            vals[f'{x}_file'] = base64.b64encode(str.encode(vals[x]))
+            codec_name, body = codec.compress(
+                str.encode(vals[x]), settings['body_codec'],
+                settings['body_codec_level'])
+            vals[f'{x}_file'] = base64.b64encode(body)
+            vals[f'{x}_codec'] = codec_name
             vals[x] = ''
         return vals
 
     @api.model_create_multi
     def create(self, vals_list):
+        source_model = self.env['kw.http.request.log.source']
         for vals in vals_list:
-            vals = self.prepare_value(vals)
-            log_source = self.env['kw.http.request.log.source'].sudo().browse(
+            settings = source_model._get_log_source_settings(
                 vals.get('log_source_id'))
-            if not log_source.active:
+            if not settings or not settings['active']:
                 raise Exception('Log source is not active')
-            vals['delete_by_date'] = log_source.get_deletion_date()
+            vals = self.prepare_value(vals)
+            vals['delete_by_date'] = source_model._get_deletion_date(
+                settings['log_retention_period'])
         return super().create(vals_list)
 
     def write(self, vals):
-        for obj in self:
-            super(HTTPRequestLog, obj).write(self.prepare_value(vals))
+        if not any(vals.get(x) for x in BODY_FIELDS):
+            return super().write(vals)
+        # bodies are prepared once per log source, records of the same
+        # source are updated at once
+        for logs in self.grouped('log_source_id').values():
+            super(HTTPRequestLog, logs).write(logs.prepare_value(dict(vals)))
         return True
 
     @api.model
-    def create_in_new_transaction(self, vals):
-        log_source_name = vals.get('log_source_name')
-        log_source = False
+    def _prepare_new_transaction_vals(self, vals):
+        """ Resolve log source of vals, returns tuple (vals, settings) or
+            (False, settings) if the source does not log requests
+        """
+        source_model = self.env['kw.http.request.log.source']
+        log_source_name = vals.pop('log_source_name', False)
+        log_source_id = False
         if log_source_name:
-            log_source = self.env['kw.http.request.log.source'].sudo().search(
-                [('name', '=', log_source_name)], limit=1)
-        if not log_source:
+            log_source_id = source_model._get_log_source_id_by_name(
+                log_source_name)
+        if not log_source_id:
             log_source_id = vals.get('log_source_id')
             if not log_source_id:
-                return False
-            log_source = self.env['kw.http.request.log.source'].sudo().browse(
-                log_source_id)
-        if not log_source.is_log_enabled or not log_source.active:
+                return False, None
+        settings = source_model._get_log_source_settings(log_source_id)
+        if not settings:
+            raise exceptions.MissingError(_(
+                'HTTP request log source %s does not exist') % log_source_id)
+        if not settings['is_log_enabled'] or not settings['active']:
+            return False, settings
+        vals['log_source_id'] = log_source_id
+        vals['delete_by_date'] = source_model._get_deletion_date(
+            settings['log_retention_period'])
+        return vals, settings
+
+    @api.model
+    def create_in_new_transaction(self, vals):
+        """ Create log in a separate transaction
+
+            :return: id of created log, key of the row (str) if the log
+                source is buffered, or False if the log is not created;
+                the key is accepted by write_in_new_transaction, it is not
+                a record id
+        """
+        vals, settings = self._prepare_new_transaction_vals(vals)
+        if not vals:
             return False
-        vals['delete_by_date'] = log_source.get_deletion_date()
+        if settings['is_log_buffered']:
+            return get_log_writer(self.env.cr.dbname).add(vals)
 
         result = False
         with self._in_new_transaction(no_raise=False) as nself:
@@ -181,8 +336,32 @@ class HTTPRequestLog(models.Model):
                 result = log.id
         return result
 
+    @api.model
+    def create_multi_in_new_transaction(self, vals_list):
+        """ Create several logs in one transaction
+
+            :return: list of ids (or keys of buffered rows) of created logs
+        """
+        result = []
+        to_create = []
+        for vals in vals_list:
+            vals, settings = self._prepare_new_transaction_vals(vals)
+            if not vals:
+                continue
+            if settings['is_log_buffered']:
+                result.append(get_log_writer(self.env.cr.dbname).add(vals))
+            else:
+                to_create.append(vals)
+        if to_create:
+            with self._in_new_transaction(no_raise=False) as nself:
+                result += nself.create(to_create).ids
+        return result
+
     @api.model
     def write_in_new_transaction(self, log_id, vals):
+        if isinstance(log_id, str):
+            # key of the row created through the buffered log writer
+            return get_log_writer(self.env.cr.dbname).update(log_id, vals)
         result = False
         with self._in_new_transaction(no_raise=True) as nself:
             log = nself.sudo().browse(log_id)
@@ -191,8 +370,226 @@ class HTTPRequestLog(models.Model):
         return result
 
     @api.model
-    def cron_delete_outdated_logs(self):
-        """Delete logs older than log_retention_period"""
-        self.env['kw.http.request.log'].sudo().search([
-            ('delete_by_date', '<', fields.Date.today()),
-        ]).unlink()
+    def _setup_fields(self):
+        super()._setup_fields()
+        # the partition key is a part of the primary key of partitioned
+        # table, so the ORM must not drop its NOT NULL constraint on update
+        key = self._get_partition_key()
+        if key in partition.PARTITION_KEYS:
+            self._fields[key].required = True
+
+    def _auto_init(self):
+        with partition.existing_table(self.env.cr, self._table):
+            self._init_is_error_column()
+            return super()._auto_init()
+
+    def _init_is_error_column(self):
+        """ The error flag of existing logs is set by a single UPDATE, so
+            the ORM does not compute it row by row when the column is added
+            to a large log table on module update
+        """
+        cr = self.env.cr
+        if not sql.table_exists(cr, self._table) \
+                or sql.column_exists(cr, self._table, 'is_error'):
+            return
+        sql.create_column(cr, self._table, 'is_error', 'boolean')
+        cr.execute(SQL(
+            "UPDATE %s SET is_error = (error IS NOT NULL AND error != '') "
+            "OR (code IS NOT NULL AND code != '' AND code !~ '^2')",
+            SQL.identifier(self._table)))
+
+    def init(self):
+        self._init_partitions()
+        self._init_column_compression()
+        # default list of recent logs, list of logs of a source and list
+        # of failed requests, indexes of partitioned table are created on
+        # each partition
+        sql.create_index(
+            self.env.cr, 'kw_http_request_log_create_date_index',
+            self._table, ['create_date DESC'])
+        sql.create_index(
+            self.env.cr, 'kw_http_request_log_source_create_date_index',
+            self._table, ['log_source_id', 'create_date DESC'])
+        sql.create_index(
+            self.env.cr, 'kw_http_request_log_error_index',
+            self._table, ['create_date DESC'], where='is_error')
+
+    def _init_column_compression(self):
+        """ Inline bodies are compressed by PostgreSQL TOAST, server option
+            kw_http_request_log_column_compression (pglz or lz4) selects
+            the method for new values (PostgreSQL 14+)
+        """
+        method = config.get('kw_http_request_log_column_compression')
+        if method not in ('pglz', 'lz4'):
+            return
+        if self.env.cr._cnx.server_version < 140000:
+            _logger.warning('Column compression requires PostgreSQL 14+')
+            return
+        for column in COMPRESSED_COLUMNS:
+            self.env.cr.execute(SQL(
+                "ALTER TABLE %s ALTER COLUMN %s SET COMPRESSION %s",
+                SQL.identifier(self._table), SQL.identifier(column),
+                SQL(method)))
+
+    def _init_partitions(self):
+        key, interval = self._get_partition_settings()
+        if not key or partition.is_partitioned(self.env.cr, self._table):
+            return
+        partition.partition_table(
+            self.env.cr, self._table, key, interval,
+            self._get_partition_horizon(key, interval))
+        if not sql.get_foreign_keys(
+                self.env.cr, self._table, 'log_source_id',
+                'kw_http_request_log_source', 'id', 'cascade'):
+            sql.add_foreign_key(
+                self.env.cr, self._table, 'log_source_id',
+                'kw_http_request_log_source', 'id', 'cascade')
+        self.pool.check_indexes(self.env.cr, [self._name])
+
+    @api.model
+    def _get_partition_settings(self):
+        """ Partitioning is enabled by server options
+            kw_http_request_log_partition_key (create_date or delete_by_date)
+            and kw_http_request_log_partition_interval (day or month)
+
+            :return: tuple (key, interval) or (False, False)
+        """
+        key = config.get('kw_http_request_log_partition_key')
+        if key not in partition.PARTITION_KEYS:
+            return False, False
+        interval = config.get('kw_http_request_log_partition_interval')
+        if interval not in partition.PARTITION_INTERVALS:
+            interval = 'month'
+        return key, interval
+
+    @api.model
+    def _get_partition_key(self):
+        """ Column the log table is partitioned by, the table stays
+            partitioned when the server option is removed
+        """
+        return self._get_partition_settings()[0] or \
+            partition.get_partition_key(self.env.cr, self._table)
+
+    @api.model
+    def _get_partition_horizon(self, key, interval):
+        """ Last date partitions have to be created for in advance """
+        horizon = fields.Date.today() + relativedelta(
+            **{f'{interval}s': PARTITION_PREMAKE})
+        if key == 'delete_by_date':
+            self.env.cr.execute(
+                "SELECT COALESCE(MAX(log_retention_period), 0) "
+                "FROM kw_http_request_log_source")
+            horizon += timedelta(days=self.env.cr.fetchone()[0])
+        return horizon
+
+    @api.model
+    def _manage_log_partitions(self):
+        """ Create partitions for coming periods and drop partitions
+            that contain only outdated logs
+
+            :return: tuple (removed rows, reclaimed bytes)
+        """
+        key, interval = self._get_partition_settings()
+        cr = self.env.cr
+        if not key or not partition.is_partitioned(cr, self._table):
+            return 0, 0
+        today = fields.Date.today()
+        partition.create_partitions(
+            cr, self._table, today,
+            self._get_partition_horizon(key, interval), interval)
+        rows = size = 0
+        for name, __, upper in partition.get_partitions(cr, self._table):
+            if not upper or upper > today:
+                continue
+            if key == 'create_date':
+                cr.execute(SQL(
+                    "SELECT 1 FROM %s WHERE delete_by_date >= %s LIMIT 1",
+                    SQL.identifier(name), today))
+                if cr.fetchone():
+                    continue
+            cr.execute(SQL(
+                "SELECT a.id FROM ir_attachment a WHERE a.res_model = %s "
+                "AND a.res_field IN %s AND a.res_id IN (SELECT id FROM %s)",
+                self._name, ('request_body_file', 'response_body_file'),
+                SQL.identifier(name)))
+            size += self._unlink_log_files(
+                self.env['ir.attachment'].sudo().browse(
+                    [r[0] for r in cr.fetchall()]))
+            cr.execute(SQL(
+                "SELECT COUNT(*), pg_total_relation_size(%s::regclass) "
+                "FROM %s", name, SQL.identifier(name)))
+            part_rows, part_bytes = cr.fetchone()
+            cr.execute(SQL("DROP TABLE %s", SQL.identifier(name)))
+            cr.commit()  # pylint: disable=invalid-commit
+            _logger.info('Dropped outdated HTTP request log partition %s',
+                         name)
+            rows += part_rows
+            size += part_bytes
+        return rows, size
+
+    @api.model
+    def _unlink_log_files(self, attachments):
+        size = sum(attachments.mapped('file_size'))
+        attachments.unlink()
+        return size
+
+    @api.model
+    def _purge_logs(self, ids):
+        """ Remove logs and their body files bypassing ORM unlink
+
+            :return: tuple (removed rows, reclaimed bytes)
+        """
+        size = self._unlink_log_files(
+            self.env['ir.attachment'].sudo().search([
+                ('res_model', '=', self._name),
+                ('res_field', 'in',
+                 ['request_body_file', 'response_body_file']),
+                ('res_id', 'in', ids)]))
+        self.env.cr.execute(SQL(
+            "SELECT COALESCE(SUM(pg_column_size(t.*)), 0) FROM %s t "
+            "WHERE t.id = ANY(%s)", SQL.identifier(self._table), ids))
+        size += self.env.cr.fetchone()[0]
+        self.env.cr.execute(SQL(
+            "DELETE FROM %s WHERE id = ANY(%s)",
+            SQL.identifier(self._table), ids))
+        return self.env.cr.rowcount, size
+
+    @api.model
+    def cron_delete_outdated_logs(self, batch_size=PURGE_BATCH_SIZE,
+                                  time_limit=PURGE_TIME_LIMIT):
+        """Delete logs older than log_retention_period
+
+        Logs are removed in batches ordered by id with a commit after each
+        batch. If the run takes longer than time_limit seconds, the cron is
+        triggered again to continue. When the table is partitioned,
+        partitions with outdated logs only are dropped as a whole.
+        """
+        deadline = time.monotonic() + time_limit
+        today = fields.Date.today()
+        rows, size = self._manage_log_partitions()
+        while True:
+            self.env.cr.execute(SQL(
+                "SELECT id FROM %s WHERE delete_by_date < %s "
+                "ORDER BY id LIMIT %s",
+                SQL.identifier(self._table), today, batch_size))
+            ids = [r[0] for r in self.env.cr.fetchall()]
+            if not ids:
+                break
+            batch_rows, batch_bytes = self._purge_logs(ids)
+            rows += batch_rows
+            size += batch_bytes
+            self.env.cr.commit()  # pylint: disable=invalid-commit
+            if len(ids) < batch_size:
+                break
+            if time.monotonic() >= deadline:
+                cron = self.env.ref(
+                    'kw_http_request_log.cleanup_outdated_log_cron',
+                    raise_if_not_found=False)
+                if cron:
+                    cron._trigger()
+                break
+        self.invalidate_model()
+        _logger.info(
+            'Outdated HTTP request logs removed: %s rows, %s bytes reclaimed',
+            rows, size)
+        return {'rows': rows, 'bytes': size}
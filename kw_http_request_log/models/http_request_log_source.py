@@ -1,12 +1,21 @@
 import logging
 import os
+import random
+import threading
 from base64 import b64encode
 from datetime import timedelta
 
-from odoo import fields, models, api
+from odoo import fields, models, api, tools, _
+from odoo.exceptions import ValidationError
+
+from ..tools.codec import BODY_CODECS
+from ..tools.token_bucket import TokenBucket
 
 _logger = logging.getLogger(__name__)
 
+_buckets = {}
+_buckets_lock = threading.Lock()
+
 
 class HTTPRequestLogSource(models.Model):
     _name = 'kw.http.request.log.source'
@@ -47,6 +56,57 @@ class HTTPRequestLogSource(models.Model):
              'stored as an attachment file instead of text field. This helps '
              'to manage database size and performance.')
 
+    log_sample_rate = fields.Float(
+        default=1.0,
+        string='Sampling ratio',
+        help='Share of successful requests that are logged, from 0 to 1. '
+             'Errors and non-2xx responses are logged regardless of '
+             'sampling.')
+    log_rate_limit = fields.Integer(
+        string='Max logs per second',
+        help='Maximum number of logs written per second by each worker, '
+             'errors included. Set to 0 to disable the limit.')
+    is_log_body_on_error_only = fields.Boolean(
+        string='Bodies of failures only',
+        help='If enabled, only URL, headers and result code are stored for '
+             'successful requests, request and response bodies are stored '
+             'for failed requests only.')
+    is_log_cache_hits = fields.Boolean(
+        default=True,
+        string='Log cache hits',
+        help='If enabled, requests served from the response cache are '
+             'logged without bodies, otherwise they are not logged.')
+    body_codec = fields.Selection(
+        selection=BODY_CODECS,
+        default='none',
+        string='Body compression',
+        help='Compression of request and response bodies that are stored '
+             'as files. zstd falls back to gzip if the zstandard library '
+             'is not installed.')
+    body_codec_level = fields.Integer(
+        string='Compression level',
+        help='Compression level of the body codec, 0 means codec default.')
+    is_log_buffered = fields.Boolean(
+        string='Buffered logging',
+        help='If enabled, logs are collected in memory and written in '
+             'batches by a background thread instead of one transaction '
+             'per request. Logs appear with a small delay and may be lost '
+             'if the server is killed.')
+    log_dropped_count = fields.Integer(
+        string='Dropped logs',
+        readonly=True,
+        help='Number of buffered logs that were dropped because the buffer '
+             'was full or the logs could not be written.')
+    is_log_deferred = fields.Boolean(
+        string='Deferred logging',
+        help='If enabled, the log of a request is written once the request '
+             'is completed, in one transaction instead of two. Requests '
+             'that last longer than the threshold are logged when the '
+             'threshold is reached to stay visible while in progress.')
+    log_deferred_threshold = fields.Float(
+        default=5.0,
+        string='Deferred logging threshold, s', )
+
     type = fields.Selection(
         default='json',
         selection=[
@@ -54,10 +114,103 @@ class HTTPRequestLogSource(models.Model):
             ('xml', 'XML'),
             ('html', 'HTML')], )
 
-    def get_deletion_date(self):
+    @api.constrains('log_sample_rate')
+    def _constrains_log_sample_rate(self):
+        for obj in self:
+            if not 0 <= obj.log_sample_rate <= 1:
+                msg = _('Wrong sampling ratio: must be from 0 to 1')
+                raise ValidationError(msg)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return res
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
+
+    @api.model
+    @tools.ormcache('source_id')
+    def _get_log_source_settings(self, source_id):
+        """ Settings of the log source cached per process, the cache is
+            cleared on every change of log sources
+
+            :return: frozendict of field values or None if there is no
+                source with given id
+        """
+        source = self.sudo().with_context(active_test=False).browse(
+            source_id).exists()
+        if not source:
+            return None
+        return tools.frozendict({
+            'id': source.id,
+            'active': source.active,
+            'is_log_enabled': source.is_log_enabled,
+            'log_retention_period': source.log_retention_period,
+            'body_text_log_limit': source.body_text_log_limit,
+            'body_codec': source.body_codec,
+            'body_codec_level': source.body_codec_level,
+            'is_log_buffered': source.is_log_buffered,
+            'is_log_deferred': source.is_log_deferred,
+            'log_deferred_threshold': source.log_deferred_threshold,
+            'log_sample_rate': source.log_sample_rate,
+            'log_rate_limit': source.log_rate_limit,
+            'is_log_body_on_error_only': source.is_log_body_on_error_only,
+            'is_log_cache_hits': source.is_log_cache_hits,
+        })
+
+    @api.model
+    @tools.ormcache('name')
+    def _get_log_source_id_by_name(self, name):
+        return self.sudo().search([('name', '=', name)], limit=1).id
+
+    def get_log_settings(self):
         self.ensure_one()
+        return self._get_log_source_settings(self.id)
+
+    @api.model
+    def _get_deletion_date(self, log_retention_period):
         return (fields.Datetime.now() + timedelta(
-            days=self.log_retention_period)).date()
+            days=log_retention_period)).date()
+
+    def get_deletion_date(self):
+        self.ensure_one()
+        return self._get_deletion_date(
+            self.get_log_settings()['log_retention_period'])
+
+    def _get_log_bucket(self, rate):
+        key = (self.env.cr.dbname, self.id)
+        bucket = _buckets.get(key)
+        if bucket is None or bucket.rate != rate:
+            with _buckets_lock:
+                bucket = _buckets[key] = TokenBucket(rate)
+        return bucket
+
+    def is_log_sampled(self, is_error=False):
+        """ Decide whether a request has to be logged, called before any
+            log data is prepared
+
+            :param is_error: request failed or returned non-2xx response
+        """
+        settings = self.get_log_settings()
+        if not settings['is_log_enabled'] or not settings['active']:
+            return False
+        sample_rate = settings['log_sample_rate']
+        if not is_error and sample_rate < 1 \
+                and random.random() >= sample_rate:  # nosec
+            return False
+        if settings['log_rate_limit'] > 0:
+            return self._get_log_bucket(
+                settings['log_rate_limit']).consume()
+        return True
 
     def create_log(self, vals):
         self.ensure_one()
@@ -65,6 +218,15 @@ class HTTPRequestLogSource(models.Model):
         log_model = self.env['kw.http.request.log'].sudo()
         return log_model.create_in_new_transaction(vals)
 
+    def create_logs(self, vals_list):
+        self.ensure_one()
+        if not vals_list:
+            return []
+        for vals in vals_list:
+            vals['log_source_id'] = self.id
+        log_model = self.env['kw.http.request.log'].sudo()
+        return log_model.create_multi_in_new_transaction(vals_list)
+
     @api.model
     def update_log(self, log_id, vals):
         if not log_id:
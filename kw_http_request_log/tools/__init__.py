@@ -0,0 +1 @@
+from .log_writer import get_log_writer, HTTPRequestLogWriter
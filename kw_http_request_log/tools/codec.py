@@ -0,0 +1,47 @@
+import gzip
+import logging
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+    _logger.debug('zstandard is not installed, zstd body codec falls '
+                  'back to gzip')
+
+BODY_CODECS = [
+    ('none', 'None'),
+    ('gzip', 'gzip'),
+    ('zstd', 'zstd'),
+]
+
+DEFAULT_LEVELS = {
+    'gzip': 6,
+    'zstd': 3,
+}
+
+
+def compress(data, codec, level=0):
+    """ Compress bytes with given codec
+
+        :return: tuple (codec that was actually used, compressed bytes)
+    """
+    if codec == 'zstd' and zstandard is None:
+        codec = 'gzip'
+    level = level or DEFAULT_LEVELS.get(codec)
+    if codec == 'gzip':
+        return codec, gzip.compress(data, compresslevel=level)
+    if codec == 'zstd':
+        return codec, zstandard.ZstdCompressor(level=level).compress(data)
+    return 'none', data
+
+
+def decompress(data, codec):
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstandard is required to read zstd bodies')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
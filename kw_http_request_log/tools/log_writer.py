@@ -0,0 +1,255 @@
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+
+from odoo import api, SUPERUSER_ID
+from odoo.modules.registry import Registry
+from odoo.service import server
+from odoo.tools import config, SQL
+
+_logger = logging.getLogger(__name__)
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+class HTTPRequestLogWriter:
+    """ In-process buffer for kw.http.request.log rows.
+
+        Rows are kept in memory and bulk-inserted by a background thread
+        on its own cursor, so logging a request costs no commit for the
+        caller. Updates of rows that are still buffered are merged in
+        memory, updates of already flushed rows are applied by the next
+        flush. When the buffer is full, callers wait up to
+        ``block_timeout`` seconds and the row is dropped after that.
+        Dropped rows are counted on their log source by the next flush.
+    """
+
+    def __init__(self, dbname, buffer_size=10000, flush_size=100,
+                 flush_interval=1.0, block_timeout=0.5):
+        self.dbname = dbname
+        self.buffer_size = buffer_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self._dropped_sources = {}
+        self._creates = {}
+        self._updates = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopped = False
+
+    def __len__(self):
+        return len(self._creates) + len(self._updates)
+
+    def _drop(self, source_ids):
+        """ Must be called with self._cond acquired """
+        self.dropped += len(source_ids)
+        for source_id in source_ids:
+            if source_id:
+                self._dropped_sources[source_id] = \
+                    self._dropped_sources.get(source_id, 0) + 1
+
+    def _wait_for_room(self, source_id=None):
+        """ Must be called with self._cond acquired """
+        if len(self) < self.buffer_size:
+            return True
+        self._cond.notify_all()
+        deadline = time.monotonic() + self.block_timeout
+        while len(self) >= self.buffer_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._drop([source_id])
+                _logger.warning(
+                    'HTTP request log buffer is full, %s rows dropped so far',
+                    self.dropped)
+                return False
+            self._cond.wait(remaining)
+        return True
+
+    def add(self, vals):
+        log_uid = uuid.uuid4().hex
+        with self._cond:
+            if not self._wait_for_room(vals.get('log_source_id')):
+                return False
+            self._creates[log_uid] = dict(vals, log_uid=log_uid)
+            if len(self) >= self.flush_size:
+                self._cond.notify_all()
+        self._ensure_thread()
+        return log_uid
+
+    def update(self, log_uid, vals):
+        with self._cond:
+            if log_uid in self._creates:
+                self._creates[log_uid].update(vals)
+                return True
+            if log_uid not in self._updates and not self._wait_for_room():
+                return False
+            self._updates.setdefault(log_uid, {}).update(vals)
+            if len(self) >= self.flush_size:
+                self._cond.notify_all()
+        self._ensure_thread()
+        return True
+
+    def flush(self):
+        with self._flush_lock:
+            with self._cond:
+                creates, self._creates = self._creates, {}
+                updates, self._updates = self._updates, {}
+                self._cond.notify_all()
+            count = len(creates) + len(updates)
+            if count:
+                try:
+                    self._write(list(creates.values()), updates)
+                except Exception:
+                    with self._cond:
+                        self._drop([
+                            vals.get('log_source_id')
+                            for vals in creates.values()
+                        ] + [None] * len(updates))
+                    _logger.exception(
+                        'Cannot write %s buffered HTTP request logs', count)
+                    count = 0
+            self._write_dropped()
+            return count
+
+    def _write_dropped(self):
+        """ Add counts of dropped rows to their log sources """
+        with self._cond:
+            dropped, self._dropped_sources = self._dropped_sources, {}
+        if not dropped:
+            return
+        _logger.warning(
+            'HTTP request logs dropped by log source: %s', dropped)
+        try:
+            with Registry(self.dbname).cursor() as cr:
+                for source_id, count in dropped.items():
+                    cr.execute(SQL(
+                        "UPDATE kw_http_request_log_source "
+                        "SET log_dropped_count = "
+                        "COALESCE(log_dropped_count, 0) + %s "
+                        "WHERE id = %s", count, source_id))
+        except Exception:
+            with self._cond:
+                for source_id, count in dropped.items():
+                    self._dropped_sources[source_id] = \
+                        self._dropped_sources.get(source_id, 0) + count
+            _logger.exception('Cannot count dropped HTTP request logs')
+
+    def _write(self, vals_list, updates):
+        registry = Registry(self.dbname)
+        with registry.cursor() as cr:
+            log_model = api.Environment(
+                cr, SUPERUSER_ID, {})['kw.http.request.log']
+            if vals_list:
+                try:
+                    with cr.savepoint():
+                        log_model.create(vals_list)
+                except Exception as e:
+                    _logger.debug(e)
+                    self._write_one_by_one(cr, log_model, vals_list)
+            if updates:
+                logs = log_model.search([
+                    ('log_uid', 'in', list(updates))])
+                for log in logs:
+                    log.write(updates[log.log_uid])
+
+    def _write_one_by_one(self, cr, log_model, vals_list):
+        for vals in vals_list:
+            try:
+                with cr.savepoint():
+                    log_model.create(vals)
+            except Exception as e:
+                with self._cond:
+                    self._drop([vals.get('log_source_id')])
+                _logger.warning('Cannot write HTTP request log: %s', e)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopped and len(self) < self.flush_size:
+                    self._cond.wait(self.flush_interval)
+                stopped = self._stopped
+            self.flush()
+            if stopped:
+                return
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._pid == os.getpid() \
+                and self._thread.is_alive():
+            return
+        if Registry(self.dbname).in_test_mode():
+            # tests flush explicitly, the test cursor is not thread-safe
+            return
+        with self._cond:
+            if self._thread is not None and self._pid == os.getpid() \
+                    and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, daemon=True,
+                name=f'kw.http.request.log.writer.{self.dbname}')
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self.flush()
+
+
+def get_log_writer(dbname):
+    writer = _writers.get(dbname)
+    if writer is not None:
+        return writer
+    with _writers_lock:
+        if dbname not in _writers:
+            _writers[dbname] = HTTPRequestLogWriter(
+                dbname,
+                buffer_size=int(config.get(
+                    'kw_http_request_log_buffer_size', 10000)),
+                flush_size=int(config.get(
+                    'kw_http_request_log_flush_size', 100)),
+                flush_interval=float(config.get(
+                    'kw_http_request_log_flush_interval', 1.0)),
+                block_timeout=float(config.get(
+                    'kw_http_request_log_block_timeout', 0.5)), )
+        return _writers[dbname]
+
+
+@atexit.register
+def _flush_all_writers():
+    for writer in list(_writers.values()):
+        try:
+            writer.stop()
+        except Exception as e:
+            _logger.warning('Cannot flush HTTP request log buffer: %s', e)
+
+
+def register_worker_flush():
+    """ Flush buffers when a prefork worker stops, workers recycled by
+        request or memory limits may exit without running atexit handlers.
+        Called by the post_load hook of the module, threaded and gevent
+        servers flush buffers at exit only.
+    """
+    if not isinstance(server.server, server.PreforkServer):
+        return
+    stop = server.Worker.stop
+    if getattr(stop, 'kw_flush_log_writers', False):
+        return
+
+    def stop_worker(worker):
+        _flush_all_writers()
+        return stop(worker)
+
+    stop_worker.kw_flush_log_writers = True
+    server.Worker.stop = stop_worker
@@ -0,0 +1,179 @@
+import logging
+import re
+from contextlib import contextmanager
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+
+from odoo.tools import sql, SQL
+
+_logger = logging.getLogger(__name__)
+
+PARTITION_KEYS = ('create_date', 'delete_by_date')
+PARTITION_INTERVALS = ('day', 'month')
+
+_BOUND_RE = re.compile(r"FROM \('(\d{4}-\d{2}-\d{2})[^']*'\) "
+                       r"TO \('(\d{4}-\d{2}-\d{2})[^']*'\)")
+
+
+def period_start(value, interval):
+    if interval == 'month':
+        return value.replace(day=1)
+    return value
+
+
+def period_end(start, interval):
+    if interval == 'month':
+        return start + relativedelta(months=1)
+    return start + relativedelta(days=1)
+
+
+def partition_name(table, start, interval):
+    if interval == 'month':
+        return f'{table}_p{start:%Y%m}'
+    return f'{table}_p{start:%Y%m%d}'
+
+
+def is_partitioned(cr, table):
+    cr.execute("""
+        SELECT c.relkind
+          FROM pg_class c
+          JOIN pg_namespace n ON n.oid = c.relnamespace
+         WHERE c.relname = %s AND n.nspname = current_schema
+    """, (table, ))
+    row = cr.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+@contextmanager
+def existing_table(cr, table):
+    """ The ORM looks up regular tables and views only, so it would try to
+        create a partitioned table again on module update, such table is
+        reported as existing within the block
+    """
+    if not is_partitioned(cr, table):
+        yield
+        return
+    table_exists = sql.table_exists
+
+    def exists(cr, tablename):
+        return tablename == table or table_exists(cr, tablename)
+
+    sql.table_exists = exists
+    try:
+        yield
+    finally:
+        sql.table_exists = table_exists
+
+
+def get_partition_key(cr, table):
+    """ Return the column the table is partitioned by or None """
+    cr.execute("""
+        SELECT a.attname
+          FROM pg_partitioned_table pt
+          JOIN pg_attribute a ON a.attrelid = pt.partrelid
+                             AND a.attnum = pt.partattrs[0]
+         WHERE pt.partrelid = to_regclass(%s)
+    """, (table, ))
+    row = cr.fetchone()
+    return row and row[0]
+
+
+def get_partitions(cr, table):
+    """ Return list of tuples (name, lower date, upper date), the default
+        partition is returned with empty bounds
+    """
+    cr.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+          FROM pg_inherits i
+          JOIN pg_class c ON c.oid = i.inhrelid
+          JOIN pg_class p ON p.oid = i.inhparent
+         WHERE p.relname = %s
+         ORDER BY c.relname
+    """, (table, ))
+    result = []
+    for name, bound in cr.fetchall():
+        match = _BOUND_RE.search(bound or '')
+        if match:
+            result.append((name, date.fromisoformat(match.group(1)),
+                           date.fromisoformat(match.group(2))))
+        else:
+            result.append((name, None, None))
+    return result
+
+
+def create_partition(cr, table, start, interval):
+    """ Create partition for the period that starts at ``start``.
+
+        Creation fails if the default partition already holds rows of the
+        period, such rows stay in the default partition.
+    """
+    name = partition_name(table, start, interval)
+    try:
+        with cr.savepoint():
+            cr.execute(SQL(
+                "CREATE TABLE IF NOT EXISTS %s PARTITION OF %s "
+                "FOR VALUES FROM (%s) TO (%s)",
+                SQL.identifier(name), SQL.identifier(table),
+                start.isoformat(), period_end(start, interval).isoformat()))
+    except Exception as e:
+        _logger.warning('Cannot create partition %s: %s', name, e)
+        return False
+    return name
+
+
+def create_partitions(cr, table, date_from, date_to, interval):
+    start = period_start(date_from, interval)
+    while start <= date_to:
+        create_partition(cr, table, start, interval)
+        start = period_end(start, interval)
+
+
+def partition_table(cr, table, key, interval, date_to):
+    """ Replace regular table by a table partitioned by range of ``key``.
+
+        Existing rows are copied to partitions created for their periods,
+        partitions are also created up to ``date_to``.
+    """
+    legacy = f'{table}_legacy'
+    sequence = f'{table}_id_seq'
+    _logger.info('Converting table %s to partitions by %s of %s',
+                 table, interval, key)
+    if key == 'delete_by_date':
+        cr.execute(SQL(
+            "UPDATE %s SET delete_by_date = COALESCE(create_date, "
+            "now() AT TIME ZONE 'UTC')::date WHERE delete_by_date IS NULL",
+            SQL.identifier(table)))
+    else:
+        cr.execute(SQL(
+            "UPDATE %s SET create_date = now() AT TIME ZONE 'UTC' "
+            "WHERE create_date IS NULL", SQL.identifier(table)))
+    cr.execute(SQL("SELECT MIN(%s)::date, MAX(%s)::date FROM %s",
+                   SQL.identifier(key), SQL.identifier(key),
+                   SQL.identifier(table)))
+    date_min, date_max = cr.fetchone()
+
+    cr.execute(SQL("ALTER TABLE %s RENAME TO %s",
+                   SQL.identifier(table), SQL.identifier(legacy)))
+    cr.execute(SQL("ALTER TABLE %s RENAME CONSTRAINT %s TO %s",
+                   SQL.identifier(legacy), SQL.identifier(f'{table}_pkey'),
+                   SQL.identifier(f'{legacy}_pkey')))
+    cr.execute(SQL("ALTER SEQUENCE %s OWNED BY NONE",
+                   SQL.identifier(sequence)))
+    cr.execute(SQL(
+        "CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+        "INCLUDING COMMENTS) PARTITION BY RANGE (%s)",
+        SQL.identifier(table), SQL.identifier(legacy), SQL.identifier(key)))
+    cr.execute(SQL("ALTER TABLE %s ADD PRIMARY KEY (id, %s)",
+                   SQL.identifier(table), SQL.identifier(key)))
+    cr.execute(SQL("CREATE TABLE %s PARTITION OF %s DEFAULT",
+                   SQL.identifier(f'{table}_default'),
+                   SQL.identifier(table)))
+    create_partitions(
+        cr, table, min(date_min or date_to, date_to),
+        max(date_max or date_to, date_to), interval)
+    cr.execute(SQL("INSERT INTO %s SELECT * FROM %s",
+                   SQL.identifier(table), SQL.identifier(legacy)))
+    cr.execute(SQL("DROP TABLE %s", SQL.identifier(legacy)))
+    cr.execute(SQL("ALTER SEQUENCE %s OWNED BY %s",
+                   SQL.identifier(sequence), SQL.identifier(table, 'id')))
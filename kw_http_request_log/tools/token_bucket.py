@@ -0,0 +1,45 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """ Thread-safe token bucket, ``rate`` tokens per second are added up
+        to ``capacity``
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        """ Must be called with self._lock acquired """
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, tokens=1):
+        with self._lock:
+            self._refill()
+            if self.tokens < tokens:
+                return False
+            self.tokens -= tokens
+            return True
+
+    def reserve(self, tokens=1, max_wait=0):
+        """ Take tokens in advance, the balance goes below zero while the
+            caller waits for its turn
+
+            :return: tokens available before the reservation, None if the
+                last token would be added in more than max_wait seconds
+        """
+        with self._lock:
+            self._refill()
+            available = self.tokens
+            if available - tokens < -max_wait * self.rate:
+                return None
+            self.tokens -= tokens
+            return available
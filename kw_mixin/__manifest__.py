@@ -16,7 +16,7 @@
 
     'category': 'Extra Tools',
     'license': 'LGPL-3',
-    'version': '18.0.1.6.1',
+    'version': '18.0.1.7.0',
 
     'depends': [
         'base',
@@ -1,17 +1,50 @@
 import logging
+from weakref import WeakKeyDictionary
 
 _logger = logging.getLogger(__name__)
 
+# model class -> {(method name, suffix): hook function or None}
+_hooks = WeakKeyDictionary()
+
+
+def get_hook(record, name, suffix):
+    """ Return method ``<name>_<suffix>`` of the record class or None
+
+        Lookups are cached per model class, classes are rebuilt with the
+        registry, so the cache does not outlive them.
+    """
+    cls = type(record)
+    hooks = _hooks.get(cls)
+    if hooks is None:
+        hooks = _hooks.setdefault(cls, {})
+    key = (name, suffix)
+    try:
+        return hooks[key]
+    except KeyError:
+        hook = hooks[key] = getattr(cls, f'{name}_{suffix}', None)
+        return hook
+
+
+def clear_hooks(cls=None):
+    """ Forget cached hooks, required if hook methods are added to model
+        classes at runtime
+    """
+    if cls is None:
+        _hooks.clear()
+    else:
+        _hooks.pop(cls, None)
+
 
 def use_fname(*deco_args):
     def decorator(func, *aa):
+        f = deco_args[0] if deco_args else 'code'
+
         def wrapper(*args, **kwargs):
             self = args[0]
             self.ensure_one()
-            f = deco_args[0] if deco_args else 'code'
-            fname = f'{func.__name__}_{getattr(self, f)}'
-            if hasattr(self, fname):
-                return getattr(self, fname)(*args[1:], **kwargs)
+            hook = get_hook(self, func.__name__, getattr(self, f))
+            if hook is not None:
+                return hook(*args, **kwargs)
             return func(*args, **kwargs)
 
         return wrapper
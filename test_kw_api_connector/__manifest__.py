@@ -9,7 +9,7 @@
     'category': 'Extra Tools',
     'license': 'LGPL-3',
 
-    'version': '18.0.0.2.3',
+    'version': '18.0.0.19.0',
 
     'depends': [
         'kw_api_connector',
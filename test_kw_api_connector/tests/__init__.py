@@ -1,3 +1,5 @@
 from . import (
+    test_api_pipeline_benchmark,
     test_credential,
+    test_credential_benchmark,
 )
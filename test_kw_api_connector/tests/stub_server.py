@@ -0,0 +1,86 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        status, body, headers = self.server.get_response()
+        time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _respond
+
+
+class StubServer(ThreadingHTTPServer):
+    """ Local HTTP server answering API requests with JSON payload of the
+        given size after the given latency, a share of requests fails with
+        500 or is throttled with 429
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, size=1024, error_rate=0.0,
+                 throttle_rate=0.0, seed=0):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.requests = 0
+        self.configure(latency, size, error_rate, throttle_rate)
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % self.server_address[:2]
+
+    def configure(self, latency=0.0, size=1024, error_rate=0.0,
+                  throttle_rate=0.0):
+        """ :param latency: seconds before each response is sent
+            :param size: approximate size of successful response in bytes
+        """
+        item = {'id': 0, 'name': 'Product name', 'price': 10.5}
+        item_size = len(json.dumps(item)) + 2
+        self.payload = json.dumps({'items': [
+            dict(item, id=i) for i in range(max(size // item_size, 1))
+        ]}).encode()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+
+    def get_response(self):
+        with self._lock:
+            self.requests += 1
+            roll = self._random.random()
+        if roll < self.error_rate:
+            return 500, b'{"error": "Internal Server Error"}', {}
+        if roll < self.error_rate + self.throttle_rate:
+            return 429, b'{"error": "Too Many Requests"}', {
+                'Retry-After': '0'}
+        return 200, self.payload, {}
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.serve_forever, name='kw_api_stub_server',
+            daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
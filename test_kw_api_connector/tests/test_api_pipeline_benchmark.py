@@ -0,0 +1,202 @@
+import json
+import logging
+import time
+from contextlib import contextmanager, ExitStack
+from unittest.mock import patch
+
+from odoo import sql_db
+from odoo.tests import TransactionCase, tagged
+from odoo.tools import config, SQL
+
+from .stub_server import StubServer
+
+_logger = logging.getLogger(__name__)
+
+REQUESTS = 100
+BATCH_SIZE = 20
+CONCURRENCY = 8
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(round(pct / 100 * (len(values) - 1)), len(values) - 1)]
+
+
+@tagged('-standard', 'kw_benchmark')
+class TestApiPipelineBenchmark(TransactionCase):
+    """ Throughput and latency of api_request with the request log against
+        a local stub server, results are logged as JSON and written to the
+        file set by server option kw_benchmark_output
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = StubServer().start()
+        cls.results = []
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        path = config.get('kw_benchmark_output')
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({'benchmark': 'kw_api_connector_pipeline',
+                           'results': cls.results}, f, indent=2)
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.api_credential = self.env.ref(
+            'test_kw_api_connector.test_kw_api_credential_demo')
+        self.api_credential.api_connector_id.write({
+            'api_url': self.server.url,
+            'is_api_token_used': False,
+            'api_retry_max': 3,
+            'api_retry_backoff': 0.01, })
+        self.api_credential.api_concurrency = CONCURRENCY
+        self.log_source = self.api_credential.kw_http_request_log_source_id
+
+    @contextmanager
+    def _count_commits(self):
+        """ Count commits of all cursors, including test cursors which
+            stand for new transactions in test mode
+        """
+        counter = {'commits': 0}
+
+        def wrap(original):
+            def commit(cursor, *args, **kwargs):
+                counter['commits'] += 1
+                return original(cursor, *args, **kwargs)
+            return commit
+
+        with ExitStack() as stack:
+            for cls in (sql_db.Cursor, sql_db.TestCursor):
+                stack.enter_context(
+                    patch.object(cls, 'commit', wrap(cls.commit)))
+            yield counter
+
+    @contextmanager
+    def _collect_timings(self):
+        """ Latency of each request sent, from the time it was queued until
+            the response headers were received
+        """
+        latencies = []
+        credential_cls = type(self.api_credential)
+        original = credential_cls._api_send
+
+        def api_send(credential, *args, **kwargs):
+            response = original(credential, *args, **kwargs)
+            timings = response.kw_api_timings
+            latencies.append(
+                (timings['queue_time'] + timings['total_time']) / 1000)
+            return response
+
+        with patch.object(credential_cls, '_api_send', api_send):
+            yield latencies
+
+    def _get_log_stats(self):
+        table = self.env['kw.http.request.log']._table
+        self.env.cr.execute(SQL(
+            "SELECT COUNT(*), pg_total_relation_size(%s::regclass) FROM %s",
+            table, SQL.identifier(table)))
+        return self.env.cr.fetchone()
+
+    def _run(self, scenario, send, is_log_enabled=True, **server):
+        """ Run the scenario and store its results
+
+            :param send: function sending REQUESTS requests, it returns
+                results of the requests and latencies of calls, latencies
+                of sent requests are used if it returns None
+        """
+        self.server.configure(**server)
+        self.log_source.is_log_enabled = is_log_enabled
+        # connections are opened before the measurement
+        self.api_credential.api_request('GET', '/warmup')
+        rows, size = self._get_log_stats()
+        server_requests = self.server.requests
+        with self._count_commits() as counter, \
+                self._collect_timings() as sent_latencies:
+            start = time.perf_counter()
+            results, latencies = send()
+            elapsed = time.perf_counter() - start
+        log_rows, log_size = self._get_log_stats()
+        latencies = latencies or sent_latencies
+        result = {
+            'scenario': scenario,
+            'is_log_enabled': is_log_enabled,
+            'server': dict(server),
+            'requests': REQUESTS,
+            'sent_requests': self.server.requests - server_requests,
+            'errors': sum(1 for x in results if x is False),
+            'requests_per_second': REQUESTS / elapsed,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'commits_per_call': counter['commits'] / REQUESTS,
+            'log_rows': log_rows - rows,
+            'log_bytes': log_size - size,
+        }
+        _logger.info('API pipeline benchmark: %s', json.dumps(result))
+        self.results.append(result)
+        return result
+
+    def _send_sequential(self):
+        results = []
+        latencies = []
+        for __ in range(REQUESTS):
+            start = time.perf_counter()
+            results.append(self.api_credential.api_request('GET', '/items'))
+            latencies.append(time.perf_counter() - start)
+        return results, latencies
+
+    def _send_concurrent(self):
+        return self.api_credential.api_request_many(
+            [('GET', '/items')] * REQUESTS), None
+
+    def _send_batched(self):
+        results = []
+        for __ in range(0, REQUESTS, BATCH_SIZE):
+            results += self.api_credential.api_request_many(
+                [('GET', '/items')] * BATCH_SIZE)
+        return results, None
+
+    def _check(self, result):
+        self.assertEqual(result['errors'], 0)
+        self.assertEqual(
+            result['log_rows'],
+            REQUESTS if result['is_log_enabled'] else 0)
+
+    def test_sequential(self):
+        for is_log_enabled in (False, True):
+            self._check(self._run(
+                'sequential', self._send_sequential,
+                is_log_enabled=is_log_enabled, latency=0.002))
+
+    def test_concurrent(self):
+        for is_log_enabled in (False, True):
+            self._check(self._run(
+                'concurrent', self._send_concurrent,
+                is_log_enabled=is_log_enabled, latency=0.002))
+
+    def test_batched(self):
+        for is_log_enabled in (False, True):
+            self._check(self._run(
+                'batched', self._send_batched,
+                is_log_enabled=is_log_enabled, latency=0.002))
+
+    def test_payload_size(self):
+        for size in (1024, 100 * 1024, 1024 * 1024):
+            self._check(self._run(
+                f'sequential_{size // 1024}kb', self._send_sequential,
+                size=size))
+
+    def test_errors(self):
+        """ Failed and throttled requests are retried """
+        result = self._run(
+            'sequential_errors', self._send_sequential, latency=0.002,
+            error_rate=0.05, throttle_rate=0.1)
+        self.assertGreater(result['sent_requests'], REQUESTS)
+        self.assertEqual(result['log_rows'], REQUESTS)
@@ -1,10 +1,21 @@
+import gzip
+import hashlib
 import json
+import threading
+import time
+from datetime import timedelta
 from unittest.mock import patch, MagicMock
 from contextlib import contextmanager
 import requests
+from odoo import fields
 from odoo.exceptions import ValidationError
 from odoo.tests.common import TransactionCase
 
+from odoo.addons.kw_api_connector.tools import drop_circuit, iter_json_array
+from odoo.addons.kw_api_connector.tools.pending_log import LogScheduler
+from odoo.addons.kw_api_connector.tools.request_body import dumps
+from odoo.addons.kw_mixin.tools import clear_hooks
+
 
 class TestApiCredential(TransactionCase):
 
@@ -43,7 +54,7 @@ class TestApiCredential(TransactionCase):
             self.log_ids_to_unlink.extend(logs.ids)
             yield logs
 
-    @patch('requests.request')
+    @patch('requests.Session.request')
     def test_api_request_successful_get(self, mock_request):
         # Set up mock response
         mock_response = MagicMock()
@@ -100,7 +111,7 @@ class TestApiCredential(TransactionCase):
             self.assertEqual(log_params, {'expand': 'details'})
             self.assertFalse(log.error)
 
-    @patch('requests.request')
+    @patch('requests.Session.request')
     def test_api_request_successful_post(self, mock_request):
         """Test successful execution of a POST request with data."""
         # Set up mock response
@@ -128,7 +139,8 @@ class TestApiCredential(TransactionCase):
         mock_request.assert_called_once_with(
             method='POST',
             url='https://api.test.com/items',
-            json=request_data,
+            json=None,
+            data=dumps(request_data),
             allow_redirects=True,
             params=None,
             headers=self.api_credential.get_api_headers(),
@@ -155,7 +167,38 @@ class TestApiCredential(TransactionCase):
             self.assertEqual(log_response_body, expected_result)
             self.assertFalse(log.error)
 
-    @patch('requests.request')
+    @patch('requests.Session.request')
+    def test_api_request_content_type(self, mock_request):
+        credential_class = self.api_credential.__class__
+        fname = f'get_api_headers_{self.api_credential.code}'
+
+        def get_api_headers(credential, **kw):
+            return {'content-type': 'application/vnd.api+json',
+                    'Accept': 'application/vnd.api+json', }
+
+        setattr(credential_class, fname, get_api_headers)
+        clear_hooks(credential_class)
+        self.addCleanup(clear_hooks, credential_class)
+        self.addCleanup(delattr, credential_class, fname)
+        mock_request.return_value = MagicMock(status_code=201)
+        mock_request.return_value.json.return_value = {'status': 'ok'}
+
+        # content type set by the hook is kept and not duplicated
+        self.api_credential.api_request(
+            'POST', '/content_type', data={'name': 'Item'})
+        self.api_credential.api_request_many([
+            ('POST', '/content_type', {'name': 'Item'})])
+        for call in mock_request.call_args_list:
+            headers = call.kwargs['headers']
+            self.assertEqual(
+                [v for k, v in headers.items()
+                 if k.lower() == 'content-type'],
+                ['application/vnd.api+json'])
+        with self.get_logs(
+                [('name', '=', 'https://api.test.com/content_type')]):
+            pass
+
+    @patch('requests.Session.request')
     def test_api_request_error_response_400_silent_true(self, mock_request):
         """Test without error handling for 400 Bad Request response."""
         # Set up mock response
@@ -163,6 +206,7 @@ class TestApiCredential(TransactionCase):
         mock_response.status_code = 400
         response_text = 'Bad Request'
         mock_response.text = response_text
+        mock_response.content = mock_response.text.encode()
         mock_response.json.side_effect = ValueError('No JSON object')
         mock_request.return_value = mock_response
 
@@ -199,7 +243,7 @@ class TestApiCredential(TransactionCase):
             self.assertEqual(log.response_body, response_text)
             self.assertFalse(log.request_body)
 
-    @patch('requests.request')
+    @patch('requests.Session.request')
     def test_api_request_server_error_500_silent_false(self, mock_request):
         """Test error handling for a 500 Bad Request."""
         # Setting up a mock response with a 500 error
@@ -207,6 +251,7 @@ class TestApiCredential(TransactionCase):
         mock_response.status_code = 500
         response_text = 'Internal Server Error'
         mock_response.text = response_text
+        mock_response.content = mock_response.text.encode()
         mock_response.json.side_effect = ValueError('No JSON object')
         mock_request.return_value = mock_response
 
@@ -238,7 +283,7 @@ class TestApiCredential(TransactionCase):
             self.assertEqual(log.response_body, response_text)
             self.assertFalse(log.request_body)
 
-    @patch('requests.request')
+    @patch('requests.Session.request')
     def test_api_request_exception_timeout_silent_true(self, mock_request):
         # Simulate a Timeout exception
         mock_request.side_effect = requests.exceptions.Timeout('Timed out')
@@ -276,7 +321,7 @@ class TestApiCredential(TransactionCase):
             self.assertFalse(log.response_body)
             self.assertFalse(log.request_body)
 
-    @patch('requests.request')
+    @patch('requests.Session.request')
     def test_api_request_connection_error_silent_false(self, mock_request):
         """Test for ValidationError on connection issue."""
         # Simulate ConnectionError
@@ -310,12 +355,13 @@ class TestApiCredential(TransactionCase):
             self.assertFalse(log.response_body)
             self.assertFalse(log.request_body)
 
-    @patch('requests.request')
+    @patch('requests.Session.request')
     def test_api_request_invalid_json_response(self, mock_request):
         # Mocking the response with invalid JSON
         mock_response = MagicMock()
         mock_response.status_code = 200
         mock_response.text = 'Invalid JSON'
+        mock_response.content = mock_response.text.encode()
         mock_response.json.side_effect = ValueError('No JSON object')
         mock_request.return_value = mock_response
 
@@ -353,7 +399,7 @@ class TestApiCredential(TransactionCase):
         '.parse_api_error', return_value={'is_refresh_api_token_needed': True,
                                           'message': 'Unauthorized'}
     )
-    @patch('requests.request')
+    @patch('requests.Session.request')
     def test_api_request_token_refresh(
         self, mock_request, mock_parse_api_error, mock_refresh_token
     ):
@@ -362,6 +408,7 @@ class TestApiCredential(TransactionCase):
         mock_response_401.status_code = 401
         response_text_401 = 'Internal Server Error'
         mock_response_401.text = response_text_401
+        mock_response_401.content = mock_response_401.text.encode()
 
         # Second response - 200 OK
         mock_response_200 = MagicMock()
@@ -406,10 +453,24 @@ class TestApiCredential(TransactionCase):
             log_response_body = json.loads(log_200.response_body)
             self.assertEqual(log_response_body, {'status': 'success'})
 
+        # request with JSON body is sent again with the same body
+        mock_request.reset_mock()
+        mock_request.side_effect = [mock_response_401, mock_response_200]
+        result = self.api_credential.api_request(
+            'POST', '/needs-token-refresh', data={'id': 1})
+        self.assertEqual(result, {'status': 'success'})
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(
+            mock_request.call_args.kwargs['data'], dumps({'id': 1}))
+        with self.get_logs([
+                ('name', '=', 'https://api.test.com/needs-token-refresh'),
+                ('method', '=', 'POST')]) as logs:
+            self.assertEqual(len(logs), 2)
+
     @patch(
         'odoo.addons.kw_api_connector.models.credential.ApiCredential'
         '.action_refresh_api_token', return_value=False)
-    @patch('requests.request')
+    @patch('requests.Session.request')
     def test_api_request_token_refresh_failure_silent_true(
         self, mock_request, mock_refresh_token
     ):
@@ -417,6 +478,7 @@ class TestApiCredential(TransactionCase):
         mock_response_401 = MagicMock()
         mock_response_401.status_code = 401
         mock_response_401.text = 'Unauthorized'
+        mock_response_401.content = mock_response_401.text.encode()
         mock_request.return_value = mock_response_401
 
         self.api_credential.api_request(
@@ -442,7 +504,7 @@ class TestApiCredential(TransactionCase):
     @patch(
         'odoo.addons.kw_api_connector.models.credential.ApiCredential'
         '.action_refresh_api_token', return_value=False)
-    @patch('requests.request')
+    @patch('requests.Session.request')
     def test_api_request_token_refresh_failure_silent_false(
         self, mock_request, mock_refresh_token
     ):
@@ -450,6 +512,7 @@ class TestApiCredential(TransactionCase):
         mock_response_401 = MagicMock()
         mock_response_401.status_code = 401
         mock_response_401.text = 'Unauthorized'
+        mock_response_401.content = mock_response_401.text.encode()
         mock_request.return_value = mock_response_401
 
         # Check if ValidationError is raised
@@ -481,6 +544,792 @@ class TestApiCredential(TransactionCase):
             self.assertEqual(log.error, 'Unauthorized')
             self.assertEqual(log.response_body, 'Unauthorized')
 
+    @patch('requests.Session.request')
+    def test_api_request_not_sampled(self, mock_request):
+        self.http_request_log_source.log_sample_rate = 0
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'status': 'ok'}
+        mock_request.return_value = mock_response
+
+        self.api_credential.api_request(method='GET', url='/not-sampled')
+
+        domain = [('name', '=', 'https://api.test.com/not-sampled')]
+        with self.get_logs(domain) as logs:
+            self.assertFalse(logs)
+
+        # Failed requests are logged in one go
+        mock_response = MagicMock()
+        mock_response.status_code = 400
+        mock_response.text = 'Bad Request'
+        mock_response.content = mock_response.text.encode()
+        mock_response.json.side_effect = ValueError('No JSON object')
+        mock_request.return_value = mock_response
+
+        self.api_credential.api_request(
+            method='POST', url='/not-sampled', data={'a': 1})
+
+        with self.get_logs(domain) as logs:
+            self.assertEqual(len(logs), 1)
+            self.assertEqual(logs.method, 'POST')
+            self.assertEqual(logs.code, '400')
+            self.assertEqual(logs.error, 'Bad Request')
+            self.assertEqual(json.loads(logs.request_body), {'a': 1})
+
+    @patch('requests.Session.request')
+    def test_api_request_body_on_error_only(self, mock_request):
+        self.http_request_log_source.is_log_body_on_error_only = True
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'status': 'ok'}
+        mock_request.return_value = mock_response
+
+        self.api_credential.api_request(
+            method='POST', url='/body-on-error', data={'a': 1})
+
+        domain = [('name', '=', 'https://api.test.com/body-on-error')]
+        with self.get_logs(domain) as logs:
+            self.assertEqual(len(logs), 1)
+            self.assertEqual(logs.code, '200')
+            self.assertFalse(logs.request_body)
+            self.assertFalse(logs.response_body)
+
+    def test_api_session_pool(self):
+        session = self.api_credential._get_api_session()
+        self.assertIs(self.api_credential._get_api_session(), session)
+
+        # sessions are dropped on change of API URL
+        self.api_connector.api_url = 'https://api2.test.com'
+        self.assertIsNot(self.api_credential._get_api_session(), session)
+
+    def test_api_settings(self):
+        settings = self.api_credential.get_api_settings()
+        self.assertIs(self.api_credential.get_api_settings(), settings)
+        self.assertEqual(settings['code'], self.api_connector.name)
+
+        # cached settings are used without reading related records
+        self.api_connector.api_circuit_threshold = 5
+        self.addCleanup(
+            drop_circuit, self.api_connector._get_api_circuit_key())
+        session = MagicMock()
+        session.request.return_value.status_code = 200
+        # shared circuit state is read once per second
+        self.api_credential._api_send_with_retry(
+            session, 'GET', 'https://api.test.com/items')
+        self.env.invalidate_all()
+        with self.assertQueryCount(0):
+            self.assertEqual(
+                self.api_credential.get_api_url('/items'),
+                'https://api.test.com/items')
+            self.api_credential._api_throttle()
+            self.assertFalse(self.api_credential.get_api_token())
+            self.api_credential._api_send_with_retry(
+                session, 'GET', 'https://api.test.com/items')
+
+        # settings resolved by the caller are used by other threads even
+        # if the cache is cleared meanwhile
+        settings = self.api_credential.get_api_settings()
+        self.env.registry.clear_cache()
+        with self.assertQueryCount(0):
+            self.api_credential._api_send_with_retry(
+                session, 'GET', 'https://api.test.com/items',
+                settings=settings)
+
+        # settings are refreshed on change of the connector or credential
+        self.api_connector.api_url = 'https://api2.test.com'
+        self.assertEqual(
+            self.api_credential.get_api_url('/items'),
+            'https://api2.test.com/items')
+        self.api_credential.api_cache_ttl = 10
+        self.assertEqual(
+            self.api_credential.get_api_settings()['cache_ttl'], 10)
+
+    @patch('requests.Session.request')
+    def test_api_request_many(self, mock_request):
+        def request(method, url, **kwargs):
+            if url.endswith('/fail'):
+                raise requests.exceptions.ConnectionError('Connection failed')
+            response = MagicMock()
+            response.status_code = 200
+            response.json.return_value = {'url': url}
+            return response
+        mock_request.side_effect = request
+
+        result = self.api_credential.api_request_many([
+            ('GET', '/many/1'),
+            ('POST', '/many/2', {'name': 'Item'}),
+            ('GET', '/many/fail'),
+            ('GET', '/many/3', None, {'page': 2}),
+        ])
+        self.assertEqual(result, [
+            {'url': 'https://api.test.com/many/1'},
+            {'url': 'https://api.test.com/many/2'},
+            False,
+            {'url': 'https://api.test.com/many/3'},
+        ])
+        self.assertEqual(mock_request.call_count, 4)
+
+        domain = [('name', 'like', 'https://api.test.com/many/')]
+        with self.get_logs(domain) as logs:
+            self.assertEqual(len(logs), 4)
+            log = logs.filtered(lambda x: x.name.endswith('/many/2'))
+            self.assertEqual(log.method, 'POST')
+            self.assertEqual(log.code, '200')
+            self.assertEqual(json.loads(log.request_body), {'name': 'Item'})
+            log = logs.filtered(lambda x: x.name.endswith('/many/fail'))
+            self.assertIn('Connection failed', log.error)
+
+        with self.assertRaises(ValidationError):
+            self.api_credential.api_request_many(
+                [('GET', '/many/1'), ('GET', '/many/fail')], silent=False)
+        # collect logs of the second batch to delete them
+        with self.get_logs(domain):
+            pass
+
+    @patch('requests.Session.request')
+    def test_api_request_stream(self, mock_request):
+        items = [{'id': i, 'name': f'Item {i}'} for i in range(1000)]
+        body = json.dumps(items).encode()
+
+        def request(method, url, **kwargs):
+            self.assertTrue(kwargs.get('stream'))
+            response = MagicMock()
+            response.status_code = 200
+            if url.endswith('.jsonl'):
+                content = b'\n'.join(json.dumps(x).encode() for x in items)
+            else:
+                content = body
+            response.iter_content.side_effect = lambda chunk_size: (
+                content[i:i + 100] for i in range(0, len(content), 100))
+            return response
+        mock_request.side_effect = request
+
+        result = self.api_credential.api_request(
+            'GET', '/stream/items.json', stream='json_array')
+        self.assertEqual(list(result), items)
+        result = self.api_credential.api_request(
+            'GET', '/stream/items.jsonl', stream='jsonl')
+        self.assertEqual(list(result), items)
+        result = self.api_credential.api_request(
+            'GET', '/stream/items.json', stream=True)
+        self.assertEqual(b''.join(result), body)
+
+        domain = [('name', '=', 'https://api.test.com/stream/items.json')]
+        with self.get_logs(domain) as logs:
+            self.assertEqual(len(logs), 2)
+            for log in logs:
+                self.assertEqual(log.code, '200')
+                self.assertEqual(log.response_size, len(body))
+                self.assertEqual(
+                    log.response_hash, hashlib.sha256(body).hexdigest())
+                self.assertIn('bytes skipped', log.response_body)
+                self.assertLess(len(log.response_body), len(body))
+        with self.get_logs(
+                [('name', '=', 'https://api.test.com/stream/items.jsonl')]):
+            pass
+
+        # status is logged at once, the body is logged on close
+        domain = [('name', '=', 'https://api.test.com/stream/partial.json')]
+        with self.api_credential.api_request(
+                'GET', '/stream/partial.json', stream='json_array') as result:
+            with self.get_logs(domain) as logs:
+                self.assertEqual(logs.code, '200')
+                self.assertFalse(logs.response_hash)
+            self.assertEqual(next(result), items[0])
+        self.assertTrue(result.closed)
+        result.response.close.assert_called()
+        with self.get_logs(domain) as logs:
+            self.assertEqual(len(logs), 1)
+            self.assertTrue(logs.response_hash)
+            self.assertLess(logs.response_size, len(body))
+
+        # garbage collected stream releases the connection without logging
+        domain = [('name', '=', 'https://api.test.com/stream/dropped.json')]
+        result = self.api_credential.api_request(
+            'GET', '/stream/dropped.json', stream='json_array')
+        response = result.response
+        self.assertEqual(next(result), items[0])
+        del result
+        response.close.assert_called()
+        with self.get_logs(domain) as logs:
+            self.assertEqual(logs.code, '200')
+            self.assertFalse(logs.response_hash)
+
+    def test_iter_json_array(self):
+        def parse(text, size):
+            data = text.encode()
+            return list(iter_json_array(
+                data[i:i + size] for i in range(0, len(data), size)))
+
+        text = ' [1, 2.5, -1e+5, "a,]", {"x": [1, 2]}, null, true] \n'
+        for size in (1, 2, 100):
+            self.assertEqual(parse(text, size), [
+                1, 2.5, -1e+5, 'a,]', {'x': [1, 2]}, None, True])
+            self.assertEqual(parse('[ ]', size), [])
+            for malformed in ('[1,,2]', '[1 2]', '[,1]', '[1,]', '[1] [2]',
+                              '{"a": 1}', '[1', ''):
+                with self.assertRaises(ValueError, msg=malformed):
+                    parse(malformed, size)
+
+    @patch('requests.Session.request')
+    def test_api_request_upload(self, mock_request):
+        self.api_credential.write({
+            'is_api_compress_request': True, 'api_compress_min_size': 100, })
+        records = [{'id': i, 'name': f'Item {i}'} for i in range(1000)]
+        sent = []
+
+        def request(method, url, **kwargs):
+            self.assertIsNone(kwargs['json'])
+            self.assertEqual(
+                kwargs['headers']['Content-Encoding'], 'gzip')
+            body = kwargs['data']
+            if not isinstance(body, bytes):
+                body = b''.join(body)
+            sent.append(gzip.decompress(body))
+            response = MagicMock()
+            response.status_code = 200
+            response.json.return_value = {'status': 'ok'}
+            return response
+        mock_request.side_effect = request
+
+        self.api_credential.api_request('POST', '/upload/json', data=records)
+        self.assertEqual(json.loads(sent[0]), records)
+
+        self.api_credential.api_request(
+            'POST', '/upload/jsonl', data=iter(records), upload='jsonl')
+        self.assertEqual(
+            [json.loads(x) for x in sent[1].splitlines()], records)
+
+        domain = [('name', '=', 'https://api.test.com/upload/jsonl')]
+        with self.get_logs(domain) as logs:
+            self.assertEqual(len(logs), 1)
+            self.assertEqual(logs.request_size, len(sent[1]))
+            self.assertIn('bytes skipped', logs.request_body)
+            self.assertLess(len(logs.request_body), len(sent[1]))
+        with self.get_logs(
+                [('name', '=', 'https://api.test.com/upload/json')]) as logs:
+            # head and tail of the encoded body are logged
+            self.assertEqual(len(logs), 1)
+            self.assertEqual(logs.request_size, len(sent[0]))
+            self.assertIn('bytes skipped', logs.request_body)
+
+        # small bodies are sent uncompressed
+        mock_request.side_effect = None
+        mock_request.return_value = MagicMock(status_code=200)
+        mock_request.return_value.json.return_value = {'status': 'ok'}
+        self.api_credential.api_request('POST', '/upload/json', data={})
+        self.assertEqual(mock_request.call_args.kwargs['data'], b'{}')
+        self.assertNotIn(
+            'Content-Encoding', mock_request.call_args.kwargs['headers'])
+        with self.get_logs(
+                [('name', '=', 'https://api.test.com/upload/json')]):
+            pass
+
+        # bodies are encoded and logged the same way without compression
+        self.api_credential.is_api_compress_request = False
+        self.api_credential.api_request('POST', '/upload/plain', data=records)
+        self.assertEqual(
+            mock_request.call_args.kwargs['data'], dumps(records))
+        with self.get_logs(
+                [('name', '=', 'https://api.test.com/upload/plain')]) as logs:
+            self.assertEqual(logs.request_size, len(dumps(records)))
+            self.assertIn('bytes skipped', logs.request_body)
+            self.assertLess(len(logs.request_body), len(dumps(records)))
+
+    @patch('requests.Session.request')
+    def test_api_paginate(self, mock_request):
+        records = [{'id': i} for i in range(25)]
+        responses = []
+
+        def request(method, url, params=None, **kwargs):
+            response = MagicMock()
+            response.status_code = 200
+            response.links = {}
+            if url.endswith('/cursor'):
+                start = int(params.get('cursor') or 0)
+                end = start + params['per_page']
+                response.json.return_value = {
+                    'data': records[start:end],
+                    'meta': {'next': end < len(records) and str(end)}}
+            elif '/paginate/link' in url:
+                page = int(url.partition('?page=')[2] or 1)
+                response.json.return_value = records[
+                    (page - 1) * 10:page * 10]
+                if page * 10 < len(records):
+                    response.links = {'next': {'url': (
+                        f'https://api.test.com/paginate/link?page={page + 1}'
+                    )}}
+            else:
+                page = params['page']
+                response.json.return_value = records[
+                    (page - 1) * 10:page * 10]
+            responses.append(response)
+            return response
+        mock_request.side_effect = request
+
+        result = self.api_credential.api_paginate(
+            'GET', '/paginate/page', page_size=10)
+        self.assertEqual(list(result), records)
+        self.assertEqual(mock_request.call_count, 3)
+
+        mock_request.reset_mock()
+        result = self.api_credential.api_paginate(
+            'GET', '/paginate/cursor', strategy='cursor', page_size=10,
+            items_key='data', cursor_key='meta.next')
+        self.assertEqual(list(result), records)
+        self.assertEqual(mock_request.call_count, 3)
+
+        mock_request.reset_mock()
+        result = self.api_credential.api_paginate(
+            'GET', '/paginate/link', strategy='link', size_param=None)
+        self.assertEqual(list(result), records)
+        self.assertEqual(mock_request.call_count, 3)
+
+        # records are yielded before all pages are fetched
+        mock_request.reset_mock()
+        result = self.api_credential.api_paginate(
+            'GET', '/paginate/page', page_size=10)
+        self.assertEqual(next(result), records[0])
+        result.close()
+        self.assertEqual(mock_request.call_count, 1)
+
+        # next page is requested in the background if prefetch is enabled
+        mock_request.reset_mock()
+        result = self.api_credential.api_paginate(
+            'GET', '/paginate/page', page_size=10, prefetch=True)
+        self.assertEqual(list(result), records)
+        self.assertEqual(mock_request.call_count, 3)
+
+        # prefetched page is finished when the caller stops iterating
+        mock_request.reset_mock()
+        result = self.api_credential.api_paginate(
+            'GET', '/paginate/page', page_size=10, prefetch=True)
+        self.assertEqual(next(result), records[0])
+        result.close()
+        self.assertLessEqual(mock_request.call_count, 2)
+        if mock_request.call_count == 2:
+            responses[-1].close.assert_called_once()
+
+        domain = [('name', 'like', 'https://api.test.com/paginate/')]
+        with self.get_logs(domain) as logs:
+            self.assertTrue(logs)
+
+    def test_api_token(self):
+        credential_class = self.api_credential.__class__
+        fname = f'fetch_api_token_{self.api_credential.code}'
+        self.assertFalse(self.api_credential.get_api_token())
+        calls = []
+
+        def fetch_api_token(credential):
+            calls.append(credential.id)
+            return {'token': f'token{len(calls)}', 'expires_in': expires_in}
+
+        setattr(credential_class, fname, fetch_api_token)
+        clear_hooks(credential_class)
+        self.addCleanup(clear_hooks, credential_class)
+        self.addCleanup(delattr, credential_class, fname)
+
+        # token is fetched once and cached until it expires
+        expires_in = 3600
+        headers = self.api_credential.get_api_headers()
+        self.assertEqual(headers['Authorization'], 'Bearer token1')
+        self.assertEqual(
+            self.api_credential.get_api_headers()['Authorization'],
+            'Bearer token1')
+        self.assertEqual(len(calls), 1)
+
+        # token is refreshed on demand
+        self.assertTrue(self.api_credential.action_refresh_api_token())
+        self.assertEqual(self.api_credential.get_api_token(), 'token2')
+        self.assertEqual(len(calls), 2)
+
+        # token that expires within refresh margin is refreshed
+        expires_in = 30
+        self.api_credential.get_api_token(force=True)
+        self.assertEqual(self.api_credential.get_api_token(), 'token4')
+        self.assertEqual(len(calls), 4)
+
+    @patch('requests.Session.request')
+    def test_api_request_retry(self, mock_request):
+        mock_response_503 = MagicMock()
+        mock_response_503.status_code = 503
+        mock_response_503.headers = {'Retry-After': '0'}
+        mock_response_503.text = 'Service Unavailable'
+        mock_response_503.content = mock_response_503.text.encode()
+        mock_response_503.json.side_effect = ValueError('No JSON')
+        mock_response_200 = MagicMock()
+        mock_response_200.status_code = 200
+        mock_response_200.json.return_value = {'status': 'ok'}
+        self.api_connector.write({
+            'api_retry_max': 2, 'api_retry_backoff': 0, })
+
+        mock_request.side_effect = [
+            requests.exceptions.ConnectionError('Connection failed'),
+            mock_response_503, mock_response_200]
+        result = self.api_credential.api_request('GET', '/retry')
+        self.assertEqual(result, {'status': 'ok'})
+        self.assertEqual(mock_request.call_count, 3)
+
+        # non-idempotent requests are not retried
+        mock_request.reset_mock()
+        mock_request.side_effect = [mock_response_503, mock_response_200]
+        self.assertFalse(self.api_credential.api_request('POST', '/retry'))
+        self.assertEqual(mock_request.call_count, 1)
+
+        # unless they have an idempotency key
+        mock_request.reset_mock()
+        mock_request.side_effect = [mock_response_503, mock_response_200]
+        headers = dict(self.api_credential.get_api_headers(),
+                       **{'Idempotency-Key': 'key1'})
+        result = self.api_credential.api_request(
+            'POST', '/retry', headers=headers)
+        self.assertEqual(result, {'status': 'ok'})
+        self.assertEqual(mock_request.call_count, 2)
+
+        # requests of batches and pages are retried as well
+        mock_request.reset_mock()
+        mock_request.side_effect = [mock_response_503, mock_response_200]
+        self.assertEqual(self.api_credential.api_request_many(
+            [('GET', '/retry/many')]), [{'status': 'ok'}])
+        self.assertEqual(mock_request.call_count, 2)
+
+        mock_request.reset_mock()
+        mock_request.side_effect = [mock_response_503, mock_response_200]
+        mock_response_200.json.return_value = []
+        self.assertEqual(list(self.api_credential.api_paginate(
+            'GET', '/retry/pages')), [])
+        self.assertEqual(mock_request.call_count, 2)
+
+        with self.get_logs([('name', '=', 'https://api.test.com/retry')]) \
+                as logs:
+            self.assertEqual(len(logs), 3)
+        with self.get_logs(
+                [('name', 'like', 'https://api.test.com/retry/')]) as logs:
+            self.assertEqual(len(logs), 2)
+
+    @patch('requests.Session.request')
+    def test_api_request_circuit_breaker(self, mock_request):
+        connector = self.api_connector
+        self.addCleanup(drop_circuit, connector._get_api_circuit_key())
+        connector.write({'api_circuit_threshold': 2})
+        mock_request.side_effect = requests.exceptions.ConnectionError(
+            'Connection failed')
+
+        for __ in range(3):
+            self.assertFalse(self.api_credential.api_request('GET', '/down'))
+        # the third request is not sent
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertTrue(connector.is_api_circuit_open())
+
+        with self.get_logs([('name', '=', 'https://api.test.com/down')]) \
+                as logs:
+            self.assertEqual(len(logs), 3)
+            self.assertIn('circuit breaker', logs.sorted('id')[-1].error)
+
+        # circuit is closed again after the timeout
+        connector.api_circuit_open_until = False
+        self.assertFalse(connector.is_api_circuit_open())
+
+        # circuit opened by another worker is seen without failures of
+        # this one
+        mock_request.reset_mock()
+        connector.api_circuit_open_until = \
+            fields.Datetime.now() + timedelta(hours=1)
+        self.assertFalse(self.api_credential.api_request('GET', '/open'))
+        mock_request.assert_not_called()
+        with self.get_logs([('name', '=', 'https://api.test.com/open')]) \
+                as logs:
+            self.assertIn('circuit breaker', logs.error)
+
+    @patch('requests.Session.request')
+    def test_api_request_rate_limit(self, mock_request):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'status': 'ok'}
+        mock_request.return_value = mock_response
+
+        for backend in ['postgresql', 'local']:
+            self.api_connector.write({
+                'api_rate_limit': 1, 'api_rate_burst': 2,
+                'api_rate_limit_timeout': 0,
+                'api_rate_limit_backend': backend, })
+            mock_request.reset_mock()
+            results = [self.api_credential.api_request('GET', '/throttled')
+                       for __ in range(3)]
+            self.assertEqual(results, [{'status': 'ok'}] * 2 + [False])
+            self.assertEqual(mock_request.call_count, 2)
+            metrics = self.api_credential.get_api_rate_limit_metrics()
+            self.assertEqual(metrics['requests'], 2)
+            self.assertEqual(metrics['throttled'], 1)
+
+        with self.get_logs([('name', '=', 'https://api.test.com/throttled')]) \
+                as logs:
+            self.assertEqual(len(logs), 6)
+            self.assertEqual(len(logs.filtered('error')), 2)
+
+    @patch('requests.Session.request')
+    def test_api_request_cache(self, mock_request):
+        credential = self.api_credential
+        response_data = {'rates': [1, 2]}
+        mock_response_200 = MagicMock()
+        mock_response_200.status_code = 200
+        mock_response_200.content = json.dumps(response_data).encode()
+        mock_response_200.json.return_value = response_data
+        mock_response_200.headers = {'ETag': '"v1"'}
+        mock_response_304 = MagicMock()
+        mock_response_304.status_code = 304
+        mock_response_304.headers = {}
+        hits, misses = credential.api_cache_hits, credential.api_cache_misses
+
+        # fresh response is served from the cache
+        credential.write({'is_api_cache_enabled': True, 'api_cache_ttl': 300})
+        mock_request.return_value = mock_response_200
+        for __ in range(2):
+            self.assertEqual(
+                credential.api_request('GET', '/rates'), response_data)
+        self.assertEqual(mock_request.call_count, 1)
+        credential.invalidate_recordset(['api_cache_hits', 'api_cache_misses'])
+        self.assertEqual(credential.api_cache_hits, hits + 1)
+        self.assertEqual(credential.api_cache_misses, misses + 1)
+
+        # expired response is revalidated
+        credential.api_cache_ttl = 0
+        credential.api_request('GET', '/rates')
+        mock_request.return_value = mock_response_304
+        self.assertEqual(
+            credential.api_request('GET', '/rates'), response_data)
+        self.assertEqual(mock_request.call_count, 3)
+        self.assertEqual(
+            mock_request.call_args.kwargs['headers']['If-None-Match'], '"v1"')
+
+        with self.get_logs([('name', '=', 'https://api.test.com/rates')]) \
+                as logs:
+            self.assertEqual(len(logs), 4)
+            self.assertEqual(len(logs.filtered('is_cache_hit')), 2)
+
+    @patch('requests.Session.request')
+    def test_api_request_deferred_log(self, mock_request):
+        self.http_request_log_source.write({
+            'is_log_deferred': True, 'log_deferred_threshold': 60, })
+        log_model = type(self.env['kw.http.request.log'])
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'status': 'ok'}
+        mock_request.return_value = mock_response
+
+        # log of fast request is written at once
+        with patch.object(log_model, 'write_in_new_transaction') as update:
+            self.api_credential.api_request('GET', '/deferred/fast')
+            update.assert_not_called()
+
+        # log of slow request is written by the scheduler while it is in
+        # progress, the scheduler uses its own cursor
+        request = ('GET', '/deferred/slow', None, None,
+                   self.api_credential.get_api_headers())
+        log = self.api_credential._api_log_start(request)
+        log.timer.cancel()
+        log.write(*log.timer.args)
+        self.assertTrue(log.log_id)
+        url = 'https://api.test.com/deferred/slow'
+        with self.get_logs([('name', '=', url)]) as logs:
+            self.assertEqual(len(logs), 1)
+            self.assertFalse(logs.code)
+        self.api_credential._api_log(log, request, {'code': 200})
+
+        # errors of the scheduled write are logged
+        log = self.api_credential._api_log_start(request)
+        log.timer.cancel()
+        source_model = type(self.env['kw.http.request.log.source'])
+        with patch.object(source_model, 'create_log',
+                          side_effect=Exception('Log failed')), \
+                self.assertLogs(
+                    'odoo.addons.kw_api_connector.tools.pending_log',
+                    'ERROR'):
+            log.write(*log.timer.args)
+        self.assertFalse(log.log_id)
+        self.api_credential._api_log(log, request, {'code': 200})
+
+        domain = [('name', 'like', 'https://api.test.com/deferred/')]
+        with self.get_logs(domain) as logs:
+            self.assertEqual(len(logs), 3)
+            self.assertEqual(logs.mapped('code'), ['200'] * 3)
+
+    def test_api_log_scheduler(self):
+        scheduler = LogScheduler()
+        written = []
+        done = threading.Event()
+
+        class Log:
+            def write(self, name):
+                written.append(name)
+                if name == 'last':
+                    done.set()
+
+        # due rows are written in order by one thread, cancelled are not
+        scheduler.schedule(0.2, Log(), ('second', ))
+        thread = scheduler._thread
+        scheduler.schedule(0.1, Log(), ('first', ))
+        scheduler.schedule(0.15, Log(), ('cancelled', )).cancel()
+        scheduler.schedule(0.3, Log(), ('last', ))
+        self.assertIs(scheduler._thread, thread)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(written, ['first', 'second', 'last'])
+
+    @patch('requests.Session.request')
+    def test_api_request_timings(self, mock_request):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'status': 'ok'}
+        mock_response.elapsed = timedelta(milliseconds=25)
+        mock_response._content = b'{"status": "ok"}'
+        mock_response.request.body = b'{"id": 1}'
+
+        def request(*args, **kwargs):
+            time.sleep(0.05)
+            return mock_response
+        mock_request.side_effect = request
+
+        self.api_credential.api_request('POST', '/timings', data={'id': 1})
+
+        with self.get_logs([('name', '=', 'https://api.test.com/timings')]) \
+                as logs:
+            self.assertEqual(len(logs), 1)
+            self.assertEqual(logs.request_size, 9)
+            self.assertEqual(logs.response_size, 16)
+            self.assertAlmostEqual(logs.ttfb_time, 25)
+            self.assertGreaterEqual(logs.total_time, 50)
+            self.assertGreaterEqual(logs.queue_time, 0)
+            # no connection is opened by the mocked session
+            self.assertEqual(logs.connect_time, 0)
+
+    @patch('requests.Session.request')
+    def test_api_outbox(self, mock_request):
+        outbox_model = self.env['kw.api.outbox']
+        error_response = MagicMock()
+        error_response.status_code = 500
+        error_response.text = 'Internal Server Error'
+        error_response.content = error_response.text.encode()
+        error_response.json.side_effect = ValueError('No JSON object')
+        mock_request.return_value = error_response
+
+        job = self.api_credential.api_enqueue(
+            'POST', '/outbox', data={'id': 1}, idempotency_key='outbox-1')
+        self.assertEqual(job.state, 'pending')
+        mock_request.assert_not_called()
+
+        # failed request is retried later
+        self.assertEqual(outbox_model.cron_process_outbox(), 1)
+        job.invalidate_recordset()
+        self.assertEqual(job.state, 'pending')
+        self.assertEqual(job.attempt_count, 1)
+        self.assertIn('Internal Server Error', job.error)
+        self.assertGreater(job.next_attempt_date, job.create_date)
+        self.assertEqual(outbox_model.cron_process_outbox(), 0)
+
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'status': 'ok'}
+        mock_request.return_value = mock_response
+        job.next_attempt_date = job.create_date
+        self.assertEqual(outbox_model.cron_process_outbox(), 1)
+        job.invalidate_recordset()
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.result, {'status': 'ok'})
+        self.assertFalse(job.error)
+        self.assertEqual(
+            mock_request.call_args.kwargs['headers']['Idempotency-Key'],
+            'outbox-1')
+        with self.get_logs([('api_outbox_id', '=', job.id)]) as logs:
+            self.assertEqual(len(logs), 2)
+            self.assertEqual(sorted(logs.mapped('code')), ['200', '500'])
+
+        # request is moved to dead letters after the last attempt
+        mock_request.return_value = error_response
+        job = self.api_credential.api_enqueue(
+            'GET', '/outbox', max_attempts=1)
+        outbox_model.cron_process_outbox()
+        job.invalidate_recordset()
+        self.assertEqual(job.state, 'dead')
+        job.action_retry()
+        self.assertEqual(job.state, 'pending')
+        self.assertEqual(job.attempt_count, 0)
+        with self.get_logs([('api_outbox_id', '=', job.id)]):
+            pass
+
+        # permanent errors are not retried, connection errors are
+        not_found = MagicMock()
+        not_found.status_code = 404
+        not_found.json.return_value = {'error': 'Not found'}
+        mock_request.return_value = not_found
+        job = self.api_credential.api_enqueue('GET', '/outbox/missing')
+        outbox_model.cron_process_outbox()
+        job.invalidate_recordset()
+        self.assertEqual(job.state, 'dead')
+        self.assertEqual(job.attempt_count, 1)
+
+        mock_request.side_effect = requests.exceptions.ConnectionError(
+            'Connection failed')
+        job = self.api_credential.api_enqueue('GET', '/outbox/down')
+        outbox_model.cron_process_outbox()
+        job.invalidate_recordset()
+        self.assertEqual(job.state, 'pending')
+        with self.get_logs([('name', 'like', 'https://api.test.com/outbox/')]):
+            pass
+
+    def test_api_outbox_worker_error(self):
+        outbox_model = self.env['kw.api.outbox']
+        outbox_class = type(outbox_model)
+        # failed worker does not stop the cron from being triggered again
+        with patch.object(self.env.registry, 'in_test_mode',
+                          return_value=False), \
+                patch.object(outbox_class, '_drain', side_effect=[
+                    RuntimeError('Worker failed'), 1]), \
+                patch.object(outbox_class, '_trigger_cron') as trigger, \
+                self.assertLogs('odoo.addons.kw_api_connector.models.outbox',
+                                'ERROR'):
+            self.assertEqual(outbox_model.cron_process_outbox(
+                workers=2, time_limit=0), 1)
+        trigger.assert_called_once()
+
+    @patch('requests.Session.request')
+    def test_api_request_large_error(self, mock_request):
+        self.api_credential.api_capture_size = 1024
+        html = '<html><body><h1>Server Error</h1>%s</body></html>' % (
+            '<p>Details</p>' * 10000)
+        mock_response = MagicMock()
+        mock_response.status_code = 500
+        mock_response.headers = {'Content-Type': 'text/html; charset=utf-8'}
+        mock_response.content = html.encode()
+        mock_request.return_value = mock_response
+
+        module = 'odoo.addons.kw_api_connector.models.credential'
+        with patch(f'{module}.html2text', return_value='Server Error') \
+                as mock_html2text:
+            with self.assertRaises(ValidationError):
+                self.api_credential.api_request(
+                    'GET', '/large-error', silent=False)
+        # error text is converted once, only the head of the body is used
+        mock_html2text.assert_called_once()
+        self.assertLessEqual(len(mock_html2text.call_args.args[0]), 1100)
+        mock_response.json.assert_not_called()
+
+        # binary body is not logged
+        mock_response.headers = {'Content-Type': 'application/pdf'}
+        mock_response.content = b'%PDF-1.4\x00' * 1000
+        self.api_credential.api_request('GET', '/binary-error')
+
+        domain = [('name', '=', 'https://api.test.com/large-error')]
+        with self.get_logs(domain) as logs:
+            self.assertEqual(len(logs), 1)
+            self.assertEqual(logs.error, 'Server Error')
+            self.assertIn('truncated', logs.response_body)
+            self.assertLess(len(logs.response_body), 1100)
+        with self.get_logs(
+                [('name', '=', 'https://api.test.com/binary-error')]) as logs:
+            self.assertEqual(len(logs), 1)
+            self.assertIn('binary body', logs.response_body)
+            self.assertIn('application/pdf', logs.error)
+
     def test_api_request_dynamic_method(self):
         # Define the dynamic method
         def api_request_test_connector(
@@ -506,3 +1355,9 @@ class TestApiCredential(TransactionCase):
 
         # Check that the dynamic method was called
         self.assertEqual(result, 'Dynamic Method Called')
+
+        # requests of batches are sent by the method too
+        self.assertEqual(self.api_credential.api_request_many([
+            ('GET', '/dynamic-method'),
+            ('POST', '/dynamic-method', {'name': 'Item'}),
+        ]), ['Dynamic Method Called'] * 2)
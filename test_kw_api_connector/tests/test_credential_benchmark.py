@@ -0,0 +1,48 @@
+import logging
+import timeit
+from unittest.mock import MagicMock
+
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.kw_mixin.tools import get_hook
+
+_logger = logging.getLogger(__name__)
+
+
+@tagged('-standard', 'kw_benchmark')
+class TestApiCredentialBenchmark(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        self.api_credential = self.env.ref(
+            'test_kw_api_connector.test_kw_api_credential_demo')
+        self.response = MagicMock(status_code=200)
+
+    def _measure(self, func, number=10000):
+        return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+    def test_hook_dispatch(self):
+        """ Compare hasattr / getattr lookup of hooks on every call (before)
+            with lookups cached per model class (now)
+        """
+        credential = self.api_credential
+        code = credential.code
+
+        def lookup_before():
+            fname = f'is_api_success_{code}'
+            if hasattr(credential, fname):
+                return getattr(credential, fname)
+            return None
+
+        def lookup_now():
+            return get_hook(credential, 'is_api_success', code)
+
+        before = self._measure(lookup_before)
+        now = self._measure(lookup_now)
+        call = self._measure(
+            lambda: credential.is_api_success(self.response))
+        _logger.info(
+            'Hook dispatch: hasattr/getattr %.3f us, cached %.3f us per '
+            'lookup, is_api_success call %.3f us',
+            before * 1e6, now * 1e6, call * 1e6)
+        self.assertLess(now, before)
@@ -1,4 +1,5 @@
 from . import (
     test_kw_http_request_log_source,
     test_kw_http_request_log,
+    test_kw_http_request_log_benchmark,
 )
@@ -1,7 +1,20 @@
-from datetime import timedelta
+import json
+from datetime import date, timedelta
+from unittest.mock import MagicMock, patch
+
+from dateutil.relativedelta import relativedelta
+from lxml import etree
 from odoo import registry, fields
 from odoo.tests import TransactionCase
+from odoo.tools import config, sql, SQL
+from odoo.tools.safe_eval import safe_eval
 from odoo.modules.registry import Registry
+from odoo.service import server
+
+from odoo.addons.kw_http_request_log.tools import (
+    get_log_writer, HTTPRequestLogWriter, log_writer, partition, )
+from odoo.addons.kw_http_request_log.tools.log_writer import \
+    register_worker_flush
 
 
 class TestHTTPRequestLog(TransactionCase):
@@ -45,10 +58,12 @@ class TestHTTPRequestLog(TransactionCase):
             self.assertEqual(log.method, 'POST')
             self.assertEqual(
                 log.headers, '{"Content-Type": "application/json"}')
+            self.assertEqual(log.request_body, '{"test": "data"}')
+            self.assertEqual(log.response_body, '{"result": "ok"}')
             self.assertEqual(
-                log.request_body, '{\n  "test": "data"\n}')
+                log.request_body_formatted, '{\n  "test": "data"\n}')
             self.assertEqual(
-                log.response_body, '{\n  "result": "ok"\n}')
+                log.response_body_formatted, '{\n  "result": "ok"\n}')
             self.assertEqual(log.code, '200')
 
     def test_create_log_with_large_body(self):
@@ -74,6 +89,31 @@ class TestHTTPRequestLog(TransactionCase):
             self.assertFalse(log.request_body)
             self.assertFalse(log.response_body)
 
+    def test_create_log_with_compressed_body(self):
+        with Registry(self.env.cr.dbname).cursor() as cr1:
+            env1 = self.env(cr=cr1)
+            env1['kw.http.request.log.source'].browse(
+                self.log_source_id).write({'body_codec': 'gzip'})
+            large_body = 'x' * 11 * 1024  # More than body_text_log_limit
+            log = env1['kw.http.request.log'].create({
+                'name': 'https://test.com',
+                'method': 'POST',
+                'response_body': large_body,
+                'log_source_id': self.log_source_id,
+            })
+            log_id = log.id
+            env1.cr.commit()
+
+        with Registry(self.env.cr.dbname).cursor() as cr1:
+            env1 = self.env(cr=cr1)
+            log = env1['kw.http.request.log'].browse(log_id)
+            self.assertFalse(log.response_body)
+            self.assertEqual(log.response_body_codec, 'gzip')
+            self.assertLess(
+                len(log.with_context(bin_size=False).response_body_file),
+                len(large_body))
+            self.assertEqual(log.response_body_file_text, large_body)
+
     def test_create_in_new_transaction(self):
         log_model = self.env['kw.http.request.log']
         log_id = log_model.create_in_new_transaction({
@@ -108,6 +148,29 @@ class TestHTTPRequestLog(TransactionCase):
             log = env1['kw.http.request.log'].browse(log_id)
             self.assertEqual(log.code, '500')
 
+    def test_write_logs_of_different_sources(self):
+        with Registry(self.env.cr.dbname).cursor() as cr1:
+            env1 = self.env(cr=cr1)
+            log_source_2 = env1['test.log.source'].create({
+                'name': 'Test Source Log 2',
+                'body_text_log_limit': 100,
+            })
+            logs = env1['kw.http.request.log'].create([{
+                'name': 'https://test.com',
+                'log_source_id': source_id,
+            } for source_id in [
+                self.log_source_id,
+                log_source_2.kw_http_request_log_source_id.id]])
+            large_body = 'x' * 11 * 1024
+            logs.write({'response_body': large_body})
+            log_1, log_2 = logs
+            # body limit of each log source is applied
+            self.assertTrue(log_1.response_body_file)
+            self.assertFalse(log_1.response_body)
+            self.assertFalse(log_2.response_body_file)
+            self.assertEqual(log_2.response_body, large_body)
+            cr1.rollback()
+
     def test_compute_log_process_time(self):
         # with registry(self.env.cr.dbname).cursor() as cr1:
         with Registry(self.env.cr.dbname).cursor() as cr1:
@@ -159,6 +222,40 @@ class TestHTTPRequestLog(TransactionCase):
             log = env1['kw.http.request.log'].browse(log_id)
             self.assertFalse(log.exists())
 
+    def test_cron_delete_outdated_logs_with_files(self):
+        with Registry(self.env.cr.dbname).cursor() as cr1:
+            env1 = self.env(cr=cr1)
+            large_body = 'x' * 11 * 1024  # More than body_text_log_limit
+            log = env1['kw.http.request.log'].create({
+                'name': 'https://test.com',
+                'method': 'POST',
+                'request_body': large_body,
+                'response_body': large_body,
+                'log_source_id': self.log_source_id,
+            })
+            log.write({
+                'delete_by_date': fields.Date.today() - timedelta(days=10),
+            })
+            log_id = log.id
+            env1.cr.commit()
+
+        with Registry(self.env.cr.dbname).cursor() as cr1:
+            env1 = self.env(cr=cr1)
+            res = env1['kw.http.request.log'].cron_delete_outdated_logs(
+                batch_size=1)
+            self.assertGreaterEqual(res['rows'], 1)
+            self.assertGreaterEqual(res['bytes'], 2 * 11 * 1024)
+
+        with Registry(self.env.cr.dbname).cursor() as cr1:
+            env1 = self.env(cr=cr1)
+            self.assertFalse(
+                env1['kw.http.request.log'].browse(log_id).exists())
+            self.assertFalse(env1['ir.attachment'].sudo().search([
+                ('res_model', '=', 'kw.http.request.log'),
+                ('res_field', 'in', ['request_body_file',
+                                     'response_body_file']),
+                ('res_id', '=', log_id)]))
+
     def test_format_html_request_body(self):
         """Test HTML formatting in request body"""
         # with registry(self.env.cr.dbname).cursor() as cr1:
@@ -229,3 +326,286 @@ class TestHTTPRequestLog(TransactionCase):
         })
         # Verify that the log was not created
         self.assertFalse(log_id)
+
+    def test_buffered_log_writer(self):
+        with Registry(self.env.cr.dbname).cursor() as cr1:
+            env1 = self.env(cr=cr1)
+            env1['kw.http.request.log.source'].browse(
+                self.log_source_id).write({'is_log_buffered': True})
+            env1.cr.commit()
+
+        log_model = self.env['kw.http.request.log']
+        writer = get_log_writer(self.env.cr.dbname)
+        log_uid = log_model.create_in_new_transaction({
+            'name': 'https://test.com/buffered',
+            'method': 'POST',
+            'log_source_id': self.log_source_id,
+        })
+        # key of the buffered row is returned instead of record id
+        self.assertIsInstance(log_uid, str)
+        # update of a buffered row is merged in memory
+        self.assertTrue(
+            log_model.write_in_new_transaction(log_uid, {'code': '200'}))
+        writer.flush()
+
+        with Registry(self.env.cr.dbname).cursor() as cr1:
+            env1 = self.env(cr=cr1)
+            log = env1['kw.http.request.log'].search([
+                ('log_uid', '=', log_uid)])
+            self.assertEqual(len(log), 1)
+            self.assertEqual(log.name, 'https://test.com/buffered')
+            self.assertEqual(log.code, '200')
+
+        # update of an already flushed row is applied by the next flush
+        log_model.write_in_new_transaction(log_uid, {'code': '500'})
+        writer.flush()
+
+        with Registry(self.env.cr.dbname).cursor() as cr1:
+            env1 = self.env(cr=cr1)
+            log = env1['kw.http.request.log'].search([
+                ('log_uid', '=', log_uid)])
+            self.assertEqual(log.code, '500')
+
+    def test_log_writer_dropped(self):
+        source = self.env['test.log.source'].browse(
+            self.log_source_id).kw_http_request_log_source_id
+        writer = HTTPRequestLogWriter(
+            self.env.cr.dbname, buffer_size=1, block_timeout=0)
+        vals = {'method': 'GET', 'log_source_id': source.id}
+        self.assertTrue(writer.add(dict(vals, name='https://test.com/1')))
+        with self.assertLogs(log_writer.__name__, 'WARNING'):
+            self.assertFalse(writer.add(dict(vals, name='https://test.com/2')))
+            self.assertEqual(writer.flush(), 1)
+        self.assertEqual(writer.dropped, 1)
+        source.invalidate_recordset()
+        self.assertEqual(source.log_dropped_count, 1)
+
+    def test_log_writer_worker_stop(self):
+        writer = get_log_writer(self.env.cr.dbname)
+        source = self.env['test.log.source'].browse(
+            self.log_source_id).kw_http_request_log_source_id
+        log_uid = writer.add({
+            'name': 'https://test.com/worker_stop',
+            'method': 'GET',
+            'log_source_id': source.id,
+        })
+        # the flush is registered for workers of the prefork server only
+        self.addCleanup(setattr, server.Worker, 'stop', server.Worker.stop)
+        register_worker_flush()
+        with patch.object(writer, '_stopped', False):
+            server.Worker.stop(MagicMock())
+        self.assertEqual(len(writer), 1)
+
+        # buffered rows are written when a prefork worker stops
+        with patch.object(server, 'server',
+                          MagicMock(spec=server.PreforkServer)):
+            register_worker_flush()
+        with patch.object(writer, '_stopped', False):
+            server.Worker.stop(MagicMock())
+        self.assertFalse(len(writer))
+        self.assertEqual(self.env['kw.http.request.log'].search_count([
+            ('log_uid', '=', log_uid)]), 1)
+
+    def _get_query_plan(self, domain):
+        query = self.env['kw.http.request.log']._search(domain, limit=80)
+        self.env.cr.execute(SQL(
+            "EXPLAIN (FORMAT JSON) %s", query.select()))
+        return json.dumps(self.env.cr.fetchone()[0])
+
+    def test_search_query_plans(self):
+        # tables of tests are small, make planner prefer indexes
+        self.env.cr.execute("SET LOCAL enable_seqscan = off")
+        cases = [
+            ([('log_source_id', '=', self.log_source_id)],
+             'kw_http_request_log_source_create_date_index'),
+            ([('is_error', '=', True)],
+             'kw_http_request_log_error_index'),
+            ([('create_date', '>=', fields.Datetime.now() - timedelta(
+                days=7))],
+             'kw_http_request_log_create_date_index'),
+            ([('delete_by_date', '<', fields.Date.today())],
+             'kw_http_request_log__delete_by_date_index'),
+        ]
+        if self.env.registry.has_trigram:
+            cases.append((
+                [('name', 'ilike', 'test.com')],
+                'kw_http_request_log__name_index'))
+        for domain, index_name in cases:
+            with self.subTest(domain=domain):
+                self.assertIn(index_name, self._get_query_plan(domain))
+
+    def _patch_partition_settings(self, key='create_date', interval='day'):
+        return patch.dict(config.options, {
+            'kw_http_request_log_partition_key': key,
+            'kw_http_request_log_partition_interval': interval, })
+
+    def test_partition_table(self):
+        cr = self.env.cr
+        table = 'test_kw_http_request_log_partition'
+        today = fields.Date.today()
+        old = today - timedelta(days=40)
+        cr.execute(SQL(
+            "CREATE TABLE %s (id serial PRIMARY KEY, create_date timestamp, "
+            "delete_by_date date)", SQL.identifier(table)))
+        cr.execute(SQL(
+            "INSERT INTO %s (create_date, delete_by_date) "
+            "VALUES (%s, %s), (NULL, NULL)",
+            SQL.identifier(table), old, old))
+
+        partition.partition_table(cr, table, 'create_date', 'month', today)
+
+        self.assertTrue(partition.is_partitioned(cr, table))
+        self.assertEqual(
+            partition.get_partition_key(cr, table), 'create_date')
+        names = [x[0] for x in partition.get_partitions(cr, table)]
+        self.assertIn(f'{table}_default', names)
+        for value in (old, today):
+            self.assertIn(partition.partition_name(
+                table, partition.period_start(value, 'month'), 'month'),
+                names)
+        # rows are copied to partitions of their periods
+        cr.execute(SQL("SELECT COUNT(*), COUNT(create_date) FROM %s",
+                       SQL.identifier(table)))
+        self.assertEqual(cr.fetchone(), (2, 2))
+        cr.execute(SQL("SELECT COUNT(*) FROM %s",
+                       SQL.identifier(f'{table}_default')))
+        self.assertEqual(cr.fetchone()[0], 0)
+        # the id sequence is kept
+        cr.execute(SQL(
+            "INSERT INTO %s (create_date) VALUES (now()) RETURNING id",
+            SQL.identifier(table)))
+        self.assertEqual(cr.fetchone()[0], 3)
+
+    def test_create_partition(self):
+        cr = self.env.cr
+        table = 'test_kw_http_request_log_partition'
+        cr.execute(SQL(
+            "CREATE TABLE %s (id serial, delete_by_date date NOT NULL) "
+            "PARTITION BY RANGE (delete_by_date)", SQL.identifier(table)))
+
+        name = partition.create_partition(cr, table, date(2030, 1, 1), 'day')
+        self.assertEqual(name, f'{table}_p20300101')
+        # existing partition is kept
+        self.assertEqual(partition.create_partition(
+            cr, table, date(2030, 1, 1), 'day'), name)
+        # overlapping partition is not created
+        self.assertFalse(partition.create_partition(
+            cr, table, date(2030, 1, 1), 'month'))
+        partition.create_partitions(
+            cr, table, date(2030, 1, 2), date(2030, 1, 3), 'day')
+        self.assertEqual(partition.get_partitions(cr, table), [
+            (name, date(2030, 1, 1), date(2030, 1, 2)),
+            (f'{table}_p20300102', date(2030, 1, 2), date(2030, 1, 3)),
+            (f'{table}_p20300103', date(2030, 1, 3), date(2030, 1, 4)),
+        ])
+
+    def test_is_error_column(self):
+        log_model = self.env['kw.http.request.log']
+        table = log_model._table
+        logs = log_model.create([{
+            'name': 'https://test.com',
+            'log_source_id': self.log_source_id,
+            'code': code,
+            'error': error,
+        } for code, error in (
+            ('200', False), ('404', False), ('200', 'Error'), (False, ''))])
+        self.env.flush_all()
+        self.env.cr.execute(SQL(
+            "ALTER TABLE %s DROP COLUMN is_error CASCADE",
+            SQL.identifier(table)))
+
+        # the column of existing logs is filled in SQL, not by the ORM
+        log_model._auto_init()
+        self.assertFalse(
+            self.env.records_to_compute(log_model._fields['is_error']))
+        log_model.init()
+        self.env.cr.execute(SQL(
+            "SELECT id, is_error FROM %s WHERE id IN %s ORDER BY id",
+            SQL.identifier(table), tuple(logs.ids)))
+        self.assertEqual(self.env.cr.fetchall(), list(zip(
+            logs.ids, (False, True, True, False))))
+
+    def test_partitioned_log_table(self):
+        log_model = self.env['kw.http.request.log']
+        table = log_model._table
+        field = log_model._fields['create_date']
+        self.addCleanup(setattr, field, 'required', field.required)
+        today = fields.Date.today()
+        old = today - timedelta(days=10)
+        with self._patch_partition_settings():
+            log_model._init_partitions()
+            self.assertTrue(partition.is_partitioned(self.env.cr, table))
+        # the table stays partitioned without the server option, the ORM
+        # keeps NOT NULL of the partition key on module update
+        self.assertEqual(log_model._get_partition_key(), 'create_date')
+        field.required = True
+        # module is updated more than once with the partitioned table
+        for __ in range(2):
+            log_model._auto_init()
+            log_model.init()
+        self.assertTrue(partition.is_partitioned(self.env.cr, table))
+        table_exists = sql.table_exists
+        with partition.existing_table(self.env.cr, table):
+            self.assertTrue(sql.table_exists(self.env.cr, table))
+        self.assertIs(sql.table_exists, table_exists)
+        # indexes of the table are created on each partition
+        self.env.cr.execute(SQL(
+            "SELECT (SELECT COUNT(*) FROM pg_partition_tree(%s::regclass) "
+            "WHERE isleaf), (SELECT COUNT(*) FROM pg_partition_tree("
+            "'kw_http_request_log_create_date_index'::regclass) "
+            "WHERE isleaf)", table))
+        partitions, indexes = self.env.cr.fetchone()
+        self.assertEqual(indexes, partitions)
+
+        with self._patch_partition_settings():
+            old_partition = partition.create_partition(
+                self.env.cr, table, old, 'day')
+            with Registry(self.env.cr.dbname).cursor() as cr1:
+                env1 = self.env(cr=cr1)
+                log = env1['kw.http.request.log'].create({
+                    'name': 'https://test.com',
+                    'log_source_id': self.log_source_id,
+                })
+                log_id = log.id
+                cr1.execute(SQL(
+                    "UPDATE %s SET create_date = %s, delete_by_date = %s "
+                    "WHERE id = %s", SQL.identifier(table), old, old,
+                    log_id))
+                env1.cr.commit()
+
+            with Registry(self.env.cr.dbname).cursor() as cr1:
+                env1 = self.env(cr=cr1)
+                res = env1['kw.http.request.log'].cron_delete_outdated_logs()
+                self.assertGreaterEqual(res['rows'], 1)
+
+        names = [x[0] for x in partition.get_partitions(self.env.cr, table)]
+        self.assertNotIn(old_partition, names)
+        # partitions of coming periods are created in advance
+        self.assertIn(partition.partition_name(
+            table, today + timedelta(days=1), 'day'), names)
+        self.assertFalse(
+            self.env['kw.http.request.log'].browse(log_id).exists())
+
+    def test_default_filter_recent(self):
+        action = self.env.ref(
+            'kw_http_request_log.kw_http_request_log_act_window')
+        self.assertEqual(
+            safe_eval(action.context).get('search_default_filter_recent'), 1)
+        arch = self.env['kw.http.request.log'].get_views(
+            [(False, 'search')])['views']['search']['arch']
+        node = etree.fromstring(arch).find(".//filter[@name='filter_recent']")
+        domain = safe_eval(node.get('domain'), {
+            'context_today': date.today,
+            'relativedelta': relativedelta, })
+
+        log_model = self.env['kw.http.request.log']
+        logs = log_model.create([{
+            'name': 'https://test.com',
+            'log_source_id': self.log_source_id,
+        } for __ in range(2)])
+        self.env.cr.execute(SQL(
+            "UPDATE %s SET create_date = create_date - interval '8 days' "
+            "WHERE id = %s", SQL.identifier(log_model._table), logs[1].id))
+        self.env.invalidate_all()
+        self.assertEqual(
+            log_model.search(domain + [('id', 'in', logs.ids)]), logs[0])
@@ -0,0 +1,47 @@
+import json
+import logging
+import timeit
+
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.kw_http_request_log.models.http_request_log import (
+    HTTPRequestLog, )
+
+_logger = logging.getLogger(__name__)
+
+
+def make_payload(size):
+    """ List of dicts which JSON representation is about size bytes """
+    item = {'id': 1, 'name': 'Product name', 'price': 10.5,
+            'tags': ['a', 'b', 'c'], 'active': True}
+    item_size = len(json.dumps(item)) + 2
+    return [dict(item, id=i) for i in range(max(size // item_size, 1))]
+
+
+@tagged('-standard', 'kw_benchmark')
+class TestHTTPRequestLogBenchmark(TransactionCase):
+
+    def _measure(self, func, value, number):
+        return min(timeit.repeat(
+            lambda: func(value), number=number, repeat=3)) / number
+
+    def test_write_path_formatting(self):
+        """ Compare formatting of bodies on write (before) with storing
+            them as received (now)
+        """
+        for size, number in [(1024, 1000), (100 * 1024, 50),
+                             (5 * 1024 * 1024, 2)]:
+            payload = make_payload(size)
+            body = json.dumps(payload)
+            for label, value in [('str', body), ('dict', payload)]:
+                before = self._measure(
+                    HTTPRequestLog.try_convert2formatted_json, value, number)
+                now = self._measure(
+                    HTTPRequestLog.convert2log_text, value, number)
+                _logger.info(
+                    'Log write path, %s KB %s body: formatted %.3f ms, '
+                    'as received %.3f ms, stored size %s -> %s bytes',
+                    size // 1024, label, before * 1000, now * 1000,
+                    len(HTTPRequestLog.try_convert2formatted_json(value)),
+                    len(HTTPRequestLog.convert2log_text(value)))
+                self.assertLess(now, before)
@@ -1,6 +1,9 @@
 from odoo import registry
+from odoo.exceptions import ValidationError
 from odoo.tests import TransactionCase
 
+from odoo.addons.kw_http_request_log.tools.token_bucket import TokenBucket
+
 
 class TestHttpRequestLog(TransactionCase):
 
@@ -56,3 +59,40 @@ class TestHttpRequestLog(TransactionCase):
             env1 = self.env(cr=cr1)
             log = env1['kw.http.request.log'].browse(log_id)
             self.assertEqual(log.code, '500')
+
+    def test_log_sampling(self):
+        source = self.env['test.log.source'].browse(
+            self.log_source_id).kw_http_request_log_source_id
+        source.log_sample_rate = 0
+        self.assertFalse(source.is_log_sampled())
+        # errors are logged regardless of sampling
+        self.assertTrue(source.is_log_sampled(is_error=True))
+
+        source.write({'log_sample_rate': 1, 'log_rate_limit': 1})
+        self.assertTrue(source.is_log_sampled())
+        self.assertFalse(source.is_log_sampled(is_error=True))
+
+        for rate in (-0.1, 1.5):
+            with self.assertRaises(ValidationError):
+                source.log_sample_rate = rate
+
+    def test_token_bucket_reserve(self):
+        bucket = TokenBucket(1, 2)
+        self.assertEqual(bucket.reserve(2), 2)
+        self.assertFalse(bucket.consume())
+        # the balance goes below zero only within max_wait
+        self.assertIsNone(bucket.reserve(1))
+        available = bucket.reserve(2, max_wait=3)
+        self.assertLess(available, 1)
+        self.assertIsNone(bucket.reserve(2, max_wait=3))
+        self.assertLess(bucket.tokens, -1)
+
+    def test_log_source_settings_cache(self):
+        source = self.env['test.log.source'].browse(
+            self.log_source_id).kw_http_request_log_source_id
+        settings = source.get_log_settings()
+        self.assertIs(source.get_log_settings(), settings)
+
+        source.log_retention_period = 5
+        self.assertEqual(
+            source.get_log_settings()['log_retention_period'], 5)